@@ -1,6 +1,8 @@
 import streamlit as st
 from langchain_core.messages import HumanMessage, AIMessage
-from src.cores.CoT_agent import NutriAgentReseacher
+from src.config import config
+from src.cores.history import new_history_state
+from src.cores.registry import get_registry
 
 # --- 1. CẤU HÌNH TRANG ---
 st.set_page_config(
@@ -58,15 +60,59 @@ def convert_history_to_langchain(streamlit_msgs):
             history.append(AIMessage(content=msg["content"]))
     return history
 
+def render_sources(sources, tier=None):
+    """Hiển thị bậc retrieval + nguồn tài liệu dạng chips."""
+    if tier is not None:
+        tier_labels = {0: "tra cứu bảng dinh dưỡng", 1: "dense search", 2: "multi-query", 3: "multi-query + rerank"}
+        st.caption(f"🔎 Retrieval: {tier_labels.get(tier, tier)}")
+    if not sources:
+        return
+    st.divider()
+    st.caption("📚 Nguồn tài liệu tham khảo:")
+    
+    # Xử lý hiển thị nguồn đẹp mắt
+    unique_sources = {}
+    for doc in sources:
+        src_name = doc.metadata.get('source', 'Tài liệu không tên')
+        # Làm sạch tên file (bỏ đường dẫn dài dòng)
+        short_name = src_name.split("/")[-1].replace(".pdf", "")
+        unique_sources[short_name] = unique_sources.get(short_name, 0) + 1
+    
+    # Hiển thị dạng Chips
+    for name, count in unique_sources.items():
+        # Dùng HTML/CSS nhỏ để hiển thị badge
+        st.markdown(f"""
+        <div style="background-color: #f0fdf4; padding: 5px 10px; border-radius: 20px; border: 1px solid #bbf7d0; font-size: 12px; color: #166534; display: inline-block;">
+            📄 {name} <span style="font-weight: bold;">(x{count} chunks)</span>
+        </div>
+        """, unsafe_allow_html=True)
+
 # --- 4. KHỞI TẠO AGENT (QUẢN LÝ CACHE THÔNG MINH) ---
 @st.cache_resource(show_spinner=False)
-def get_agent(use_reasoning_mode):
+def start_models():
     """
-    Khởi tạo Agent. 
-    Tham số 'use_reasoning_mode' giúp Streamlit biết khi nào cần tạo lại Agent mới.
+    Bắt đầu load model 1 lần cho cả process theo config.WARMUP_MODE.
+    "background": load trên thread nền, trang được render ngay.
     """
-    print(f"🔄 Đang khởi tạo NutriAgent với chế độ Reasoning={use_reasoning_mode}...")
-    return NutriAgentReseacher(use_reasoning=use_reasoning_mode)
+    registry = get_registry()
+    if config.WARMUP_MODE == "background":
+        registry.warm_up()
+    elif config.WARMUP_MODE == "eager":
+        registry.warm_up(background=False)
+    return registry
+
+@st.cache_resource(show_spinner=False)
+def get_agent():
+    """
+    Khởi tạo Agent 1 lần cho cả process, chỉ khi có câu hỏi đầu tiên.
+    Model đang được warm-up -> chờ đúng model còn thiếu, không load lại.
+    Chế độ suy luận được truyền theo từng câu hỏi -> bật/tắt nút gạt không tạo agent / load model mới.
+    """
+    from src.cores.CoT_agent import NutriAgentReseacher
+    print("🔄 Đang khởi tạo NutriAgent...")
+    return NutriAgentReseacher()
+
+registry = start_models()
 
 # --- 5. SIDEBAR ---
 with st.sidebar:
@@ -80,6 +126,7 @@ with st.sidebar:
     # Nút xóa lịch sử
     if st.button("🗑️ Clear Chat", type="primary", use_container_width=True):
         st.session_state.messages = []
+        st.session_state.history_state = new_history_state()
         st.rerun()
     
     st.markdown("""
@@ -93,12 +140,30 @@ with st.sidebar:
     </div>
     """, unsafe_allow_html=True)
 
-# Khởi tạo Agent dựa trên nút gạt
-agent = get_agent(is_reasoning)
+# Trạng thái warm-up + hit-rate cache embedding câu hỏi (dùng chung cho mọi session)
+with st.sidebar:
+    warmup = registry.warmup_status()
+    if warmup["state"] == "warming":
+        st.caption(f"⏳ Đang load model nền: {len(warmup['done'])}/{len(warmup['done']) + len(warmup['pending'])} "
+                   f"(đang chờ: {', '.join(warmup['pending'])})")
+    elif warmup["errors"]:
+        st.caption(f"⚠️ Warm-up lỗi: {', '.join(warmup['errors'])}")
+    if registry.is_loaded("vectordb"):
+        q_stats = registry.vectordb().query_cache_stats()
+        st.caption(f"⚡ Query cache: {q_stats['hit_rate']:.0%} hit ({q_stats['hits']}/{q_stats['hits'] + q_stats['misses']}), {q_stats['size']} câu hỏi")
+    with st.expander("📦 Bộ nhớ model"):
+        for row in registry.memory_report():
+            if row["name"] == "process":
+                st.caption(f"Process RSS: {row['rss_total_mb']} MB")
+            else:
+                st.caption(f"{row['name']}: +{row['rss_delta_mb']} MB RSS, params {row['param_mb']} MB, load {row['load_s']}s")
 
 # Init session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "history_state" not in st.session_state:
+    # Bản tóm tắt các lượt cũ, cập nhật dần (không tóm tắt lại từ đầu mỗi lượt)
+    st.session_state.history_state = new_history_state()
 
 # --- 6. GIAO DIỆN CHÍNH ---
 st.markdown("""
@@ -132,48 +197,45 @@ if prompt := st.chat_input("Ví dụ: 100g ức gà chứa bao nhiêu protein?")
         
         # Chuyển đổi lịch sử chat (Bỏ tin nhắn user vừa nhập để tránh trùng lặp trong history)
         lc_history = convert_history_to_langchain(st.session_state.messages[:-1])
+
+        # Agent dựng ở câu hỏi đầu tiên (chờ các model warm-up còn đang load), các lần sau lấy từ cache
+        with st.spinner("Đang khởi động model..."):
+            agent = get_agent()
         
-        # Container hiển thị trạng thái
-        with st.status("NutriAgent đang nghiên cứu...", expanded=True) as status:
-            st.write("🔍 Đang tìm kiếm trong VectorDB...")
-            # Gọi Agent
-            response = agent.research(prompt, chat_history=lc_history)
-            
-            st.write("Đang tổng hợp câu trả lời...")
-            status.update(label="Đã xong!", state="complete", expanded=False)
-        
-        # --- A. HIỂN THỊ SUY LUẬN (Nếu có) ---
-        thoughts = response.get("model_thoughts", "")
-        if is_reasoning and thoughts:
+        # Thứ tự hiển thị: suy luận -> câu trả lời -> nguồn (nguồn có trước, được điền ngay sau retrieval)
+        status = st.status("NutriAgent đang nghiên cứu...", expanded=False)
+        thoughts_area = None
+        if is_reasoning:
             with st.expander("🤔 Xem quá trình suy luận (Chain-of-Thought)"):
-                st.info(thoughts)
-        
-        # --- B. HIỂN THỊ CÂU TRẢ LỜI ---
-        st.markdown(response["answer"])
-        
-        # --- C. HIỂN THỊ NGUỒN ---
-        sources = response.get("sources", [])
-        if sources:
-            st.divider()
-            st.caption("📚 Nguồn tài liệu tham khảo:")
-            
-            # Xử lý hiển thị nguồn đẹp mắt
-            unique_sources = {}
-            for doc in sources:
-                src_name = doc.metadata.get('source', 'Tài liệu không tên')
-                # Làm sạch tên file (bỏ đường dẫn dài dòng)
-                short_name = src_name.split("/")[-1].replace(".pdf", "")
-                unique_sources[short_name] = unique_sources.get(short_name, 0) + 1
-            
-            # Hiển thị dạng Chips
-            cols = st.columns(len(unique_sources))
-            for idx, (name, count) in enumerate(unique_sources.items()):
-                # Dùng HTML/CSS nhỏ để hiển thị badge
-                st.markdown(f"""
-                <div style="background-color: #f0fdf4; padding: 5px 10px; border-radius: 20px; border: 1px solid #bbf7d0; font-size: 12px; color: #166534; display: inline-block;">
-                    📄 {name} <span style="font-weight: bold;">(x{count} chunks)</span>
-                </div>
-                """, unsafe_allow_html=True)
+                thoughts_area = st.empty()
+        answer_area = st.empty()
+        sources_area = st.container()
+
+        thoughts, answer_text = "", ""
+        response = None
+        for event in agent.research_stream(prompt, chat_history=lc_history,
+                                           history_state=st.session_state.history_state,
+                                           use_reasoning=is_reasoning):
+            if event["type"] == "sources":
+                status.update(label="Đang tổng hợp câu trả lời...")
+                with sources_area:
+                    render_sources(event["sources"], event.get("retrieval_tier"))
+            elif event["type"] == "thinking":
+                thoughts += event["text"]
+                if thoughts_area is not None:
+                    thoughts_area.info(thoughts)
+            elif event["type"] == "answer":
+                answer_text += event["text"]
+                answer_area.markdown(answer_text + "▌")
+            else: # "done" / "error"
+                response = event["result"]
+
+        status.update(label="Đã xong!", state="complete", expanded=False)
+        # Bản cuối đã parse lại toàn bộ output (giống research())
+        thoughts = response.get("model_thoughts", "")
+        if thoughts_area is not None and thoughts:
+            thoughts_area.info(thoughts)
+        answer_area.markdown(response["answer"])
 
     # 3. Lưu lại vào Session State (Kèm cả phần suy luận để render lại nếu f5)
     st.session_state.messages.append({
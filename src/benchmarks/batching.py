@@ -0,0 +1,120 @@
+"""
+Kiểm tra + benchmark micro-batching giữa các request (BatchedEmbeddings, BatchedCrossEncoder).
+
+Chạy:  python -m src.benchmarks.batching [n_threads] [overhead_ms] [per_item_ms]
+- Không cần model thật: model giả tốn overhead_ms mỗi lần gọi + per_item_ms mỗi phần tử và chỉ chạy
+  1 lời gọi tại 1 thời điểm (giống model torch đã dùng hết core cho 1 lô).
+- n_threads request đồng thời, mỗi request embed 1 câu hỏi + chấm 10 cặp rerank:
+  so sánh gọi thẳng model với gọi qua micro-batcher.
+- Kiểm tra mọi request nhận đúng kết quả của mình, số lần gọi model giảm và bản micro-batch nhanh hơn;
+  1 request đứng 1 mình không phải chờ gom MICRO_BATCH_WAIT_MS.
+  Mức tăng tốc phụ thuộc tỉ lệ overhead / chi phí mỗi phần tử của model.
+"""
+import sys
+import threading
+import time
+from typing import List, Tuple
+from langchain_core.embeddings import Embeddings
+# Internal Import
+from src.config import config
+from src.cores.reranker import BatchedCrossEncoder
+from src.utils.batching import track_request
+from src.vectordb.embedding_cache import BatchedEmbeddings
+
+PAIRS_PER_REQUEST = 10
+
+
+class FakeModel:
+    """Chi phí mỗi lần gọi = overhead + per_item * số phần tử, các lời gọi bị tuần tự hoá."""
+    def __init__(self, overhead_ms: float, per_item_ms: float):
+        self.overhead = overhead_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _cost(self, n: int):
+        with self._lock:
+            self.calls += 1
+            time.sleep(self.overhead + self.per_item * n)
+
+
+class FakeEmbeddings(Embeddings, FakeModel):
+    def __init__(self, overhead_ms: float, per_item_ms: float):
+        FakeModel.__init__(self, overhead_ms, per_item_ms)
+        self.query_encode_kwargs = {} # encode query giống document -> embed_queries gộp được lô
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._cost(len(texts))
+        return [[float(len(text)), float(sum(map(ord, text)))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class FakeCrossEncoder(FakeModel):
+    def score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        self._cost(len(pairs))
+        return [float(len(query) * 1000 + len(doc)) for query, doc in pairs]
+
+
+def run(n_threads: int, embeddings, cross_encoder) -> Tuple[float, dict]:
+    results = {}
+
+    def request(i: int):
+        query = f"câu hỏi {i}"
+        pairs = [(query, "x" * j) for j in range(PAIRS_PER_REQUEST)]
+        # Như 1 request /research của server: batcher biết còn request khác đang chạy để chờ gom
+        with track_request():
+            results[i] = (embeddings.embed_query(query), cross_encoder.score(pairs))
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(n_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, results
+
+
+if __name__ == "__main__":
+    n_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    overhead_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 15.0
+    per_item_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    print(f"{n_threads} request đồng thời, model giả {overhead_ms}ms/lần gọi + {per_item_ms}ms/phần tử, "
+          f"chờ gom {config.MICRO_BATCH_WAIT_MS}ms")
+
+    direct_emb, direct_ce = FakeEmbeddings(overhead_ms, per_item_ms), FakeCrossEncoder(overhead_ms, per_item_ms)
+    t_direct, expected = run(n_threads, direct_emb, direct_ce)
+
+    base_emb, base_ce = FakeEmbeddings(overhead_ms, per_item_ms), FakeCrossEncoder(overhead_ms, per_item_ms)
+    batched_emb, batched_ce = BatchedEmbeddings(base_emb, name="bench_queries"), BatchedCrossEncoder(base_ce, name="bench_pairs")
+    t_batched, got = run(n_threads, batched_emb, batched_ce)
+
+    if got != expected:
+        raise SystemExit("FAIL: kết quả micro-batch khác kết quả gọi thẳng model")
+    print(f"gọi thẳng model:  {t_direct:6.2f}s  ({n_threads / t_direct:6.1f} req/s), "
+          f"{direct_emb.calls} lần embed + {direct_ce.calls} lần rerank")
+    print(f"micro-batch:      {t_batched:6.2f}s  ({n_threads / t_batched:6.1f} req/s), "
+          f"{base_emb.calls} lần embed + {base_ce.calls} lần rerank")
+    for name, batcher in (("embed", batched_emb.batcher), ("rerank", batched_ce.batcher)):
+        stats = batcher.stats()
+        print(f"  {name}: {stats['batches']} lô, trung bình {stats['avg_batch_items']:.1f} phần tử/lô, "
+              f"chờ gom trung bình {stats['avg_wait_ms']:.1f}ms")
+    # Batching chỉ khấu hao được overhead mỗi lần gọi, phần chi phí theo phần tử vẫn giữ nguyên
+    n_items = n_threads * (1 + PAIRS_PER_REQUEST)
+    floor = (n_items * per_item_ms + 2 * overhead_ms) / 1000
+    print(f"Tăng tốc: x{t_direct / t_batched:.1f} (lý thuyết tối đa x{t_direct / floor:.1f}, khi gom hết vào 1 lô)")
+    if n_threads > 1 and base_emb.calls + base_ce.calls >= (direct_emb.calls + direct_ce.calls) / 2:
+        raise SystemExit("FAIL: micro-batching không gom được request")
+    if n_threads > 1 and t_batched >= 0.8 * t_direct:
+        raise SystemExit("FAIL: micro-batching không nhanh hơn gọi thẳng model")
+    # 1 request đứng 1 mình: chạy ngay, không chờ gom
+    lone_emb, lone_ce = BatchedEmbeddings(FakeEmbeddings(0, 0), name="bench_lone_queries"), \
+        BatchedCrossEncoder(FakeCrossEncoder(0, 0), name="bench_lone_pairs")
+    for _ in range(20):
+        run(1, lone_emb, lone_ce)
+    lone_wait = max(b.stats()["avg_wait_ms"] for b in (lone_emb.batcher, lone_ce.batcher))
+    print(f"1 request đứng 1 mình: chờ gom trung bình {lone_wait:.2f}ms")
+    if config.MICRO_BATCH_WAIT_MS > 0 and lone_wait >= config.MICRO_BATCH_WAIT_MS / 2:
+        raise SystemExit("FAIL: request đứng 1 mình vẫn phải chờ gom")
+    print("OK")
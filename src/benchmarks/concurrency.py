@@ -0,0 +1,189 @@
+"""
+Kiểm tra + benchmark API async của agent (NutriAgentReseacher.aresearch) với LLM giả có độ trễ.
+
+Chạy:  python -m src.benchmarks.concurrency [n_requests] [llm_latency_s] [model_ms]
+- Không cần Groq / Qdrant / model thật: LLM giả ngủ llm_latency_s mỗi lần gọi (giống chờ mạng);
+  embedder + cross-encoder giả bận model_ms mỗi lần gọi (giống model torch trên CPU).
+- Retriever thật: AdaptiveRetriever -> BatchedMultiQueryRetriever -> CachedCrossEncoderReranker
+  trên 1 mmap index nhỏ (VectorDB chế độ mmap). Ngưỡng tier 1 / tier 2 đặt để mọi câu hỏi đi hết
+  3 bậc: dense search, multi-query (1 lần gọi LLM + batch search), rerank.
+- So sánh n_requests câu hỏi gọi research() tuần tự với asyncio.gather(aresearch(...)) trên cùng 1 agent.
+- Kiểm tra mọi request đều nhận đúng câu trả lời của mình và bản async nhanh hơn rõ rệt.
+"""
+import asyncio
+import hashlib
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, List, Tuple
+import numpy as np
+from langchain_core.documents import Document as LangChainDocument
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+# Internal Import
+from src.config import config
+from src.cores.CoT_agent import NutriAgentReseacher
+from src.cores.history import ChatHistoryManager
+from src.cores.reranker import CachedCrossEncoderReranker
+from src.cores.multi_query import BatchedMultiQueryRetriever
+from src.cores.retrievers import AdaptiveRetriever
+from src.vectordb.mmap_index import MmapVectorStore
+from src.vectordb.qdrantdb import VectorDB
+
+DIM = 64
+WORDS = ["protein", "vitamin", "chất xơ", "năng lượng", "canxi", "sắt", "ức gà", "gạo", "cá", "rau",
+         "absorption", "metabolism", "intake", "lipid", "glucid", "trẻ em", "người lớn", "bữa sáng"]
+
+
+class SlowFakeChatModel(FakeListChatModel):
+    """LLM giả: trả lời lại câu hỏi cuối cùng sau `latency` giây (sync: time.sleep, async: asyncio.sleep)."""
+    latency: float = 0.5
+
+    @staticmethod
+    def _reply(messages) -> str:
+        return f"<thinking>ok</thinking><answer>{messages[-1].content}</answer>"
+
+    def _call(self, messages, *args: Any, **kwargs: Any) -> str:
+        time.sleep(self.latency)
+        return self._reply(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+
+class BusyModel:
+    """Model giả bận `busy_ms` mỗi lần gọi, các lời gọi bị tuần tự hoá (như 1 model torch dùng hết core)."""
+    def __init__(self, busy_ms: float):
+        self.busy = busy_ms / 1000
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _work(self):
+        with self._lock:
+            self.calls += 1
+            time.sleep(self.busy)
+
+
+class FakeEmbeddings(Embeddings, BusyModel):
+    """Bag-of-words băm vào DIM chiều: câu hỏi chung từ với chunk thì cosine cao."""
+    def __init__(self, busy_ms: float):
+        BusyModel.__init__(self, busy_ms)
+
+    @staticmethod
+    def _vector(text: str) -> List[float]:
+        vector = np.zeros(DIM, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % DIM] += 1.0
+        return (vector + 1e-3).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._work()
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+
+class FakeCrossEncoder(BusyModel):
+    def score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        self._work()
+        return [len(set(query.split()) & set(doc.split())) / 10 for query, doc in pairs]
+
+
+class BenchVectorDB(VectorDB):
+    """VectorDB chế độ mmap trên thư mục tạm, không load model / không đọc config đường dẫn index."""
+    sparse_index = None
+
+    def __init__(self, path: str, embeddings: Embeddings, n_docs: int = 300, seed: int = 42):
+        self.db_type = "mmap"
+        self.collection_name = "bench"
+        self.client_config = {"path": path}
+        self.embeddings = self.query_embeddings = embeddings
+        self._sparse_index = None
+        self._async_client = None
+        rng = np.random.default_rng(seed)
+        docs = [
+            LangChainDocument(page_content=" ".join(rng.choice(WORDS, size=12)),
+                              metadata={"chunk_id": f"c{i}", "source": config.SOURCE_TEXTBOOK, "page": i})
+            for i in range(n_docs)
+        ]
+        self.db = MmapVectorStore(path, embeddings, recreate=True)
+        self.db.upsert([doc.metadata["chunk_id"] for doc in docs], docs,
+                       [FakeEmbeddings._vector(doc.page_content) for doc in docs])
+
+
+def build_agent(llm_latency: float, model_ms: float):
+    """Agent thật (prompt, chain, parse output, retriever) nhưng LLM + model giả, không answer cache / fast path."""
+    embeddings, cross_encoder = FakeEmbeddings(model_ms), FakeCrossEncoder(model_ms)
+    agent = NutriAgentReseacher.__new__(NutriAgentReseacher)
+    agent.use_reasoning = True
+    agent.llm = SlowFakeChatModel(responses=[""], latency=llm_latency)
+    agent.history = ChatHistoryManager.from_config(agent.llm)
+    agent.nutrient_store = None
+    agent.answer_cache = None
+    vectordb = BenchVectorDB(tempfile.mkdtemp(prefix="bench_mmap_"), embeddings)
+    agent.advanced_retriever = AdaptiveRetriever(
+        vectordb=vectordb,
+        multi_query=BatchedMultiQueryRetriever.from_vectordb(vectordb, agent.llm, k=config.RETRIEVAL_K),
+        reranker=CachedCrossEncoderReranker(model=cross_encoder, top_n=config.RERANK_TOP_N),
+        top_n=config.RERANK_TOP_N,
+        # Không bao giờ đủ tin ở tier 1 / tier 2 -> đo đường dài nhất
+        tier1_min_score=2.0,
+        tier2_min_consensus=2.0,
+    )
+    agent._create_conversational_chain()
+    return agent, embeddings, cross_encoder
+
+
+def check(results, questions):
+    wrong = [q for q, r in zip(questions, results) if r["answer"] != q]
+    if wrong:
+        raise SystemExit(f"FAIL: {len(wrong)} request nhận sai câu trả lời, vd. {wrong[0]!r}")
+
+
+async def run_async(agent, questions):
+    return await asyncio.gather(*(agent.aresearch(q) for q in questions))
+
+
+if __name__ == "__main__":
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    llm_latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    model_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    questions = [f"câu hỏi số {i} về {WORDS[i % len(WORDS)]} và {WORDS[(3 * i) % len(WORDS)]}" for i in range(n_requests)]
+    agent, embeddings, cross_encoder = build_agent(llm_latency, model_ms)
+    print(f"{n_requests} request, LLM giả {llm_latency}s/lần gọi, model giả {model_ms}ms/lần gọi, "
+          f"CPU_WORKERS={config.CPU_WORKERS}")
+
+    start = time.perf_counter()
+    sequential = [agent.research(q) for q in questions]
+    t_seq = time.perf_counter() - start
+    check(sequential, questions)
+    model_calls = (embeddings.calls + cross_encoder.calls) / n_requests
+    embeddings.calls = cross_encoder.calls = 0
+
+    start = time.perf_counter()
+    concurrent = asyncio.run(run_async(agent, questions))
+    t_async = time.perf_counter() - start
+    check(concurrent, questions)
+    # Lượt 2 trúng một phần cache embedding / điểm rerank của lượt 1 -> đếm lại số lần gọi model thật
+    async_calls = embeddings.calls + cross_encoder.calls
+    tiers = {r["retrieval_tier"] for r in sequential + list(concurrent)}
+    if tiers != {3}:
+        raise SystemExit(f"FAIL: retrieval không đi hết 3 bậc (tier {tiers})")
+
+    # Giới hạn dưới của bản async: 2 lần chờ LLM (multi-query + trả lời) + phần model bị tuần tự hoá
+    floor = 2 * llm_latency + async_calls * model_ms / 1000
+    print(f"research() tuần tự:        {t_seq:7.2f}s  ({n_requests / t_seq:6.1f} req/s), "
+          f"{model_calls:.1f} lần gọi model / request")
+    print(f"aresearch() đồng thời:     {t_async:7.2f}s  ({n_requests / t_async:6.1f} req/s), lý thuyết >= {floor:.2f}s")
+    print(f"Tăng tốc: x{t_seq / t_async:.1f}")
+    if n_requests > 1 and t_async >= t_seq / 2:
+        raise SystemExit("FAIL: aresearch() không chạy đồng thời các request")
+    print("OK")
@@ -0,0 +1,79 @@
+"""
+Benchmark throughput embedding lúc ingestion (src/vectordb/parallel_encoder.py).
+
+Chạy:  python -m src.benchmarks.embedding [n_chunks] [max_workers]
+- Corpus: chunk thật từ cache_parse nếu đã có (chạy pipeline trước), không thì sinh ngẫu nhiên.
+- In chunks/sec của HuggingFaceEmbeddings trong process và ParallelEncoder với 1..N workers.
+- Thời gian khởi động pool / load model không tính vào throughput (warm-up trước khi đo).
+"""
+import os
+import random
+import sys
+import time
+# Internal Import
+from src.config import config
+from src.processing.ingestion import ProcessDocuments, TextSplitter
+from src.processing.page_cache import ParseCache
+from src.vectordb.parallel_encoder import ParallelEncoder
+
+
+def load_corpus(n_chunks: int, seed: int = 42):
+    processor = ProcessDocuments()
+    if os.path.exists(config.PATH_TEXTBOOK_EN) and ParseCache(
+        processor.cache_dir, processor._cache_name("textbook_en_parsed"), config.PATH_TEXTBOOK_EN
+    ).raw_store().exists():
+        pages = []
+        for page in processor.iter_english_textbook():
+            pages.append(page)
+            if len(pages) >= n_chunks:
+                break
+        texts = [chunk.page_content for chunk in TextSplitter().split(pages)][:n_chunks]
+        if texts:
+            return texts, "cache_parse"
+
+    # Không có dữ liệu thật -> text ngẫu nhiên, độ dài lệch nhau như chunk thật
+    rng = random.Random(seed)
+    words = ["protein", "vitamin", "chất xơ", "năng lượng", "glucid", "lipid", "canxi", "sắt",
+             "absorption", "metabolism", "dietary", "intake", "gạo", "thịt", "cá", "rau"]
+    texts = [
+        " ".join(rng.choice(words) for _ in range(rng.randint(10, config.CHUNK_SIZE // 5)))
+        for _ in range(n_chunks)
+    ]
+    return texts, "synthetic"
+
+
+def bench_in_process(texts) -> float:
+    from langchain_huggingface import HuggingFaceEmbeddings
+    model = HuggingFaceEmbeddings(model_name=config.EMBEDDING_MODEL)
+    model.embed_documents(texts[:8]) # warm-up
+    start = time.perf_counter()
+    model.embed_documents(texts)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def bench_parallel(texts, workers: int) -> float:
+    encoder = ParallelEncoder(workers=workers)
+    try:
+        # Warm-up: mỗi worker load model xong mới bắt đầu đo
+        encoder.embed_documents(texts[:workers * encoder.batch_size])
+        start = time.perf_counter()
+        for _ in encoder.iter_encode(texts):
+            pass
+        return len(texts) / (time.perf_counter() - start)
+    finally:
+        encoder.close()
+
+
+if __name__ == "__main__":
+    n_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+
+    texts, origin = load_corpus(n_chunks)
+    print(f"Corpus: {len(texts)} chunks ({origin}), model {config.EMBEDDING_MODEL}, "
+          f"batch={config.EMBED_BATCH_SIZE}, {os.cpu_count()} CPU")
+
+    baseline = bench_in_process(texts)
+    print(f"in-process (HuggingFaceEmbeddings): {baseline:8.1f} chunks/s")
+    for workers in range(1, max_workers + 1):
+        rate = bench_parallel(texts, workers)
+        print(f"parallel, {workers:2d} workers:            {rate:8.1f} chunks/s  (x{rate / baseline:.2f})")
@@ -0,0 +1,148 @@
+"""
+Golden check + microbenchmark cho engine TCVN3 -> Unicode (src/utils/helpers.py).
+
+Chạy:  python -m src.benchmarks.encoding
+- So sánh fix_encoding / fix_encoding_batch với bản cài đặt cũ (vòng lặp str.replace)
+  trên một corpus sinh ngẫu nhiên (seed cố định) -> phải giống hệt từng ký tự.
+- Đo thời gian xử lý 1 lô trang giả lập của bản cũ và bản mới (lấy lần nhanh nhất của 30 lần chạy).
+  Mức tăng tốc dao động theo máy / lần chạy (đo được khoảng x1.2 - x1.8), không nên coi là 1 con số cố định.
+"""
+import random
+import re
+import time
+import unicodedata
+# Internal Import
+from src.utils.helpers import fix_encoding, fix_encoding_batch, TCVN3_TO_UNICODE
+
+# ===== Bản cài đặt cũ (giữ nguyên để làm golden reference) =====
+# noqa: dict literal cũ có khoá trùng, giữ nguyên đúng như bản gốc
+LEGACY_TCVN3_TO_UNICODE = {
+    # --- Nguyên âm thường ---
+    'µ': 'à', '¸': 'á', '¶': 'ả', '·': 'ã', '¹': 'ạ',
+    '¨': 'ă', '¾': 'ắ', '»': 'ằ', '¼': 'ẳ', '½': 'ẵ', 'Æ': 'ặ',
+    '©': 'â', 'Ê': 'ấ', 'Ç': 'ầ', 'Ë': 'ẩ', 'É': 'ẫ', 'È': 'ậ',
+    '®': 'đ',
+    'Ð': 'é', 'Ì': 'ẻ', 'Î': 'ẽ', 'Ï': 'ẹ',
+    'ª': 'ê', 'Õ': 'ế', 'Ò': 'ề', 'Ó': 'ể', 'Ô': 'ễ', 'Ö': 'ệ',
+    '×': 'ì', 'Ý': 'í', 'Ø': 'ỉ', 'Ü': 'ĩ', 'Þ': 'ị',
+    'ß': 'ò', 'ã': 'ó', 'á': 'ỏ', 'â': 'õ', 'ä': 'ọ',
+    '«': 'ô', 'è': 'ộ', 'å': 'ồ', 'æ': 'ố', 'ç': 'ổ', 'é': 'ỗ',
+    '¬': 'ư', 'ú': 'ử', 'ù': 'ứ', 'û': 'ữ', 'ü': 'ự', '÷': 'ư', # Có nhiều biến thể của ư
+    'ê': 'ơ', 'í': 'ớ', 'ë': 'ờ', 'ì': 'ở', 'î': 'ỡ', 'ï': 'ợ',
+    'ó': 'ù', 'ò': 'ú', 'ô': 'ủ', 'õ': 'ũ', 'ö': 'ụ',
+    'ý': 'ỳ', 'þ': 'ỵ', 'ø': 'ừ', '÷': 'ự', 'û': 'ỷ', 'ü': 'ỹ',
+    
+    # --- Nguyên âm HOA (Thường bị thiếu trong bảng cũ) ---
+    'µ': 'À', '¸': 'Á', '¶': 'Ả', '·': 'Ã', '¹': 'Ạ',
+    '¡': 'Ă', '¾': 'Ắ', '»': 'Ằ', '¼': 'Ẳ', '½': 'Ẵ', 'Æ': 'Ặ',
+    '¢': 'Â', 'Ê': 'Ấ', 'Ç': 'Ầ', 'Ë': 'Ẩ', 'É': 'Ẫ', 'È': 'Ậ',
+    '§': 'Đ',
+    '£': 'Ê', 'Õ': 'Ế', 'Ò': 'Ề', 'Ó': 'Ể', 'Ô': 'Ễ', 'Ö': 'Ệ',
+    '¤': 'Ô', 'è': 'Ộ', 'å': 'Ồ', 'æ': 'Ố', 'ç': 'Ổ', 'é': 'Ỗ',
+    '¥': 'Ơ', 'í': 'Ớ', 'ë': 'Ờ', 'ì': 'Ở', 'î': 'Ỡ', 'ï': 'Ợ',
+    '¦': 'Ư', 'ú': 'Ử', 'ù': 'Ứ', 'û': 'Ữ', 'ü': 'Ự', 'ø': 'Ừ',
+    
+    # --- Ký tự lỗi PDF đặc thù (Do font map sai) ---
+    '3/4': 'ư', 
+    '1/4': 'ở',
+    '1/2': 'ả',
+    '–': '', # Gạch nối dài thường gây lỗi
+}
+
+
+def legacy_clean_broken_layout(text: str) -> str:
+    if not text: return ""
+    text = re.sub(r'(?<=[a-zA-Zà-ỹÀ-Ỹ])\n(?=[a-zA-Zà-ỹÀ-Ỹ])', '', text)
+    text = re.sub(r'-{3,}', ' ', text)
+    return text
+
+def legacy_fix_encoding(text: str) -> str:
+    if not text: return ""
+    text = legacy_clean_broken_layout(text)
+    text = text.replace("µg", "##MICRO_GRAM##")
+    text = text.replace("mg", "##MILLI_GRAM##")
+    for tcvn_char, unicode_char in LEGACY_TCVN3_TO_UNICODE.items():
+        if tcvn_char in text:
+            text = text.replace(tcvn_char, unicode_char)
+    text = text.replace("##MICRO_GRAM##", "µg")
+    text = text.replace("##MILLI_GRAM##", "mg")
+    text = unicodedata.normalize('NFC', text)
+    text = text.replace("B,nh", "Bánh")
+    text = text.replace("m,y", "mây")
+    text = text.replace("l,t", "lứt")
+    text = text.replace("tî", "tẻ")
+    return text.strip()
+
+
+# ===== Corpus =====
+_TCVN3_CHARS = [k for k in LEGACY_TCVN3_TO_UNICODE if len(k) == 1]
+_TOKENS = ["µg", "mg", "3/4", "1/4", "1/2", "–", "---", "B,nh", "m,y", "l,t", "tî", "i\u0302", "100g", "|"]
+
+def _word(rng) -> str:
+    # Từ bị lỗi font: chữ ASCII xen mã TCVN3 (~1/3 số từ), thỉnh thoảng là token đặc biệt
+    roll = rng.random()
+    if roll < 0.003:
+        return rng.choice(_TOKENS)
+    letters = [rng.choice("abcdeghiklmnopqrstuvxy") for _ in range(rng.randint(1, 6))]
+    if roll < 0.4:
+        letters[rng.randrange(len(letters))] = rng.choice(_TCVN3_CHARS)
+    return "".join(letters)
+
+def build_corpus(n_pages: int = 200, page_len: int = 2000, seed: int = 42):
+    """Trang giả lập kiểu bảng TPTP bị lỗi font (seed cố định -> tái lập được)."""
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(n_pages):
+        parts, size = [], 0
+        while size < page_len:
+            part = _word(rng) + (" " if rng.random() < 0.9 else "\n")
+            parts.append(part)
+            size += len(part)
+        pages.append("".join(parts))
+    # Ca biên
+    pages.extend(["", "   ", "µg mg vµng", "3/4 1/4 1/2 –", "3–/4", "M\na\ng\ni\nª", "\x00µ"])
+    return pages
+
+
+def check_golden(pages) -> int:
+    """So khớp từng trang với bản cũ. Trả về số trang lệch (0 = đạt)."""
+    mismatches = 0
+    for i, page in enumerate(pages):
+        expected = legacy_fix_encoding(page)
+        if fix_encoding(page) != expected:
+            mismatches += 1
+            print(f"[MISMATCH] fix_encoding trang {i}")
+    batch = fix_encoding_batch(pages)
+    for i, page in enumerate(pages):
+        if batch[i] != legacy_fix_encoding(page):
+            mismatches += 1
+            print(f"[MISMATCH] fix_encoding_batch trang {i}")
+    return mismatches
+
+
+def bench(fn, pages, repeat: int = 30) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(pages)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    assert TCVN3_TO_UNICODE == LEGACY_TCVN3_TO_UNICODE, "Bảng mã hiệu lực khác bản cũ"
+    assert list(TCVN3_TO_UNICODE) == list(LEGACY_TCVN3_TO_UNICODE), "Thứ tự khoá khác bản cũ"
+
+    pages = build_corpus()
+    mismatches = check_golden(pages)
+    print(f"Golden check: {'OK' if not mismatches else f'{mismatches} lệch'} ({len(pages)} trang)")
+
+    t_legacy = bench(lambda ps: [legacy_fix_encoding(p) for p in ps], pages)
+    t_single = bench(lambda ps: [fix_encoding(p) for p in ps], pages)
+    t_batch = bench(fix_encoding_batch, pages)
+    total_chars = sum(len(p) for p in pages)
+    print(f"Corpus: {len(pages)} trang, {total_chars} ký tự")
+    print(f"legacy (str.replace loop): {t_legacy * 1000:8.2f} ms")
+    print(f"fix_encoding (compiled):   {t_single * 1000:8.2f} ms  (x{t_legacy / t_single:.1f})")
+    print(f"fix_encoding_batch:        {t_batch * 1000:8.2f} ms  (x{t_legacy / t_batch:.1f})")
+    raise SystemExit(1 if mismatches else 0)
@@ -0,0 +1,78 @@
+"""
+Golden check + benchmark cho fast path bảng dinh dưỡng (NutrientStore.lookup).
+
+Chạy:  python -m src.benchmarks.nutrient_lookup [repeat]
+- Bảng nhỏ dựng sẵn có các cặp tên trùng nhau khi bỏ dấu với từ thường trong câu hỏi
+  (cá chứa / Cà chua, của / Cua): mỗi câu hỏi phải khớp đúng thực phẩm, hoặc None
+  (không đoán -> đi qua retrieval bình thường) khi câu hỏi có 2 cách đọc.
+- Đo thời gian trung bình 1 lần lookup trên bảng đó.
+"""
+import sys
+import time
+import numpy as np
+# Internal Import
+from src.processing.nutrient_store import NutrientStore
+
+FOODS = [
+    ("1001", "Cà chua", 0.6, 1.4),
+    ("1002", "Cá chép", 16.0, 0.9),
+    ("1003", "Cua", 12.3, 4.7),
+    ("1004", "Cua đồng", 12.3, 4.7),
+    ("1005", "Ức gà", 23.1, 0.7),
+    ("1006", "Gạo tẻ", 7.9, 1.3),
+    ("1007", "Cá", 17.5, 1.0),
+]
+
+# (câu hỏi, tên thực phẩm mong đợi hoặc None)
+GOLDEN = [
+    ("100g cá chứa bao nhiêu protein?", None),
+    ("100g cà chua chứa bao nhiêu protein?", "Cà chua"),
+    ("100g ca chua chua bao nhieu protein", "Cà chua"),
+    ("Hàm lượng protein của cua đồng là bao nhiêu?", "Cua đồng"),
+    ("Lượng sắt của cua là bao nhiêu?", "Cua"),
+    ("Hàm lượng protein của ức gà là bao nhiêu?", "Ức gà"),
+    ("100g cá chép có bao nhiêu protein", "Cá chép"),
+    ("gạo tẻ chứa bao nhiêu sắt", "Gạo tẻ"),
+    ("Mã 1006 có bao nhiêu protein?", "Gạo tẻ"),
+    ("Ăn cà chua có giúp giảm béo không?", None),
+]
+
+
+def build_store() -> NutrientStore:
+    return NutrientStore(
+        codes=np.array([f[0] for f in FOODS], dtype=str),
+        names=np.array([f[1] for f in FOODS], dtype=str),
+        pages=np.arange(len(FOODS), dtype=np.int32),
+        columns={
+            "protein": np.array([f[2] for f in FOODS], dtype=np.float32),
+            "iron": np.array([f[3] for f in FOODS], dtype=np.float32),
+        },
+        units={"protein": "g", "iron": "mg"},
+    )
+
+
+def check_golden(store: NutrientStore) -> int:
+    """Số câu hỏi khớp sai (0 = đạt)."""
+    mismatches = 0
+    for query, expected in GOLDEN:
+        match = store.lookup(query)
+        got = match["name"] if match else None
+        if got != expected:
+            mismatches += 1
+            print(f"[MISMATCH] {query!r}: mong đợi {expected!r}, nhận {got!r}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    store = build_store()
+    mismatches = check_golden(store)
+    print(f"Golden check: {'OK' if not mismatches else f'{mismatches} lệch'} ({len(GOLDEN)} câu hỏi)")
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query, _ in GOLDEN:
+            store.lookup(query)
+    elapsed = time.perf_counter() - start
+    print(f"lookup: {1e6 * elapsed / (repeat * len(GOLDEN)):.1f} µs / câu hỏi ({len(store)} thực phẩm)")
+    raise SystemExit(1 if mismatches else 0)
@@ -0,0 +1,91 @@
+"""
+Benchmark bước rerank trên CPU (src/cores/reranker.py).
+
+Chạy:  python -m src.benchmarks.rerank [n_queries] [n_candidates]
+- pairs/sec của cross-encoder (config.RERANKER_MODEL) theo từng kích thước lô cố định
+  so với gom lô động theo số ký tự.
+- Latency end-to-end 1 lần rerank (n_candidates chunk -> top_n):
+  CrossEncoderReranker gốc, bản cache lần đầu (cold), lặp lại câu hỏi (warm), và có early exit.
+- Early exit là heuristic: in tỉ lệ chunk top_n trùng với khi chấm hết.
+"""
+import random
+import statistics
+import sys
+import time
+from langchain_core.documents import Document as LangChainDocument
+# Internal Import
+from src.config import config
+from src.cores.reranker import CachedCrossEncoderReranker
+from src.utils.lru import TTLCache
+
+WORDS = ["protein", "vitamin", "chất xơ", "năng lượng", "glucid", "lipid", "canxi", "sắt", "ức gà",
+         "absorption", "metabolism", "dietary", "intake", "gạo", "thịt bò", "cá", "rau muống", "| 1001 |"]
+
+
+def build_data(n_queries: int, n_candidates: int, seed: int = 42):
+    rng = random.Random(seed)
+    queries = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))) for _ in range(n_queries)]
+    docs = [
+        LangChainDocument(
+            page_content=" ".join(rng.choice(WORDS) for _ in range(rng.randint(20, config.CHUNK_SIZE // 3))),
+            metadata={"chunk_id": f"c{i}"},
+        )
+        for i in range(n_candidates * 3)
+    ]
+    candidates = [rng.sample(docs, n_candidates) for _ in queries]
+    return queries, candidates
+
+
+def pairs_per_sec(model, pairs, batch_size: int = None, reranker: CachedCrossEncoderReranker = None) -> float:
+    start = time.perf_counter()
+    if reranker is not None:
+        reranker.score_pairs(pairs)
+    else:
+        for i in range(0, len(pairs), batch_size):
+            model.score(pairs[i:i + batch_size])
+    return len(pairs) / (time.perf_counter() - start)
+
+
+def latency_ms(fn, queries, candidates) -> float:
+    times = []
+    for query, docs in zip(queries, candidates):
+        start = time.perf_counter()
+        fn(docs, query)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    from langchain_classic.retrievers.document_compressors import CrossEncoderReranker
+    from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+
+    n_queries = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_candidates = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    queries, candidates = build_data(n_queries, n_candidates)
+
+    print(f"Model {config.RERANKER_MODEL}, {n_queries} câu hỏi x {n_candidates} candidates, "
+          f"top_n={config.RERANK_TOP_N}, max_chars={config.RERANK_MAX_CHARS}")
+    model = HuggingFaceCrossEncoder(model_name=config.RERANKER_MODEL)
+    model.score([("warm", "up")])
+
+    pairs = [(q, d.page_content[:config.RERANK_MAX_CHARS]) for q, docs in zip(queries, candidates) for d in docs]
+    for batch_size in (1, 8, 32):
+        print(f"pairs/sec, batch cố định {batch_size:2d}:  {pairs_per_sec(model, pairs, batch_size):8.1f}")
+    dynamic = CachedCrossEncoderReranker.from_config(model)
+    print(f"pairs/sec, lô động ({config.RERANK_BATCH_CHARS} ký tự): {pairs_per_sec(model, pairs, reranker=dynamic):8.1f}")
+
+    baseline = CrossEncoderReranker(model=model, top_n=config.RERANK_TOP_N)
+    no_exit = CachedCrossEncoderReranker.from_config(model)
+    no_exit.early_exit_score = None
+    print(f"latency (median) CrossEncoderReranker gốc: {latency_ms(baseline.compress_documents, queries, candidates):8.1f} ms")
+    print(f"latency (median) cache cold:               {latency_ms(no_exit.compress_documents, queries, candidates):8.1f} ms")
+    print(f"latency (median) cache warm:               {latency_ms(no_exit.compress_documents, queries, candidates):8.1f} ms")
+    early = CachedCrossEncoderReranker.from_config(model)
+    early.cache = TTLCache(maxsize=config.RERANK_CACHE_SIZE)
+    print(f"latency (median) cold + early exit:        {latency_ms(early.compress_documents, queries, candidates):8.1f} ms")
+
+    def top_ids(reranker, query, docs):
+        return {doc.metadata["chunk_id"] for doc in reranker.compress_documents(docs, query)}
+    overlap = [len(top_ids(early, q, docs) & top_ids(no_exit, q, docs)) / config.RERANK_TOP_N
+               for q, docs in zip(queries, candidates)]
+    print(f"top_n trùng với chấm hết (early exit):     {100 * statistics.mean(overlap):8.1f} %")
@@ -0,0 +1,113 @@
+"""
+Startup profile: thời gian import + load model của từng thành phần lúc cold start.
+
+Chạy:  python -m src.benchmarks.startup [repeat]
+- Import: mỗi module được import trong 1 interpreter mới (lặp `repeat` lần, lấy median),
+  nên số đo là chi phí cold import gồm cả các dependency của nó. Module chưa cài -> "không cài".
+- Load model: 1 interpreter mới chạy warm-up của registry theo thứ tự WARMUP_COMPONENTS,
+  in thời gian load + lần gọi thử (probe) và RSS tăng thêm của từng thành phần.
+- Cuối cùng ước lượng thời gian tới lúc render được UI: chỉ import registry (WARMUP_MODE=background)
+  so với import + load hết model (WARMUP_MODE=eager).
+Cần chạy từ thư mục gốc repo, đủ cấu hình .env như khi chạy app.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+# Internal Import
+from src.cores.registry import ModelRegistry
+
+# Thành phần nặng lúc khởi động, theo thứ tự agent cần tới
+IMPORTS = [
+    "langchain_core.prompts",
+    "langchain_classic.chains.combine_documents",
+    "langchain_classic.retrievers.multi_query",
+    "langchain_groq",
+    "langchain_community.cross_encoders",
+    "langchain_huggingface",
+    "sentence_transformers",
+    "qdrant_client",
+    "langchain_qdrant",
+    "src.cores.registry",
+    "src.cores.CoT_agent",
+    "src.vectordb.qdrantdb",
+]
+
+_IMPORT_SNIPPET = """
+import importlib, time
+start = time.perf_counter()
+importlib.import_module({module!r})
+print(time.perf_counter() - start)
+"""
+
+_LOAD_SNIPPET = """
+import json
+from src.cores.registry import get_registry
+registry = get_registry()
+registry.warm_up(background=False)
+status = registry.warmup_status()
+print("@@" + json.dumps({"timings": status["timings"], "errors": status["errors"],
+                         "memory": registry.memory_report()}))
+"""
+
+
+def _run(snippet: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True,
+                          cwd=os.getcwd(), env={**os.environ, "PYTHONWARNINGS": "ignore"})
+
+
+def profile_import(module: str, repeat: int):
+    """Median thời gian cold import (giây), None nếu module không import được."""
+    times = []
+    for _ in range(repeat):
+        proc = _run(_IMPORT_SNIPPET.format(module=module))
+        if proc.returncode != 0:
+            return None
+        times.append(float(proc.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def profile_models() -> dict:
+    proc = _run(_LOAD_SNIPPET)
+    for line in proc.stdout.splitlines():
+        if line.startswith("@@"):
+            return json.loads(line[2:])
+    raise SystemExit(f"FAIL: warm-up không chạy được:\n{proc.stderr[-2000:]}")
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f"Python {sys.version.split()[0]}, {os.cpu_count()} CPU, median của {repeat} lần cold import\n")
+
+    print("=== Import (interpreter mới, gồm cả dependency) ===")
+    import_times = {}
+    for module in IMPORTS:
+        import_times[module] = profile_import(module, repeat)
+        shown = "không cài / lỗi" if import_times[module] is None else f"{import_times[module]:7.3f}s"
+        print(f"{module:45s} {shown}")
+
+    print("\n=== Load model (warm-up của registry) ===")
+    models = profile_models()
+    memory = {row["name"]: row for row in models["memory"]}
+    # Tên component warm-up -> tên model trong memory_report
+    names = {"reranker_model": "reranker"}
+    for component in ModelRegistry.WARMUP_COMPONENTS:
+        timing = models["timings"].get(component)
+        if timing is None:
+            print(f"{component:20s} lỗi: {models['errors'].get(component, '?')}")
+            continue
+        row = memory.get(names.get(component, component))
+        line = f"{component:20s} load {timing['load_s']:7.3f}s  probe {timing['probe_s']:6.3f}s"
+        if row is not None:
+            line += f"  RSS +{row['rss_delta_mb']} MB  params {row['param_mb']} MB"
+        print(line)
+    process = memory.get("process", {})
+    print(f"Process RSS sau warm-up: {process.get('rss_total_mb')} MB")
+
+    # Thời gian tới khi UI render được (không tính khởi động Streamlit)
+    registry_import = import_times["src.cores.registry"] or 0.0
+    total_load = sum(t["load_s"] + t["probe_s"] for t in models["timings"].values())
+    print("\n=== Tới lúc render UI ===")
+    print(f"WARMUP_MODE=background: {registry_import:7.3f}s (model load nền trong {total_load:.2f}s)")
+    print(f"WARMUP_MODE=eager:      {registry_import + total_load:7.3f}s")
@@ -28,8 +28,125 @@ class Config:
     EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
     #PROD_EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
     RERANKER_MODEL = "BAAI/bge-reranker-base"
+    # Rerank: cache điểm (câu hỏi, chunk), cắt chunk, gom lô động theo số ký tự, early exit (heuristic, xem dưới)
+    RERANK_TOP_N = 5
+    RERANK_MAX_CHARS = 1000
+    RERANK_BATCH_CHARS = 8000
+    RERANK_MAX_BATCH = 32
+    # Heuristic: đã có top_n chunk đạt ngưỡng thì bỏ qua các đợt sau. Chunk chưa chấm vẫn có thể điểm cao hơn
+    # -> top_n có thể khác khi chấm hết (đổi độ chính xác lấy độ trễ). None = luôn chấm hết
+    RERANK_EARLY_EXIT_SCORE = 0.9
+    RERANK_CACHE_SIZE = 20_000
+    RERANK_CACHE_TTL = 24 * 3600
+    # Embedding cache: vector lưu theo (model, hash text) trên đĩa, dùng chung cho ingestion + evaluation
+    EMBEDDING_CACHE = True
+    EMBEDDING_CACHE_DIR = str(DATA_DIR / "cache_embeddings")
+    EMBEDDING_CACHE_MAX_ITEMS = 200_000
+    # Cache vector câu hỏi trong RAM (LRU + TTL giây), dùng chung giữa các session
+    QUERY_CACHE_SIZE = 4096
+    QUERY_CACHE_TTL = 24 * 3600
+    # Encoder lúc ingestion: "default" = model trong process; "parallel" = chia lô cho process pool
+    ENCODER_MODE = "default"
+    EMBED_BATCH_SIZE = 64
+    EMBED_WORKERS = max(1, (os.cpu_count() or 2) // 2)
     CHUNK_SIZE = 450
     CHUNK_OVERLAP = 150
+    # Bảng Markdown: 1 chunk / dòng (hoặc nhóm dòng) thực phẩm, lặp lại header, không cắt giữa dòng
+    TABLE_AWARE_SPLIT = True
+
+    # Retrieval
+    # "hybrid": BM25 + dense chạy song song, hợp nhất bằng Reciprocal Rank Fusion; "similarity": chỉ dense
+    RETRIEVAL_MODE = "hybrid"
+    RETRIEVAL_K = 10 # Số candidate mỗi câu hỏi đưa sang reranker
+    HYBRID_DENSE_K = 20
+    HYBRID_SPARSE_K = 20
+    RRF_K = 60
+    SPARSE_INDEX_PATH = str(DATA_DIR / "sparse_index.npz")
+    # Số chunk giữ postings BM25 trong RAM trước khi ghi ra file run lúc ingestion (gộp lại lúc save)
+    SPARSE_SPILL_CHUNKS = 2048
+
+    # "adaptive": dense 1 lần -> (chưa đủ tin) multi-query -> (vẫn chưa) rerank; "full": luôn multi-query + rerank
+    RETRIEVAL_STRATEGY = "adaptive"
+    ADAPTIVE_TIER1_MIN_SCORE = 0.55 # Cosine top-1 tối thiểu
+    ADAPTIVE_TIER1_MARGIN = 0.08 # top-1 phải cao hơn điểm thứ top_n+1 ít nhất chừng này
+    ADAPTIVE_TIER2_MIN_CONSENSUS = 0.6 # Tỉ lệ top_n được >= 2 biến thể cùng tìm thấy
+
+    # Answer cache: trả lời lại ngay câu hỏi (độc lập) gần giống câu đã hỏi, không gọi LLM / reranker
+    ANSWER_CACHE = True
+    ANSWER_CACHE_THRESHOLD = 0.95 # Cosine tối thiểu giữa 2 câu hỏi
+    ANSWER_CACHE_SIZE = 1000
+    ANSWER_CACHE_TTL = 6 * 3600
+    # Version dữ liệu, đổi sau mỗi lần ingestion -> answer cache tự xoá
+    INGEST_VERSION_PATH = str(DATA_DIR / "ingest_version.txt")
+
+    # Small-to-big: embed chunk con nhỏ để tìm chính xác, đưa parent (khối văn xuôi / bảng) cho LLM
+    PARENT_CHILD = True
+    CHILD_CHUNK_SIZE = 200
+    CHILD_CHUNK_OVERLAP = 40
+    PARENT_MAX_CHARS = 1500
+    PARENT_STORE_PATH = str(DATA_DIR / "parent_store.jsonl")
+
+    # Router: chọn tài liệu cần tìm (bảng TPTP / giáo trình / cả hai) bằng từ khoá + ngôn ngữ, không gọi LLM
+    QUERY_ROUTING = True
+    SOURCE_FOOD_TABLE = "Vietnamese Food Table"
+    SOURCE_TEXTBOOK = "Human Nutrition Text"
+    # Trường payload được đánh index lúc ingestion (Qdrant) để search có filter nhanh
+    PAYLOAD_INDEX_FIELDS = ["metadata.source"]
+
+    # Context: gộp chunk chồng nhau cùng trang, bỏ đoạn trùng, nhồi theo độ liên quan tới ngân sách token
+    CONTEXT_PACKING = True
+    CONTEXT_MAX_TOKENS = 1800
+    CONTEXT_MIN_OVERLAP = 20 # Số ký tự chồng nhau tối thiểu để coi 2 chunk là liền kề
+
+    # API async (aresearch): số việc nặng CPU (embed, rerank, search mmap) chạy song song trên model dùng chung
+    CPU_WORKERS = min(4, os.cpu_count() or 1)
+
+    # Khởi động web app: "background" = UI hiện ngay, model load trên 1 thread nền;
+    # "eager" = load hết model trước khi render; "lazy" = chỉ load khi có câu hỏi đầu tiên
+    WARMUP_MODE = os.getenv("WARMUP_MODE", "background")
+
+    # Micro-batching: gom embed câu hỏi / chấm cross-encoder của các request đồng thời thành 1 lần gọi model.
+    # Tắt cho web app (1 người dùng / session); src.server bật lên bằng SERVER_MICRO_BATCH trước khi load model
+    MICRO_BATCH = False
+    MICRO_BATCH_WAIT_MS = 5.0 # Chờ gom tối đa, chỉ khi còn request khác đang chạy (request đứng 1 mình không chờ)
+    MICRO_BATCH_MAX_QUERIES = 32
+    MICRO_BATCH_MAX_PAIRS = 64
+    MICRO_BATCH_TIMEOUT = 60.0 # Chờ kết quả của model quá số giây này -> TimeoutError thay vì treo request
+
+    # HTTP server (python -m src.server)
+    SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+    SERVER_PORT = int(os.getenv("PORT", "8000"))
+    SERVER_MAX_CONCURRENCY = 32 # Số request /research xử lý cùng lúc, vượt quá thì chờ trong hàng
+    SERVER_QUEUE_TIMEOUT = 30.0 # Chờ quá số giây này -> 503
+    SERVER_MAX_BODY_BYTES = 1_000_000
+    SERVER_MICRO_BATCH = True # Server bật MICRO_BATCH (nhiều request đồng thời dùng chung model)
+
+    # Lịch sử chat: giữ nguyên văn vài lượt gần nhất, lượt cũ hơn gộp vào bản tóm tắt (cache theo session)
+    HISTORY_MAX_TOKENS = 1500 # Tổng token lịch sử (tóm tắt + cửa sổ) trong mỗi prompt
+    HISTORY_KEEP_TURNS = 4 # Số lượt (user + assistant) giữ nguyên văn
+    HISTORY_SUMMARY_MAX_TOKENS = 300
+    TOKEN_ENCODING = "cl100k_base" # tiktoken, xấp xỉ tokenizer của Llama trên Groq
+
+    # Nutrient store: bảng dinh dưỡng dạng cột cho fast path tra cứu số liệu chính xác
+    NUTRIENT_STORE_PATH = str(DATA_DIR / "nutrient_store.npz")
+    NUTRIENT_FAST_PATH = True
+    NUTRIENT_MATCH_MIN_SCORE = 85
+
+    # Parser
+    # "llamaparse": parse qua LlamaCloud; "local": pdfplumber chạy song song trên process pool
+    PARSER_BACKEND = "llamaparse"
+    PARSER_WORKERS = os.cpu_count()
+    PARSER_PAGES_PER_TASK = 16
+
+    # Ingestion
+    # "full": xoá và tạo lại toàn bộ collection (force_recreate)
+    # "incremental": chỉ embed/upsert chunk mới hoặc thay đổi, xoá chunk không còn tồn tại
+    INGEST_MODE = "incremental"
+    # Streaming: xử lý theo lô trang qua các stage song song, bộ nhớ bị chặn bởi batch/queue
+    INGEST_STREAMING = False
+    STREAM_BATCH_SIZE = 64
+    STREAM_QUEUE_SIZE = 4
+    STREAM_EMBED_WORKERS = 2
 
     #Model
     GROQ_MODEL_NAME = "llama-3.1-8b-instant"
@@ -39,6 +156,11 @@ class Config:
     #VECTOR_DB_TYPE = "qdrant_local"
     VECTOR_DB_TYPE = "qdrant_cloud"
     #VECTOR_DB_TYPE = "pinecone"
+    #VECTOR_DB_TYPE = "mmap" # Index nhúng trong process (np.memmap), không cần server
+
+    # Cấu hình phụ cho mmap (Chỉ dùng nếu type="mmap")
+    MMAP_INDEX_PATH = str(DATA_DIR / "mmap_index")
+    MMAP_DTYPE = "float32" # "float16" -> giảm 1/2 RAM/đĩa
 
     # Cấu hình phụ cho Pinecone (Chỉ dùng nếu type="pinecone")
     PINECONE_INDEX_NAME = "nutri-agent"
@@ -1,47 +1,64 @@
 import logging
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
 logging.getLogger("langchain.retrievers.multi_query").setLevel(logging.INFO)
-from langchain_groq import ChatGroq
+logging.getLogger("src.cores.retrievers").setLevel(logging.INFO)
+logging.getLogger("src.cores.multi_query").setLevel(logging.INFO)
 from langchain_core.messages import BaseMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage
-# Chuyển hướng sang thư viện classic
-from langchain_classic.chains.retrieval import create_retrieval_chain
-from langchain_classic.chains.combine_documents import create_stuff_documents_chain
-from langchain_classic.chains import create_history_aware_retriever
-# Import Retrievers & Rerankers
-from langchain_classic.retrievers import ContextualCompressionRetriever
-from langchain_classic.retrievers.multi_query import MultiQueryRetriever
-from langchain_classic.retrievers.document_compressors import CrossEncoderReranker
-from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+from langchain_core.output_parsers import StrOutputParser
+# Chains / retriever của langchain_classic, ChatGroq, cross-encoder, Qdrant được import lười
+# (trong các hàm dựng chain / trong registry) -> import module này không kéo theo thư viện nặng
 # Internal class
 from src.config import config
-from src.vectordb.qdrantdb import VectorDB
+from src.cores.retrievers import AdaptiveRetriever, ParentDocumentRetriever
+from src.cores.registry import ModelRegistry, get_registry
+from src.cores.answer_cache import get_answer_cache
+from src.cores.history import ChatHistoryManager
+from src.cores.context import pack_from_config
+from src.cores.router import QueryRouter
+from src.cores.streaming import TagStreamParser
+from src.utils.concurrency import run_cpu
 #from src.cores.prompts import system_prompt
 
 class NutriAgentReseacher:
-    def __init__(self, use_reasoning : bool = True):
+    def __init__(self, use_reasoning : bool = True, registry: Optional[ModelRegistry] = None):
+        # Chế độ mặc định, mỗi request có thể ghi đè (research(..., use_reasoning=...))
         self.use_reasoning = use_reasoning 
+        # Model / client dùng chung trong process: agent thứ 2 không load lại embedder, reranker, Qdrant
+        self.registry = registry or get_registry()
        
         # khởi tạo LLMs
-        self.llm  = ChatGroq(
-            model = config.GROQ_MODEL_NAME,
-            api_key = config.GROQ_API_KEY,
-            temperature=0,
-            max_tokens=2048
-        )
+        self.llm = self.registry.llm()
+
+        # Lịch sử chat bị chặn theo token (cửa sổ gần nhất + tóm tắt lượt cũ)
+        self.history = ChatHistoryManager.from_config(self.llm)
 
         # 2. Kết nối Ký ức (VectorDB)
-        # Gọi class VectorDB không tham số -> Tự động load DB từ ổ cứng (Local)
-        self.vectordb = VectorDB()
-        self.retriever = self.vectordb.get_retriever(search_kwargs={"k": 5})
+        # VectorDB ở chế độ đọc -> Tự động load DB từ ổ cứng (Local), dùng chung qua registry
+        self.vectordb = self.registry.vectordb()
+
+        # Fast path: tra cứu trực tiếp bảng dinh dưỡng (không cần retrieval/rerank)
+        self.nutrient_store = self.registry.nutrient_store()
+
+        # Cache câu trả lời theo câu hỏi độc lập (dùng chung giữa 2 chế độ, entry tách theo use_reasoning)
+        self.answer_cache = get_answer_cache() if config.ANSWER_CACHE else None
+
+        # Docstore parent section (small-to-big), None nếu index chưa được dựng ở chế độ parent/child
+        self.parent_store = self.registry.parent_store()
 
         # RAG nâng cao
         self.advanced_retriever = self._build_advanced_retriever()
+        if self.parent_store is not None:
+            # Rerank trên chunk con, chỉ đọc parent của top-n cuối cùng
+            self.advanced_retriever = ParentDocumentRetriever(
+                retriever=self.advanced_retriever,
+                parent_store=self.parent_store,
+            )
 
-        # Tạo Chain xử lý cuối cùng
-        self.chain = self._create_conversational_chain()
+        # Tạo các chain rephrase + QA; research() tự điều phối rephrase -> retrieval -> QA
+        self._create_conversational_chain()
     
     def _build_advanced_retriever(self):
         """
@@ -49,27 +66,45 @@ class NutriAgentReseacher:
         """
         print("... Đang kích hoạt các module Advanced RAG ...")
         
-        # A. Base Retriever: Lấy dữ liệu thô
-        # Lấy số lượng lớn (k=20) để không bị sót thông tin, sau đó lọc sau.
-        base_retriever = self.vectordb.get_retriever(search_kwargs={"k": 20})
-
-        # B. Kỹ thuật 1: Multi-Query (Đa truy vấn)
+        # A + B. Multi-Query (Đa truy vấn) trên Base Retriever
         # Agent tự biến đổi câu hỏi của user thành 3-4 câu khác nhau để tìm kiếm rộng hơn.
-        
         # Ví dụ: User hỏi "Ức gà tốt ko?" -> AI tìm thêm "Dinh dưỡng ức gà", "Lợi ích ức gà".
-        multi_query_retriever = MultiQueryRetriever.from_llm(
-            retriever=base_retriever,
-            llm=self.llm,
-            include_original=True
+        # Tất cả biến thể được embed + tìm kiếm trong 1 lô, khử trùng lặp theo chunk_id trước khi rerank.
+        # Hybrid BM25 + dense (RRF) bắt được tên/mã thực phẩm chính xác -> không cần over-fetch k=20.
+        # Router cục bộ: câu hỏi số liệu của 1 thực phẩm cụ thể chỉ tìm trong bảng TPTP,
+        # câu hỏi kiến thức chỉ tìm trong giáo trình
+        from src.cores.multi_query import BatchedMultiQueryRetriever
+        router = QueryRouter(nutrient_store=self.nutrient_store) if config.QUERY_ROUTING else None
+        multi_query_retriever = BatchedMultiQueryRetriever.from_vectordb(
+            self.vectordb,
+            self.llm,
+            k=config.RETRIEVAL_K,
+            search_type=config.RETRIEVAL_MODE,
+            include_original=True,
+            router=router
         )
 
         # C. Kỹ thuật 2: Reranker (Sắp xếp lại)
-        # Dùng model chuyên dụng để đọc kỹ 20 kết quả trên, chấm điểm và chỉ lấy 5 cái tốt nhất.
-        # Model 'BAAI/bge-reranker-base' rất nhẹ và tốt cho đa ngôn ngữ.
-        reranker_model = HuggingFaceCrossEncoder(model_name="BAAI/bge-reranker-base")
-        compressor = CrossEncoderReranker(model=reranker_model, top_n=5)
+        # Dùng model chuyên dụng (config.RERANKER_MODEL) chấm điểm các candidate và chỉ lấy 5 cái tốt nhất.
+        # Điểm được cache theo (câu hỏi, chunk), chunk bị cắt ngắn, chấm theo lô động và
+        # (heuristic) bỏ qua các đợt sau khi đã đủ top_n chunk đạt RERANK_EARLY_EXIT_SCORE.
+        compressor = self.registry.reranker()
+
+        # D. Adaptive: câu hỏi dễ chỉ cần 1 lần dense search, chỉ leo lên multi-query / rerank khi chưa đủ tin
+        if config.RETRIEVAL_STRATEGY == "adaptive":
+            return AdaptiveRetriever(
+                vectordb=self.vectordb,
+                multi_query=multi_query_retriever,
+                reranker=compressor,
+                router=router,
+                top_n=config.RERANK_TOP_N,
+                tier1_min_score=config.ADAPTIVE_TIER1_MIN_SCORE,
+                tier1_margin=config.ADAPTIVE_TIER1_MARGIN,
+                tier2_min_consensus=config.ADAPTIVE_TIER2_MIN_CONSENSUS,
+            )
 
         #  Multi-Query chạy trước -> Kết quả đưa vào Reranker
+        from langchain_classic.retrievers import ContextualCompressionRetriever
         compression_retriever = ContextualCompressionRetriever(
             base_compressor=compressor,
             base_retriever=multi_query_retriever
@@ -95,16 +130,18 @@ class NutriAgentReseacher:
             ("human", "{input}"),
         ])
         
-        history_aware_retriever = create_history_aware_retriever(
-            self.llm, 
-            self.advanced_retriever, 
-            contextualize_q_prompt
-        )
+        # Tách riêng bước tạo câu hỏi độc lập để research() dùng làm khoá answer cache
+        self.rephrase_chain = contextualize_q_prompt | self.llm | StrOutputParser()
 
         # --- 2. QA PROMPT (Prompt trả lời chính) ---
+        # Chế độ reasoning chọn theo từng request -> dựng sẵn QA chain cho cả 2 chế độ (chỉ khác prompt)
+        # Cả retrieval lẫn fast path đều đưa context thẳng vào QA chain
+        self.qa_chains = {mode: self._create_qa_chain(mode) for mode in (True, False)}
+
+    def _create_qa_chain(self, use_reasoning: bool):
         # Sử dụng kỹ thuật Chain-of-Thought với XML Tags (<thinking>, <answer>)
         
-        if self.use_reasoning:
+        if use_reasoning:
             instructions = """
             You are a Critical Thinking Nutritionist. Follow this structure strictly:
 
@@ -153,62 +190,231 @@ class NutriAgentReseacher:
             ("human", "{input}"),
         ])
 
-        question_answer_chain = create_stuff_documents_chain(self.llm, qa_prompt)
-        rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-        
-        return rag_chain
+        from langchain_classic.chains.combine_documents import create_stuff_documents_chain
+        return create_stuff_documents_chain(self.llm, qa_prompt)
     
-    def research(self, query: str, chat_history: List[BaseMessage] = []) -> Dict[str, Any]:
+    def _mode(self, use_reasoning: Optional[bool]) -> bool:
+        """Chế độ của request: None -> chế độ mặc định của agent."""
+        return self.use_reasoning if use_reasoning is None else bool(use_reasoning)
+
+    def _parse_output(self, raw_text: str, use_reasoning: Optional[bool] = None):
+        """Tách <thinking> / <answer> từ output của LLM."""
+        final_answer = raw_text
+        model_thinking = ""
+
+        # --- Logic Parse XML Tags (<thinking> ... </thinking>) ---
+        if self._mode(use_reasoning):
+            # 1. Trích xuất phần suy nghĩ
+            think_match = re.search(r'<thinking>(.*?)</thinking>', raw_text, re.DOTALL)
+            if think_match:
+                model_thinking = think_match.group(1).strip()
+            
+            # 2. Trích xuất câu trả lời
+            ans_match = re.search(r'<answer>(.*?)</answer>', raw_text, re.DOTALL)
+            if ans_match:
+                final_answer = ans_match.group(1).strip()
+            else:
+                # Fallback: Nếu model quên đóng tag answer, lấy phần còn lại sau thinking
+                final_answer = re.sub(r'<thinking>.*?</thinking>', '', raw_text, flags=re.DOTALL).strip()
+                final_answer = final_answer.replace("<answer>", "").replace("</answer>", "").strip()
+
+        else:
+            # Nếu không dùng reasoning, model có thể vẫn bọc trong <answer> do prompt yêu cầu consistency
+            final_answer = raw_text.replace("<answer>", "").replace("</answer>", "").strip()
+
+        return final_answer, model_thinking
+
+    def _nutrient_lookup(self, query: str):
+        """Câu hỏi số liệu thành phần (thực phẩm + chất dinh dưỡng) -> hàng dữ liệu chính xác."""
+        if self.nutrient_store is None:
+            return None
+        match = self.nutrient_store.lookup(query, min_score=config.NUTRIENT_MATCH_MIN_SCORE)
+        if match is None:
+            return None
+        print(f"⚡ Nutrient fast path: {match['name']} ({match['code']}) - {match['requested']}")
+        return [self.nutrient_store.to_document(match)]
+    
+    def _standalone_question(self, query: str, chat_history: List[BaseMessage]) -> str:
+        """Giống create_history_aware_retriever: không có lịch sử thì dùng nguyên câu hỏi."""
+        if not chat_history:
+            return query
+        return self.rephrase_chain.invoke({"input": query, "chat_history": chat_history}).strip() or query
+
+    async def _astandalone_question(self, query: str, chat_history: List[BaseMessage]) -> str:
+        if not chat_history:
+            return query
+        return (await self.rephrase_chain.ainvoke({"input": query, "chat_history": chat_history})).strip() or query
+
+    @staticmethod
+    def _retrieval_tier(sources) -> Any:
+        """0 = nutrient fast path, 1-3 = bậc adaptive, "full" = multi-query + rerank cố định."""
+        if sources and sources[0].metadata.get("content_type") == "nutrient_lookup":
+            return 0
+        if sources and "retrieval_tier" in sources[0].metadata:
+            return sources[0].metadata["retrieval_tier"]
+        return "full"
+
+    def _prepare(self, query: str, chat_history: List[BaseMessage],
+                 history_state: Optional[Dict[str, Any]], use_reasoning: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Các bước trước khi sinh câu trả lời (dùng chung cho research / research_stream).
+        Answer cache hit -> "cached" chứa kết quả, không cần retrieval.
+        """
+        # 0. Chặn kích thước lịch sử (dùng chung cho prompt rephrase và prompt trả lời)
+        chat_history = self.history.build(chat_history, history_state)
+
+        # 1. Câu hỏi độc lập (chỉ gọi LLM khi có lịch sử chat)
+        standalone = self._standalone_question(query, chat_history)
+        prepared = {"query": query, "chat_history": chat_history, "standalone": standalone,
+                    "use_reasoning": self._mode(use_reasoning), "cache_vector": None, "cached": None}
+
+        # 2. Answer cache: câu hỏi gần giống đã trả lời -> trả về ngay, không gọi LLM / reranker
+        prepared["cached"] = self._lookup_answer_cache(prepared)
+        if prepared["cached"] is not None:
+            return prepared
+
+        # 3. Retrieval
+        # Fast path: câu hỏi số liệu -> hàng dữ liệu chính xác, bỏ qua multi-query + search + rerank
+        retrieved = self._nutrient_lookup(standalone) or self.advanced_retriever.invoke(standalone)
+
+        # 4. Lắp context: gộp chunk chồng nhau, nhồi theo ngân sách token
+        # sources = các chunk gốc thực sự có trong prompt
+        prepared["context"], prepared["sources"] = pack_from_config(retrieved)
+        return prepared
+
+    async def _aprepare(self, query: str, chat_history: List[BaseMessage],
+                        history_state: Optional[Dict[str, Any]], use_reasoning: Optional[bool] = None) -> Dict[str, Any]:
+        """Như _prepare(): gọi LLM / retriever bằng API async, việc nặng CPU chạy trên pool giới hạn."""
+        chat_history = await self.history.abuild(chat_history, history_state)
+        standalone = await self._astandalone_question(query, chat_history)
+        prepared = {"query": query, "chat_history": chat_history, "standalone": standalone,
+                    "use_reasoning": self._mode(use_reasoning), "cache_vector": None, "cached": None}
+
+        prepared["cached"] = await run_cpu(self._lookup_answer_cache, prepared)
+        if prepared["cached"] is not None:
+            return prepared
+
+        retrieved = await run_cpu(self._nutrient_lookup, standalone)
+        if not retrieved:
+            retrieved = await self.advanced_retriever.ainvoke(standalone)
+        prepared["context"], prepared["sources"] = await run_cpu(pack_from_config, retrieved)
+        return prepared
+
+    def _lookup_answer_cache(self, prepared: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.answer_cache is None:
+            return None
+        prepared["cache_vector"] = self.vectordb.query_embeddings.embed_query(prepared["standalone"])
+        cached = self.answer_cache.lookup(prepared["cache_vector"], mode=prepared["use_reasoning"])
+        if cached is not None:
+            print(f"⚡ Answer cache hit: {cached['cache_hit']}")
+        return cached
+
+    @staticmethod
+    def _qa_input(prepared: Dict[str, Any]) -> Dict[str, Any]:
+        return {"input": prepared["query"], "chat_history": prepared["chat_history"], "context": prepared["context"]}
+
+    def _qa_chain_for(self, prepared: Dict[str, Any]):
+        return self.qa_chains[prepared["use_reasoning"]]
+
+    def _finalize(self, prepared: Dict[str, Any], raw_text: str) -> Dict[str, Any]:
+        final_answer, model_thinking = self._parse_output(raw_text, prepared["use_reasoning"])
+        sources = prepared["sources"]
+        result = {
+            "answer": final_answer,
+            "sources": sources,
+            "model_thoughts": model_thinking,
+            "retrieval_tier": self._retrieval_tier(sources)
+        }
+        if prepared["cache_vector"] is not None and sources:
+            self.answer_cache.store(prepared["cache_vector"], prepared["use_reasoning"], prepared["standalone"], result)
+        return result
+
+    @staticmethod
+    def _error_result(e: Exception) -> Dict[str, Any]:
+        return {
+            "answer": "Xin lỗi, hệ thống đang gặp sự cố khi xử lý câu hỏi.",
+            "sources": [],
+            "model_thoughts": str(e),
+            "error": True
+        }
+
+    def research(self, query: str, chat_history: List[BaseMessage] = [],
+                 history_state: Optional[Dict[str, Any]] = None,
+                 use_reasoning: Optional[bool] = None) -> Dict[str, Any]:
         """
         Hàm thực thi chính.
-        Input: Câu hỏi + Lịch sử chat
+        Input: Câu hỏi + Lịch sử chat (+ trạng thái tóm tắt lịch sử của session, xem history.new_history_state)
+               + chế độ suy luận của request (None -> chế độ mặc định của agent)
         Output: Dictionary chứa câu trả lời, nguồn, và suy luận (nếu có)
         """
         try:
-            # Gọi Chain đã khởi tạo
-            response = self.chain.invoke({"input": query, "chat_history": chat_history})
-            
-            raw_text = response["answer"]
-            sources = response.get("context", [])
-            
-            final_answer = raw_text
-            model_thinking = ""
-
-            # --- Logic Parse XML Tags (<thinking> ... </thinking>) ---
-            if self.use_reasoning:
-                # 1. Trích xuất phần suy nghĩ
-                think_match = re.search(r'<thinking>(.*?)</thinking>', raw_text, re.DOTALL)
-                if think_match:
-                    model_thinking = think_match.group(1).strip()
-                
-                # 2. Trích xuất câu trả lời
-                ans_match = re.search(r'<answer>(.*?)</answer>', raw_text, re.DOTALL)
-                if ans_match:
-                    final_answer = ans_match.group(1).strip()
-                else:
-                    # Fallback: Nếu model quên đóng tag answer, lấy phần còn lại sau thinking
-                    final_answer = re.sub(r'<thinking>.*?</thinking>', '', raw_text, flags=re.DOTALL).strip()
-                    final_answer = final_answer.replace("<answer>", "").replace("</answer>", "").strip()
+            prepared = self._prepare(query, chat_history, history_state, use_reasoning)
+            if prepared["cached"] is not None:
+                return prepared["cached"]
 
-            else:
-                # Nếu không dùng reasoning, model có thể vẫn bọc trong <answer> do prompt yêu cầu consistency
-                final_answer = raw_text.replace("<answer>", "").replace("</answer>", "").strip()
-            
-            return {
-                "answer": final_answer,
-                "sources": sources,
-                "model_thoughts": model_thinking
-            }
+            # 5. Sinh câu trả lời
+            raw_text = self._qa_chain_for(prepared).invoke(self._qa_input(prepared))
+            return self._finalize(prepared, raw_text)
             
         except Exception as e:
             print(f"Error in research: {e}")
-            return {
-                "answer": "Xin lỗi, hệ thống đang gặp sự cố khi xử lý câu hỏi.",
-                "sources": [],
-                "model_thoughts": str(e)
-            }
-   
+            return self._error_result(e)
 
+    async def aresearch(self, query: str, chat_history: List[BaseMessage] = [],
+                        history_state: Optional[Dict[str, Any]] = None,
+                        use_reasoning: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Bản async của research(): các lời gọi Groq (rephrase, multi-query, trả lời) không chặn event loop,
+        embed / rerank / search chạy trên pool giới hạn -> 1 agent phục vụ nhiều session cùng lúc.
+        """
+        try:
+            prepared = await self._aprepare(query, chat_history, history_state, use_reasoning)
+            if prepared["cached"] is not None:
+                return prepared["cached"]
 
+            raw_text = await self._qa_chain_for(prepared).ainvoke(self._qa_input(prepared))
+            return await run_cpu(self._finalize, prepared, raw_text)
 
+        except Exception as e:
+            print(f"Error in aresearch: {e}")
+            return self._error_result(e)
 
+    def research_stream(self, query: str, chat_history: List[BaseMessage] = [],
+                        history_state: Optional[Dict[str, Any]] = None,
+                        use_reasoning: Optional[bool] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Như research() nhưng stream từng phần ngay khi có, mỗi event là 1 dict có "type":
+        - "sources":  {"sources", "retrieval_tier"} ngay sau retrieval, trước khi LLM chạy.
+        - "thinking" / "answer": {"text"} từng đoạn token, đã tách theo tag <thinking> / <answer>.
+        - "done":     {"result"} kết quả đầy đủ giống research() (đã parse lại toàn bộ text).
+        - "error":    {"result"} kết quả lỗi giống research().
+        """
+        try:
+            prepared = self._prepare(query, chat_history, history_state, use_reasoning)
+            cached = prepared["cached"]
+            if cached is not None:
+                yield {"type": "sources", "sources": cached["sources"], "retrieval_tier": cached.get("retrieval_tier")}
+                if cached.get("model_thoughts"):
+                    yield {"type": "thinking", "text": cached["model_thoughts"]}
+                yield {"type": "answer", "text": cached["answer"]}
+                yield {"type": "done", "result": cached}
+                return
+
+            sources = prepared["sources"]
+            yield {"type": "sources", "sources": sources, "retrieval_tier": self._retrieval_tier(sources)}
+
+            # 5. Sinh câu trả lời, tách tag ngay trên từng chunk token
+            parser = TagStreamParser(self._mode(use_reasoning))
+            chunks = []
+            for chunk in self._qa_chain_for(prepared).stream(self._qa_input(prepared)):
+                chunks.append(chunk)
+                for kind, text in parser.feed(chunk):
+                    yield {"type": kind, "text": text}
+            for kind, text in parser.flush():
+                yield {"type": kind, "text": text}
+
+            yield {"type": "done", "result": self._finalize(prepared, "".join(chunks))}
+
+        except Exception as e:
+            print(f"Error in research_stream: {e}")
+            yield {"type": "error", "result": self._error_result(e)}
@@ -0,0 +1,123 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import numpy as np
+# Internal Import
+from src.config import config
+from src.vectordb.ingest_version import current_ingest_version
+
+
+class SemanticAnswerCache:
+    """
+    Cache câu trả lời của research() theo embedding của câu hỏi độc lập (đã giải tham chiếu lịch sử).
+    - Hit khi cosine với 1 câu hỏi đã lưu >= threshold (cùng use_reasoning).
+    - LRU (maxsize) + TTL; dùng chung giữa các agent / session trong process.
+    - Dữ liệu được nạp lại (ingest version đổi) -> xoá sạch cache.
+    """
+    def __init__(self, threshold: float = 0.95, maxsize: int = 1000, ttl: Optional[float] = None,
+                 version_check_interval: float = 5.0):
+        self.threshold = threshold
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._version = current_ingest_version()
+        self._version_checked_at = time.monotonic()
+        self._version_check_interval = version_check_interval
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _check_version(self):
+        # Chỉ đọc file version mỗi vài giây, không phải mỗi request
+        now = time.monotonic()
+        if now - self._version_checked_at < self._version_check_interval:
+            return
+        self._version_checked_at = now
+        version = current_ingest_version()
+        if version != self._version:
+            print(f"Dữ liệu đã được nạp lại ({version}), xoá answer cache ({len(self._entries)} câu).")
+            self._entries.clear()
+            self._version = version
+
+    def _evict_expired(self):
+        if not self.ttl:
+            return
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, vector, mode: Any) -> Optional[Dict[str, Any]]:
+        query = self._normalize(vector)
+        with self._lock:
+            self._check_version()
+            self._evict_expired()
+            keys = [key for key, entry in self._entries.items() if entry["mode"] == mode]
+            if keys:
+                matrix = np.stack([self._entries[key]["vector"] for key in keys])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    entry = self._entries[key]
+                    result = copy.deepcopy(entry["response"])
+                    result["cache_hit"] = {"similarity": round(float(scores[best]), 4), "question": entry["question"]}
+                    return result
+            self.misses += 1
+            return None
+
+    def store(self, vector, mode: Any, question: str, response: Dict[str, Any]):
+        entry = {
+            "vector": self._normalize(vector),
+            "mode": mode,
+            "question": question,
+            "response": copy.deepcopy(response),
+            "expires_at": time.monotonic() + self.ttl if self.ttl else float("inf"),
+        }
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+_SHARED: List[SemanticAnswerCache] = []
+_SHARED_LOCK = threading.Lock()
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Answer cache dùng chung trong process (mỗi chế độ use_reasoning có entry riêng)."""
+    with _SHARED_LOCK:
+        if not _SHARED:
+            _SHARED.append(SemanticAnswerCache(
+                threshold=config.ANSWER_CACHE_THRESHOLD,
+                maxsize=config.ANSWER_CACHE_SIZE,
+                ttl=config.ANSWER_CACHE_TTL,
+            ))
+        return _SHARED[0]
@@ -0,0 +1,113 @@
+from typing import List, Optional, Sequence, Tuple
+from langchain_core.documents import Document as LangChainDocument
+# Internal Import
+from src.config import config
+from src.utils.tokens import count_tokens, truncate_tokens
+from src.vectordb.hybrid import doc_key
+
+
+def text_overlap(a: str, b: str, min_overlap: int = 20, max_overlap: int = 600) -> int:
+    """Độ dài đoạn dài nhất vừa là đuôi của a vừa là đầu của b (phần overlap của text splitter)."""
+    for size in range(min(len(a), len(b), max_overlap), min_overlap - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+def _shared_head(a: str, b: str) -> int:
+    """Số dòng đầu giống nhau (header bảng lặp lại ở mỗi chunk table_row)."""
+    count = 0
+    for line_a, line_b in zip(a.splitlines(), b.splitlines()):
+        if line_a != line_b or not line_a.lstrip().startswith("|"):
+            break
+        count += 1
+    return count
+
+
+def _merge_pair(a: str, b: str, min_overlap: int, max_overlap: int) -> Optional[str]:
+    """Gộp 2 chunk cùng trang nếu chúng chồng lên nhau; None nếu không liên quan."""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    size = text_overlap(a, b, min_overlap, max_overlap)
+    if size:
+        return a + b[size:]
+    size = text_overlap(b, a, min_overlap, max_overlap)
+    if size:
+        return b + a[size:]
+    head = _shared_head(a, b)
+    if head:
+        return a + "\n" + "\n".join(b.splitlines()[head:])
+    return None
+
+
+class _Group:
+    """1 đoạn context sau khi gộp: text + các chunk gốc tạo nên nó (theo thứ hạng)."""
+    def __init__(self, rank: int, doc: LangChainDocument):
+        self.rank = rank
+        self.text = doc.page_content
+        self.members = [doc]
+
+
+def merge_chunks(docs: Sequence[LangChainDocument], min_overlap: int = 20,
+                 max_overlap: int = 600) -> List[_Group]:
+    """
+    Gộp chunk liền kề / chồng nhau của cùng (source, page), bỏ chunk trùng.
+    Kết quả giữ thứ hạng của chunk tốt nhất trong mỗi nhóm.
+    """
+    groups: List[_Group] = []
+    seen = set()
+    for rank, doc in enumerate(docs):
+        key = doc_key(doc)
+        if key in seen:
+            continue
+        seen.add(key)
+        page = (doc.metadata.get("source"), doc.metadata.get("page"))
+        target = _Group(rank, doc)
+        # Gộp liên tiếp: chunk mới có thể nối 2 nhóm đã có thành 1
+        for group in [g for g in groups if (g.members[0].metadata.get("source"), g.members[0].metadata.get("page")) == page]:
+            merged = _merge_pair(group.text, target.text, min_overlap, max_overlap)
+            if merged is None:
+                continue
+            groups.remove(group)
+            group.text = merged
+            group.members.extend(target.members)
+            group.rank = min(group.rank, target.rank)
+            target = group
+        groups.append(target)
+    return sorted(groups, key=lambda g: g.rank)
+
+
+def pack_context(docs: Sequence[LangChainDocument], max_tokens: Optional[int] = None,
+                 min_overlap: int = 20, max_overlap: int = 600) -> Tuple[List[LangChainDocument], List[LangChainDocument]]:
+    """
+    Lắp context cho LLM: gộp chunk chồng nhau -> xếp theo độ liên quan -> nhồi tới max_tokens.
+    Trả về (documents đưa vào prompt, các chunk gốc thực sự nằm trong prompt để làm `sources`).
+    """
+    context, sources = [], []
+    used = 0
+    for group in merge_chunks(docs, min_overlap, max_overlap):
+        text = group.text
+        size = count_tokens(text)
+        if max_tokens is not None and used + size > max_tokens:
+            if context:
+                # Đoạn này không vừa, đoạn sau có thể ngắn hơn và vẫn vừa
+                continue
+            # Đoạn liên quan nhất luôn được giữ, cắt cho vừa ngân sách
+            text = truncate_tokens(text, max_tokens)
+            size = count_tokens(text)
+        metadata = dict(group.members[0].metadata)
+        if len(group.members) > 1:
+            metadata["merged_chunk_ids"] = [doc_key(doc) for doc in group.members]
+        context.append(LangChainDocument(page_content=text, metadata=metadata))
+        sources.extend(group.members)
+        used += size
+    return context, sources
+
+
+def pack_from_config(docs: Sequence[LangChainDocument]) -> Tuple[List[LangChainDocument], List[LangChainDocument]]:
+    if not config.CONTEXT_PACKING:
+        return list(docs), list(docs)
+    return pack_context(docs, max_tokens=config.CONTEXT_MAX_TOKENS,
+                        min_overlap=config.CONTEXT_MIN_OVERLAP, max_overlap=config.CHUNK_OVERLAP * 2)
@@ -0,0 +1,155 @@
+import re
+from typing import Dict, List, Optional, Sequence, Union
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+# Internal Import
+from src.config import config
+from src.utils.tokens import count_tokens, truncate_tokens
+
+_THINKING = re.compile(r"<thinking>.*?(?:</thinking>|$)", re.DOTALL)
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
+    You maintain a running summary of a nutrition Q&A conversation.
+    Update the summary with the new turns below.
+
+    ### INSTRUCTIONS:
+    1. **KEEP FACTS:** Foods, quantities, nutrient values, user goals and constraints mentioned so far.
+    2. **BE BRIEF:** At most {max_words} words, no greetings, no reasoning.
+    3. **KEEP LANGUAGE:** Write in the language the user uses.
+    4. **FORMAT:** Output ONLY the updated summary.
+    """),
+    ("human", "Current summary:\n{summary}\n\nNew turns:\n{turns}"),
+])
+
+
+def strip_thinking(text: str) -> str:
+    """Bỏ phần <thinking> (kể cả khi model quên đóng tag) và tag <answer>."""
+    text = _THINKING.sub("", text or "")
+    return text.replace("<answer>", "").replace("</answer>", "").strip()
+
+
+def new_history_state() -> Dict:
+    """Trạng thái tóm tắt của 1 session (lưu trong st.session_state)."""
+    return {"summary": "", "summarized": 0}
+
+
+class ChatHistoryManager:
+    """
+    Chặn kích thước lịch sử chat đưa vào prompt:
+    - Giữ nguyên văn keep_turns lượt gần nhất, bớt tiếp lượt cũ nếu vượt max_tokens.
+    - Các lượt cũ hơn được gộp dần vào 1 bản tóm tắt (chỉ tóm tắt phần mới bị đẩy ra, cache theo session).
+    - Bỏ <thinking> khỏi tin nhắn của assistant.
+    Tổng token (tóm tắt + cửa sổ) <= max_tokens, dù session dài bao nhiêu.
+    """
+    def __init__(self, llm: BaseLanguageModel, max_tokens: int = 1500, keep_turns: int = 4,
+                 summary_max_tokens: int = 300):
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary_max_tokens = min(summary_max_tokens, max_tokens)
+        self.summary_chain = SUMMARY_PROMPT | llm | StrOutputParser()
+
+    @classmethod
+    def from_config(cls, llm: BaseLanguageModel) -> "ChatHistoryManager":
+        return cls(
+            llm,
+            max_tokens=config.HISTORY_MAX_TOKENS,
+            keep_turns=config.HISTORY_KEEP_TURNS,
+            summary_max_tokens=config.HISTORY_SUMMARY_MAX_TOKENS,
+        )
+
+    @staticmethod
+    def _to_messages(messages: Sequence[Union[BaseMessage, Dict]]) -> List[BaseMessage]:
+        """Nhận tin nhắn LangChain hoặc dict {"role", "content"} của Streamlit."""
+        result = []
+        for msg in messages:
+            if isinstance(msg, dict):
+                role, content = msg.get("role"), msg.get("content", "")
+            else:
+                role, content = ("user" if msg.type == "human" else "assistant"), msg.content
+            if role == "user":
+                result.append(HumanMessage(content=content))
+            elif role == "assistant":
+                result.append(AIMessage(content=strip_thinking(content)))
+        return result
+
+    def _window_start(self, messages: List[BaseMessage]) -> int:
+        start = max(0, len(messages) - 2 * self.keep_turns)
+        budget = self.max_tokens - self.summary_max_tokens
+        sizes = [count_tokens(msg.content) for msg in messages]
+        total = sum(sizes[start:])
+        while start < len(messages) and total > budget:
+            total -= sizes[start]
+            start += 1
+        # Cửa sổ bắt đầu bằng câu hỏi của user, không bắt đầu giữa 1 lượt
+        while start < len(messages) and messages[start].type != "human":
+            start += 1
+        return start
+
+    def _summary_input(self, summary: str, messages: List[BaseMessage]) -> Dict:
+        turns = "\n".join(f"{'User' if msg.type == 'human' else 'Assistant'}: {msg.content}" for msg in messages)
+        return {
+            "summary": summary or "(empty)",
+            "turns": turns,
+            "max_words": max(20, self.summary_max_tokens * 2 // 3),
+        }
+
+    def _summarize(self, summary: str, messages: List[BaseMessage]) -> str:
+        try:
+            updated = self.summary_chain.invoke(self._summary_input(summary, messages)).strip()
+        except Exception as e:
+            # Không chặn câu hỏi hiện tại vì lỗi tóm tắt: giữ bản tóm tắt cũ
+            print(f"Không tóm tắt được lịch sử chat: {e}")
+            return summary
+        return truncate_tokens(updated, self.summary_max_tokens)
+
+    async def _asummarize(self, summary: str, messages: List[BaseMessage]) -> str:
+        try:
+            updated = (await self.summary_chain.ainvoke(self._summary_input(summary, messages))).strip()
+        except Exception as e:
+            print(f"Không tóm tắt được lịch sử chat: {e}")
+            return summary
+        return truncate_tokens(updated, self.summary_max_tokens)
+
+    def _plan(self, messages: Sequence[Union[BaseMessage, Dict]], state: Optional[Dict]):
+        """(tin nhắn, đầu cửa sổ, các tin nhắn mới cần gộp vào tóm tắt)."""
+        messages = self._to_messages(messages)
+        start = self._window_start(messages)
+        if state is None:
+            return messages, start, []
+        if state["summarized"] > len(messages):
+            # Lịch sử đã bị xoá (Clear Chat) -> bắt đầu lại
+            state.update(new_history_state())
+        return messages, start, messages[state["summarized"]:start]
+
+    @staticmethod
+    def _compose(messages: List[BaseMessage], state: Dict) -> List[BaseMessage]:
+        history = messages[state["summarized"]:]
+        if state["summary"]:
+            history = [SystemMessage(content=f"Summary of the earlier conversation:\n{state['summary']}")] + history
+        return history
+
+    def build(self, messages: Sequence[Union[BaseMessage, Dict]], state: Optional[Dict] = None) -> List[BaseMessage]:
+        """
+        Lịch sử đưa vào prompt: [tóm tắt] + cửa sổ gần nhất.
+        state=None -> không tóm tắt, chỉ bỏ lượt cũ (vẫn chặn được kích thước prompt).
+        """
+        messages, start, pending = self._plan(messages, state)
+        if state is None:
+            return messages[start:]
+        if pending:
+            state["summary"] = self._summarize(state["summary"], pending)
+            state["summarized"] = start
+        return self._compose(messages, state)
+
+    async def abuild(self, messages: Sequence[Union[BaseMessage, Dict]], state: Optional[Dict] = None) -> List[BaseMessage]:
+        """Như build(), gọi LLM tóm tắt bằng API async."""
+        messages, start, pending = self._plan(messages, state)
+        if state is None:
+            return messages[start:]
+        if pending:
+            state["summary"] = await self._asummarize(state["summary"], pending)
+            state["summarized"] = start
+        return self._compose(messages, state)
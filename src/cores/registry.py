@@ -0,0 +1,251 @@
+import importlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+# Internal Import
+from src.config import config
+
+
+def rss_bytes() -> Optional[int]:
+    """RSS hiện tại của process (Linux /proc), None nếu không đọc được."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _param_bytes(obj: Any, depth: int = 0) -> Optional[int]:
+    """Tổng dung lượng tham số torch của model (đi xuống .base / .client / .model), None nếu không phải model torch."""
+    parameters = getattr(obj, "parameters", None)
+    if callable(parameters):
+        try:
+            return sum(p.numel() * p.element_size() for p in parameters())
+        except Exception:
+            pass
+    if depth >= 3:
+        return None
+    for attr in ("base", "client", "model"):
+        child = getattr(obj, attr, None)
+        if child is not None and child is not obj:
+            size = _param_bytes(child, depth + 1)
+            if size is not None:
+                return size
+    return None
+
+
+class ModelRegistry:
+    """
+    Model + client dùng chung trong process, load lười ở lần dùng đầu tiên:
+    embedder, cross-encoder, VectorDB (Qdrant client / mmap), LLM Groq, nutrient store, parent store.
+    Mọi agent (mọi chế độ reasoning, mọi session) lấy cùng 1 instance -> không load model 2 lần.
+    Mỗi model có lock riêng: load reranker không chặn thread đang chờ embedder.
+    """
+    # Thứ tự warm-up: model nặng nhất, cần cho mọi câu hỏi đứng trước
+    WARMUP_COMPONENTS = ("embeddings", "vectordb", "reranker_model", "llm", "nutrient_store", "parent_store",
+                         "agent_modules")
+    # Module chỉ cần lúc dựng agent (chains langchain_classic, retrievers), import trước trên thread nền
+    AGENT_MODULES = ("langchain_classic.chains.combine_documents", "langchain_classic.retrievers",
+                     "src.cores.CoT_agent")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._item_locks: Dict[str, threading.Lock] = {}
+        self._items: Dict[str, Any] = {}
+        self._reports: Dict[str, Dict[str, Any]] = {}
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._warmup_components: List[str] = []
+        self._warmed: List[str] = []
+        self._warmup_errors: Dict[str, str] = {}
+        self._warmup_timings: Dict[str, Dict[str, float]] = {}
+
+    def _get(self, name: str, loader: Callable[[], Any]) -> Any:
+        if name in self._items:
+            return self._items[name]
+        with self._lock:
+            item_lock = self._item_locks.setdefault(name, threading.Lock())
+        with item_lock:
+            if name not in self._items:
+                rss_before = rss_bytes()
+                start = time.perf_counter()
+                item = loader()
+                rss_after = rss_bytes()
+                self._reports[name] = {
+                    "name": name,
+                    "load_s": round(time.perf_counter() - start, 3),
+                    # Xấp xỉ: gồm cả bộ nhớ của các model con load lần đầu bên trong loader / load song song
+                    "rss_delta_mb": None if rss_before is None or rss_after is None
+                    else round((rss_after - rss_before) / 2**20, 1),
+                    "param_mb": None,
+                }
+                size = _param_bytes(item)
+                if size is not None:
+                    self._reports[name]["param_mb"] = round(size / 2**20, 1)
+                self._items[name] = item
+                print(f"📦 Registry: loaded '{name}' in {self._reports[name]['load_s']}s")
+        return self._items[name]
+
+    # ---------- Models / clients ----------
+    def embeddings(self):
+        """Model embedding (có cache vector trên đĩa), dùng cho ingestion, retrieval và evaluation."""
+        from src.vectordb.embedding_cache import get_embeddings
+        return self._get("embeddings", lambda: get_embeddings(config.EMBEDDING_MODEL))
+
+    def vectordb(self):
+        """VectorDB ở chế độ retrieval: 1 client Qdrant (local path chỉ mở được 1 lần / process) hoặc 1 mmap index."""
+        def load():
+            from src.vectordb.qdrantdb import VectorDB
+            self.embeddings()
+            return VectorDB()
+        return self._get("vectordb", load)
+
+    def reranker_model(self):
+        def load():
+            from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+            print(f"Loading Reranker Model: {config.RERANKER_MODEL}")
+            model = HuggingFaceCrossEncoder(model_name=config.RERANKER_MODEL)
+            if config.MICRO_BATCH:
+                # Lô cặp của các request đồng thời được chấm chung 1 lần gọi model
+                from src.cores.reranker import BatchedCrossEncoder
+                model = BatchedCrossEncoder(model)
+            return model
+        return self._get("reranker", load)
+
+    def reranker(self):
+        """Compressor rerank dùng chung (cả cache điểm (câu hỏi, chunk))."""
+        def load():
+            from src.cores.reranker import CachedCrossEncoderReranker
+            return CachedCrossEncoderReranker.from_config(model=self.reranker_model())
+        return self._get("reranker_compressor", load)
+
+    def llm(self):
+        def load():
+            from langchain_groq import ChatGroq
+            return ChatGroq(
+                model=config.GROQ_MODEL_NAME,
+                api_key=config.GROQ_API_KEY,
+                temperature=0,
+                max_tokens=2048
+            )
+        return self._get("llm", load)
+
+    def nutrient_store(self):
+        """Fast path bảng dinh dưỡng, None nếu tắt NUTRIENT_FAST_PATH / chưa dựng store."""
+        def load():
+            if not config.NUTRIENT_FAST_PATH:
+                return None
+            from src.processing.nutrient_store import NutrientStore
+            store = NutrientStore.load(config.NUTRIENT_STORE_PATH)
+            if store is not None:
+                print(f"... Nutrient Store: {len(store)} thực phẩm ...")
+            return store
+        return self._get("nutrient_store", load)
+
+    def parent_store(self):
+        """Docstore parent section (small-to-big), None nếu index chưa được dựng ở chế độ parent/child."""
+        def load():
+            if not config.PARENT_CHILD:
+                return None
+            from src.vectordb.parent_store import ParentStore
+            store = ParentStore.load(config.PARENT_STORE_PATH)
+            if store is not None:
+                print(f"... Parent Store: {len(store)} parent sections ...")
+            return store
+        return self._get("parent_store", load)
+
+    def agent_modules(self):
+        for module in self.AGENT_MODULES:
+            importlib.import_module(module)
+
+    # ---------- Warm-up ----------
+    def _probe(self, component: str, item: Any):
+        """1 lần gọi thử sau khi load: khởi tạo tokenizer / thread pool của torch trước request đầu tiên."""
+        if component == "embeddings":
+            # Gọi thẳng model gốc, không ghi câu thử vào cache vector
+            getattr(item, "base", item).embed_query("warm up")
+        elif component == "reranker_model":
+            item.score([("warm up", "warm up")])
+
+    def _warm_up(self, components: List[str]):
+        for component in components:
+            try:
+                start = time.perf_counter()
+                item = getattr(self, component)()
+                load_s = time.perf_counter() - start
+                start = time.perf_counter()
+                if item is not None:
+                    self._probe(component, item)
+                probe_s = time.perf_counter() - start
+                self._warmup_timings[component] = {"load_s": round(load_s, 3), "probe_s": round(probe_s, 3)}
+                print(f"🔥 Warm-up '{component}': load {load_s:.2f}s, probe {probe_s:.2f}s")
+            except Exception as e:
+                # Component lỗi không chặn các component sau; request dùng tới nó sẽ báo lỗi như bình thường
+                self._warmup_errors[component] = str(e)
+                print(f"Warm-up '{component}' lỗi: {e}")
+            self._warmed.append(component)
+
+    def warm_up(self, components: Optional[List[str]] = None, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Load trước các model theo WARMUP_COMPONENTS.
+        background=True: chạy trên 1 daemon thread, trả về ngay (UI tương tác được trong lúc load);
+        request tới sớm sẽ chờ đúng model nó cần qua lock của model đó. Gọi lại khi đang warm-up -> không làm gì.
+        """
+        with self._lock:
+            if self._warmup_components:
+                return self._warmup_thread
+            self._warmup_components = list(components or self.WARMUP_COMPONENTS)
+            if background:
+                self._warmup_thread = threading.Thread(target=self._warm_up, args=(self._warmup_components,),
+                                                       name="model-warmup", daemon=True)
+                self._warmup_thread.start()
+                return self._warmup_thread
+        self._warm_up(self._warmup_components)
+        return None
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Chờ warm-up xong (True) hoặc hết timeout (False)."""
+        if self._warmup_thread is not None:
+            self._warmup_thread.join(timeout)
+        return self.warmup_status()["state"] in ("ready", "error")
+
+    def warmup_status(self) -> Dict[str, Any]:
+        """state: "idle" (chưa warm-up) / "warming" / "ready" / "error" (xong nhưng có component lỗi)."""
+        pending = [c for c in self._warmup_components if c not in self._warmed]
+        if not self._warmup_components:
+            state = "idle"
+        elif pending:
+            state = "warming"
+        else:
+            state = "error" if self._warmup_errors else "ready"
+        return {"state": state, "done": list(self._warmed), "pending": pending,
+                "errors": dict(self._warmup_errors), "timings": dict(self._warmup_timings)}
+
+    # ---------- Report ----------
+    def loaded(self) -> List[str]:
+        return list(self._items)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._items
+
+    def memory_report(self) -> List[Dict[str, Any]]:
+        """
+        Mỗi model đã load: thời gian load, RSS tăng thêm lúc load (xấp xỉ) và dung lượng tham số torch (nếu có).
+        rss_total_mb ở dòng "process" là RSS hiện tại của cả process.
+        """
+        report = [dict(self._reports[name]) for name in self._items if name in self._reports]
+        rss = rss_bytes()
+        report.append({"name": "process", "rss_total_mb": None if rss is None else round(rss / 2**20, 1)})
+        return report
+
+
+_REGISTRY: Optional[ModelRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+def get_registry() -> ModelRegistry:
+    """Registry dùng chung trong process."""
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = ModelRegistry()
+        return _REGISTRY
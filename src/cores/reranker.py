@@ -0,0 +1,148 @@
+import hashlib
+from typing import List, Optional, Sequence, Tuple
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor
+from langchain_core.documents import Document as LangChainDocument
+# Internal Import
+from src.config import config
+from src.utils.batching import MicroBatcher
+from src.utils.lru import TTLCache
+from src.vectordb.embedding_cache import normalize_query
+from src.vectordb.hybrid import doc_key
+
+
+def query_hash(query: str) -> str:
+    return hashlib.blake2b(normalize_query(query).encode("utf-8"), digest_size=12).hexdigest()
+
+
+def length_batches(pairs: Sequence[Tuple[str, str]], batch_chars: int, max_batch: int) -> List[List[int]]:
+    """Gom lô động: cặp ngắn -> lô to, cặp dài -> lô nhỏ (giới hạn tổng ký tự / lô)."""
+    order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][1]))
+    batches, batch, size = [], [], 0
+    for i in order:
+        length = len(pairs[i][0]) + len(pairs[i][1])
+        if batch and (size + length > batch_chars or len(batch) >= max_batch):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(i)
+        size += length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def score_in_batches(model, pairs: Sequence[Tuple[str, str]], batch_chars: int, max_batch: int) -> List[float]:
+    """Chấm theo các lô đã sort theo độ dài, trả điểm theo thứ tự ban đầu của pairs."""
+    scores = [0.0] * len(pairs)
+    for batch in length_batches(pairs, batch_chars, max_batch):
+        for i, score in zip(batch, model.score([pairs[i] for i in batch])):
+            scores[i] = float(score)
+    return scores
+
+
+class BatchedCrossEncoder:
+    """
+    Bọc cross-encoder: các lô cặp (câu hỏi, chunk) của nhiều request đồng thời được gom (MicroBatcher)
+    rồi chấm lại theo lô sort độ dài + giới hạn ký tự (RERANK_BATCH_CHARS / RERANK_MAX_BATCH) như khi
+    chấm 1 request. Cùng interface score(pairs) với HuggingFaceCrossEncoder.
+    """
+    def __init__(self, model, max_batch: int = config.MICRO_BATCH_MAX_PAIRS,
+                 max_wait_ms: float = config.MICRO_BATCH_WAIT_MS, name: str = "rerank_pairs",
+                 batch_chars: int = config.RERANK_BATCH_CHARS, model_max_batch: int = config.RERANK_MAX_BATCH,
+                 timeout: float = config.MICRO_BATCH_TIMEOUT):
+        self.model = model
+        self.batcher = MicroBatcher(lambda pairs: score_in_batches(model, pairs, batch_chars, model_max_batch),
+                                    max_batch=max_batch, max_wait_ms=max_wait_ms, name=name, timeout=timeout)
+
+    def score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        return self.batcher.submit(pairs)
+
+
+class CachedCrossEncoderReranker(BaseDocumentCompressor):
+    """
+    Thay thế CrossEncoderReranker, giảm chi phí CPU của bước rerank:
+    - Cache điểm theo (hash câu hỏi, chunk_id), LRU + TTL, dùng chung giữa các request.
+    - Chunk trùng (cùng chunk_id) chỉ chấm 1 lần.
+    - Chunk được cắt còn max_chars ký tự trước khi chấm.
+    - Chấm theo "đợt" theo thứ hạng retrieval; trong mỗi đợt, cặp được sort theo độ dài
+      và gom lô động theo tổng số ký tự (batch_chars) để giảm padding.
+    - Early exit (heuristic, tắt bằng early_exit_score=None): sau 1 đợt, nếu đã có top_n chunk đạt
+      early_exit_score thì không chấm phần còn lại. Dựa trên giả định retrieval đã xếp chunk tốt lên trước;
+      chunk chưa chấm vẫn có thể điểm cao hơn nên top_n không chắc trùng với khi chấm hết.
+    - compress_documents trả về bản sao Document (kèm metadata rerank_score), không sửa Document đầu vào.
+    """
+    model: object
+    top_n: int = 5
+    max_chars: int = 1000
+    batch_chars: int = 8000
+    max_batch: int = 32
+    early_exit_score: Optional[float] = None
+    cache: TTLCache = None
+
+    model_config = {"arbitrary_types_allowed": True, "extra": "forbid"}
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.cache is None:
+            self.cache = TTLCache(maxsize=config.RERANK_CACHE_SIZE, ttl=config.RERANK_CACHE_TTL)
+
+    @classmethod
+    def from_config(cls, model=None) -> "CachedCrossEncoderReranker":
+        if model is None:
+            from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+            model = HuggingFaceCrossEncoder(model_name=config.RERANKER_MODEL)
+        return cls(
+            model=model,
+            top_n=config.RERANK_TOP_N,
+            max_chars=config.RERANK_MAX_CHARS,
+            batch_chars=config.RERANK_BATCH_CHARS,
+            max_batch=config.RERANK_MAX_BATCH,
+            early_exit_score=config.RERANK_EARLY_EXIT_SCORE,
+        )
+
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        if isinstance(self.model, BatchedCrossEncoder):
+            # Batcher tự sort + chia lô sau khi gộp cặp của các request đồng thời
+            return self.model.score(list(pairs))
+        return score_in_batches(self.model, pairs, self.batch_chars, self.max_batch)
+
+    def rerank(self, query: str, documents: Sequence[LangChainDocument]) -> List[Tuple[LangChainDocument, float]]:
+        qhash = query_hash(query)
+        # Khử trùng lặp, giữ thứ tự retrieval
+        unique = {}
+        for doc in documents:
+            unique.setdefault(doc_key(doc), doc)
+        keys = list(unique)
+
+        scored = {}
+        pending = []
+        for key in keys:
+            cached = self.cache.get((qhash, key))
+            if cached is None:
+                pending.append(key)
+            else:
+                scored[key] = cached
+
+        wave = max(self.top_n * 2, 1)
+        for start in range(0, len(pending), wave):
+            if self.early_exit_score is not None:
+                confident = sum(1 for score in scored.values() if score >= self.early_exit_score)
+                if confident >= self.top_n:
+                    break
+            wave_keys = pending[start:start + wave]
+            pairs = [(query, unique[key].page_content[:self.max_chars]) for key in wave_keys]
+            for key, score in zip(wave_keys, self.score_pairs(pairs)):
+                scored[key] = score
+                self.cache.set((qhash, key), score)
+
+        ranked = sorted(scored.items(), key=lambda item: -item[1])
+        return [(unique[key], score) for key, score in ranked]
+
+    def compress_documents(self, documents: Sequence[LangChainDocument], query: str,
+                           callbacks: Callbacks = None) -> Sequence[LangChainDocument]:
+        results = []
+        for doc, score in self.rerank(query, documents)[:self.top_n]:
+            # Document đầu vào có thể dùng chung (cache retrieval / request khác) -> không ghi đè metadata của nó
+            results.append(LangChainDocument(page_content=doc.page_content,
+                                             metadata={**doc.metadata, "rerank_score": round(score, 6)}))
+        return results
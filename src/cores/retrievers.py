@@ -0,0 +1,177 @@
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import BaseDocumentCompressor
+from langchain_core.documents import Document as LangChainDocument
+from langchain_core.retrievers import BaseRetriever
+# Internal Import
+from src.utils.concurrency import run_cpu
+from src.vectordb.hybrid import doc_key, reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+
+def variant_overlap(queries: List[str], results: List[List[LangChainDocument]]) -> List[Dict[str, Any]]:
+    """Với từng biến thể: số hit, và tỉ lệ hit cũng được ít nhất 1 biến thể khác tìm thấy."""
+    keys = [{doc_key(doc) for doc in docs} for docs in results]
+    report = []
+    for i, (query, own) in enumerate(zip(queries, keys)):
+        others = set().union(*(k for j, k in enumerate(keys) if j != i)) if len(keys) > 1 else set()
+        report.append({
+            "query": query,
+            "hits": len(own),
+            "overlap": len(own & others) / len(own) if own else 0.0,
+        })
+    return report
+
+
+def __getattr__(name: str):
+    # BatchedMultiQueryRetriever kế thừa MultiQueryRetriever của langchain_classic (~85 ms import)
+    # -> nằm ở src.cores.multi_query, chỉ import khi thật sự dùng
+    if name == "BatchedMultiQueryRetriever":
+        from src.cores.multi_query import BatchedMultiQueryRetriever
+        return BatchedMultiQueryRetriever
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_TIER_LOCK = threading.Lock()
+
+
+class AdaptiveRetriever(BaseRetriever):
+    """
+    Retrieval theo bậc, chỉ leo bậc khi độ tin cậy thấp:
+    - Tier 1: 1 lần dense search. Đủ tin nếu điểm top-1 >= tier1_min_score và
+      (top-1 tách khỏi phần đuôi >= tier1_margin, hoặc top-1 của BM25 nằm trong top_n dense).
+    - Tier 2: multi-query (1 lần gọi LLM) -> đủ tin nếu phần lớn top_n được >= 2 biến thể cùng tìm thấy.
+    - Tier 3: rerank candidate của tier 2 bằng cross-encoder.
+    Tier phục vụ được ghi vào metadata["retrieval_tier"] của từng Document trả về.
+    Có router -> tier 1 chỉ tìm trong tài liệu được chọn (multi_query tự route).
+    """
+    vectordb: Any
+    multi_query: BaseRetriever
+    reranker: BaseDocumentCompressor
+    router: Any = None
+    top_n: int = 5
+    tier1_min_score: float = 0.55
+    tier1_margin: float = 0.08
+    tier2_min_consensus: float = 0.6
+    tier_counts: Dict[int, int] = {}
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _tier1_gate(self, hits) -> Tuple[Optional[List[LangChainDocument]], bool]:
+        """(top_docs, đủ tin theo margin); top_docs=None nếu điểm top-1 quá thấp."""
+        if not hits:
+            return None, False
+        scores = [score for _, score in hits]
+        if scores[0] < self.tier1_min_score:
+            return None, False
+        tail = scores[self.top_n] if len(scores) > self.top_n else scores[-1]
+        return [doc for doc, _ in hits[:self.top_n]], scores[0] - tail >= self.tier1_margin
+
+    def _sparse_agrees(self, query: str, top_docs: List[LangChainDocument], sources: Optional[List[str]]) -> bool:
+        """Tín hiệu rẻ thứ 2: BM25 đồng ý với dense ở top-1."""
+        sparse_index = getattr(self.vectordb, "sparse_index", None)
+        if sparse_index is None:
+            return False
+        sparse_top = sparse_index.search(query, k=1, sources=sources)
+        return bool(sparse_top) and doc_key(sparse_top[0][0]) in {doc_key(doc) for doc in top_docs}
+
+    def _tier1(self, query: str, sources: Optional[List[str]] = None):
+        hits = self.vectordb.search_with_score(query, k=self.top_n * 2, sources=sources)
+        top_docs, confident = self._tier1_gate(hits)
+        if top_docs is not None and not confident:
+            confident = self._sparse_agrees(query, top_docs, sources)
+        return top_docs if confident else None
+
+    async def _atier1(self, query: str, sources: Optional[List[str]] = None):
+        hits = await self.vectordb.asearch_with_score(query, k=self.top_n * 2, sources=sources)
+        top_docs, confident = self._tier1_gate(hits)
+        if top_docs is not None and not confident:
+            confident = await run_cpu(self._sparse_agrees, query, top_docs, sources)
+        return top_docs if confident else None
+
+    def _consensus(self, docs: List[LangChainDocument]) -> float:
+        top = docs[:self.top_n]
+        if not top:
+            return 0.0
+        return sum(1 for doc in top if doc.metadata.get("variant_hits", 1) >= 2) / len(top)
+
+    def _record(self, docs: List[LangChainDocument], tier: int) -> List[LangChainDocument]:
+        with _TIER_LOCK:
+            self.tier_counts[tier] = self.tier_counts.get(tier, 0) + 1
+        logger.info("Retrieval served by tier %d (%d docs)", tier, len(docs))
+        for doc in docs:
+            doc.metadata["retrieval_tier"] = tier
+        return docs
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[LangChainDocument]:
+        sources = self.router.route(query) if self.router is not None else None
+        docs = self._tier1(query, sources)
+        if docs is not None:
+            return self._record(docs, 1)
+
+        candidates = self.multi_query.invoke(query, config={"callbacks": run_manager.get_child()})
+        if self._consensus(candidates) >= self.tier2_min_consensus:
+            return self._record(candidates[:self.top_n], 2)
+
+        return self._record(list(self.reranker.compress_documents(candidates, query)), 3)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[LangChainDocument]:
+        sources = self.router.route(query) if self.router is not None else None
+        docs = await self._atier1(query, sources)
+        if docs is not None:
+            return self._record(docs, 1)
+
+        candidates = await self.multi_query.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        if self._consensus(candidates) >= self.tier2_min_consensus:
+            return self._record(candidates[:self.top_n], 2)
+
+        reranked = await run_cpu(self.reranker.compress_documents, candidates, query)
+        return self._record(list(reranked), 3)
+
+
+# Điểm / tín hiệu của chunk con được chuyển sang parent
+_CHILD_SIGNALS = ("rerank_score", "rrf_score", "variant_hits", "retrieval_tier")
+
+
+class ParentDocumentRetriever(BaseRetriever):
+    """
+    Small-to-big: tìm + rerank trên chunk con, rồi đổi top kết quả sang parent section.
+    - Nhiều chunk con cùng parent -> 1 parent (giữ thứ hạng của con tốt nhất).
+    - Chỉ parent của kết quả cuối cùng được đọc từ docstore.
+    - Chunk không có parent_id (index cũ) hoặc parent không còn trong store -> giữ nguyên chunk.
+    """
+    retriever: BaseRetriever
+    parent_store: Any
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[LangChainDocument]:
+        children = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self._to_parents(children)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[LangChainDocument]:
+        children = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return await run_cpu(self._to_parents, children)
+
+    def _to_parents(self, children: List[LangChainDocument]) -> List[LangChainDocument]:
+        parents = self.parent_store.get_many([doc.metadata["parent_id"] for doc in children if doc.metadata.get("parent_id")])
+
+        results: Dict[str, LangChainDocument] = {}
+        for child in children:
+            parent = parents.get(child.metadata.get("parent_id"))
+            if parent is None:
+                results.setdefault(doc_key(child), child)
+                continue
+            key = doc_key(parent)
+            if key not in results:
+                metadata = dict(parent.metadata)
+                metadata.update({name: child.metadata[name] for name in _CHILD_SIGNALS if name in child.metadata})
+                metadata["child_ids"] = []
+                results[key] = LangChainDocument(page_content=parent.page_content, metadata=metadata)
+            results[key].metadata["child_ids"].append(doc_key(child))
+        return list(results.values())
@@ -0,0 +1,61 @@
+import re
+from typing import List, Optional
+# Internal Import
+from src.config import config
+from src.utils.text import fold
+
+# Mã số thực phẩm trong bảng TPTP ("mã 1001", "mã số 1001"), so khớp trên chữ đã bỏ dấu
+_FOOD_CODE = re.compile(r"\bma( so)?\s*\d{3,6}\b")
+
+# Dấu hiệu câu hỏi kiến thức / giải thích (giáo trình Human Nutrition)
+_TEXTBOOK_PATTERNS = [re.compile(p) for p in (
+    r"\btai sao\b|\bvi sao\b", r"\bla gi\b", r"\bco che\b", r"\bvai tro\b", r"\bchuc nang\b",
+    r"\banh huong\b", r"\bloi ich\b", r"\btac hai\b", r"\bthieu hut\b|\bthieu chat\b", r"\bhap thu\b",
+    r"\bchuyen hoa\b", r"\bnen an\b|\bkhuyen nghi\b",
+    r"\b(why|what is|what are|explain|how does|role of|function of|benefits?|deficiency|absorption|"
+    r"metabolism|recommend\w*|guideline\w*|disease\w*)\b",
+)]
+
+# Từ tiếng Anh thông dụng: nhận ra câu hỏi tiếng Anh (giáo trình là tài liệu tiếng Anh)
+_ENGLISH_WORDS = {"the", "is", "are", "of", "what", "which", "how", "does", "do", "and", "for", "in", "to", "can", "should"}
+
+
+class QueryRouter:
+    """
+    Router cục bộ (không gọi LLM): câu hỏi nhắm tới bảng TPTP, giáo trình hay cả hai.
+    - Bảng TPTP chỉ khi câu hỏi nhắc cả 1 chất dinh dưỡng lẫn 1 thực phẩm cụ thể (tên trong nutrient store
+      hoặc mã số): "100g ức gà có bao nhiêu protein?". "Người lớn cần bao nhiêu protein?" không lọc.
+    - Chỉ có dấu hiệu kiến thức -> chỉ giáo trình.
+    - Có cả hai / không có gì -> không lọc (None), giữ nguyên recall như trước.
+    Câu hỏi tiếng Anh không có dấu hiệu tra số liệu được xem là câu hỏi giáo trình.
+    """
+    def __init__(self, food_table: str = config.SOURCE_FOOD_TABLE, textbook: str = config.SOURCE_TEXTBOOK,
+                 nutrient_store=None):
+        # Dùng chung alias chất dinh dưỡng + so khớp tên (có dấu) với fast path bảng dinh dưỡng
+        from src.processing.nutrient_store import requested_nutrients
+        self._requested_nutrients = requested_nutrients
+        self.food_table = food_table
+        self.textbook = textbook
+        self.nutrient_store = nutrient_store
+
+    def _names_food(self, query: str, folded: str) -> bool:
+        if _FOOD_CODE.search(folded):
+            return True
+        return self.nutrient_store is not None and self.nutrient_store.mentions_food(query)
+
+    def scores(self, query: str):
+        folded = fold(query)
+        table = int(bool(self._requested_nutrients(folded)) and self._names_food(query, folded))
+        book = sum(1 for pattern in _TEXTBOOK_PATTERNS if pattern.search(folded))
+        if not book and not table and len(_ENGLISH_WORDS.intersection(folded.split())) >= 2:
+            book = 1
+        return table, book
+
+    def route(self, query: str) -> Optional[List[str]]:
+        """Danh sách source cần tìm, None = tất cả."""
+        table, book = self.scores(query)
+        if table and not book:
+            return [self.food_table]
+        if book and not table:
+            return [self.textbook]
+        return None
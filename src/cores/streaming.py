@@ -0,0 +1,88 @@
+from typing import List, Tuple
+
+# Tag -> trạng thái sau khi gặp tag
+_TAGS = {
+    "<thinking>": "thinking",
+    "</thinking>": "outside",
+    "<answer>": "answer",
+    "</answer>": "outside",
+}
+# Không dùng reasoning: chỉ bỏ tag <answer>, mọi text còn lại là answer (giống _parse_output)
+_ANSWER_TAGS = {"<answer>": "answer", "</answer>": "answer"}
+
+
+class TagStreamParser:
+    """
+    Tách <thinking> / <answer> từ output LLM đang stream, từng chunk một, theo cùng quy tắc với _parse_output.
+    - Tag bị cắt giữa 2 chunk ("<thin" + "king>") được giữ lại trong buffer tới khi đủ.
+    - Reasoning: chỉ khối <thinking> đầu tiên là thinking, chỉ khối <answer> đầu tiên là answer.
+      Text ngoài mọi tag được giữ lại: gặp <answer> thì bỏ, hết output mà không có <answer>
+      thì mới là answer (fallback "model quên tag answer").
+    - Không reasoning: không có event thinking, toàn bộ text (trừ tag <answer>) là answer.
+    feed() trả về list (loại, text) với loại là "thinking" hoặc "answer".
+    """
+    def __init__(self, use_reasoning: bool = True):
+        self.use_reasoning = use_reasoning
+        self.tags = _TAGS if use_reasoning else _ANSWER_TAGS
+        self.state = "outside" if use_reasoning else "answer"
+        self.buffer = ""
+        # Text ngoài tag chưa biết thuộc loại nào (chỉ dùng khi reasoning)
+        self.held = ""
+        self.seen_thinking = False
+        self.seen_answer = False
+
+    def _set_state(self, tag: str):
+        state = self.tags[tag]
+        if state == "thinking":
+            state = "skip" if self.seen_thinking else "thinking"
+            self.seen_thinking = True
+        elif state == "answer" and self.use_reasoning:
+            state = "skip" if self.seen_answer else "answer"
+            self.seen_answer = True
+            self.held = ""
+        self.state = state
+
+    def _emit(self, events: List[Tuple[str, str]], text: str):
+        if not text or self.state == "skip":
+            return
+        if self.state == "outside":
+            if not self.seen_answer:
+                self.held += text
+            return
+        kind = self.state
+        if events and events[-1][0] == kind:
+            events[-1] = (kind, events[-1][1] + text)
+        else:
+            events.append((kind, text))
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        self.buffer += text
+        events: List[Tuple[str, str]] = []
+        while self.buffer:
+            idx = self.buffer.find("<")
+            if idx == -1:
+                self._emit(events, self.buffer)
+                self.buffer = ""
+                break
+            self._emit(events, self.buffer[:idx])
+            self.buffer = self.buffer[idx:]
+            tag = next((tag for tag in self.tags if self.buffer.startswith(tag)), None)
+            if tag is not None:
+                self._set_state(tag)
+                self.buffer = self.buffer[len(tag):]
+                continue
+            if any(tag.startswith(self.buffer) for tag in self.tags):
+                # Có thể là đầu của 1 tag -> đợi chunk sau
+                break
+            self._emit(events, "<")
+            self.buffer = self.buffer[1:]
+        return events
+
+    def flush(self) -> List[Tuple[str, str]]:
+        events: List[Tuple[str, str]] = []
+        self._emit(events, self.buffer)
+        self.buffer = ""
+        if not self.seen_answer and self.held.strip():
+            events.append(("answer", self.held))
+        self.held = ""
+        return events
@@ -14,7 +14,6 @@ from ragas.run_config import RunConfig
 from ragas.embeddings import LangchainEmbeddingsWrapper
 
 # Langchain & Embeddings
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_groq import ChatGroq
 # Utility
 from rapidfuzz import fuzz
@@ -22,6 +21,7 @@ from rapidfuzz import fuzz
 # Internal imports
 from src.cores.CoT_agent import NutriAgentReseacher
 from src.config import config
+from src.cores.registry import get_registry
 
 # =====================
 # PATH SETUP
@@ -173,8 +173,8 @@ if __name__ == "__main__":
             temperature=0
         )
         judge_llm = LangchainLLMWrapper(judge_model)
-        hf_embeddings = HuggingFaceEmbeddings(model_name=config.EMBEDDING_MODEL)
-        ragas_embeddings = LangchainEmbeddingsWrapper(hf_embeddings)
+        # Dùng lại model + cache embedding của agent, không load bản thứ 2
+        ragas_embeddings = LangchainEmbeddingsWrapper(get_registry().embeddings())
         
         # dataset and metrics
         ragas_ds = Dataset.from_list(samples)
@@ -199,6 +199,8 @@ if __name__ == "__main__":
         # trả về pandas
         df = result.to_pandas()
         df.to_csv(BASE_DIR / "ragas_result.csv", index=False, encoding="utf-8-sig")
+        for row in get_registry().memory_report():
+            print(f"Memory: {row}")
         print("Done!")
 
     except Exception as e:
@@ -1,40 +1,45 @@
 import os
-import pickle
 from llama_parse import LlamaParse
-from typing import List
+from typing import Iterator, List, Tuple
 from langchain_core.documents import Document as LangChainDocument
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 # Internal Import
 from src.config import config 
-from src.utils.helpers import fix_encoding, clean_broken_layout
+from src.utils.helpers import fix_encoding_batch, clean_broken_layout, batched, make_chunk_id
+from src.processing.local_parser import LocalPDFParser
+from src.processing.page_cache import ParseCache, CLEANER_VERSION
+from src.processing.markdown_table import (
+    SEPARATOR_ROW, compact_row, find_page_food_code, row_food_code,
+    separator_for, split_markdown_blocks
+)
 
 class ProcessDocuments:
-    def __init__(self):
+    def __init__(self, backend: str = config.PARSER_BACKEND):
+        self.backend = backend
         self.cache_dir = os.path.join(config.DATA_DIR, "cache_parse")
         os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _cache_name(self, name):
+        # Mỗi backend có cache riêng để không lẫn kết quả LlamaParse và local
+        return name if self.backend == "llamaparse" else f"{name}_{self.backend}"
     
-    def _load_from_cache(self, cache_name):
-        cache_path = os.path.join(self.cache_dir, f"{cache_name}.pkl")
-        if os.path.exists(cache_path):
-            print(f"Load cache_parse: {cache_name}")
-            with open(cache_path, "rb") as f:
-                return pickle.load(f)
-        return None
-    
-    def _save_to_cache(self, documents, cache_name):
-        cache_path = os.path.join(self.cache_dir, f"{cache_name}.pkl")
-        with open(cache_path, "wb") as f:
-            pickle.dump(documents, f)
-        print(f"Saved cache_parse: {cache_name}")
+    def _open_cache(self, cache_name, pdf_path) -> ParseCache:
+        # Cache khoá theo hash nội dung PDF -> PDF đổi thì tự parse lại
+        cache = ParseCache(self.cache_dir, cache_name, pdf_path)
+        cache.prune()
+        # Cache .pkl của phiên bản trước -> chuyển sang JSONL thay vì parse lại
+        cache.migrate_legacy()
+        return cache
     
     # Hàm phụ trợ chuyển đổi LlamaDoc -> LangChainDoc
     def _convert_to_langchain(self, llama_docs, source_name):
         langchain_docs = []
-        for doc in llama_docs:
+        for page_number, doc in enumerate(llama_docs, start=1):
             lc_doc = LangChainDocument(
                 page_content=doc.text, # Lấy nội dung text
                 metadata={
                     "source": source_name,
+                    "page": page_number, # LlamaParse trả về 1 document / trang
                     **doc.metadata # Copy metadata gốc
                 }
             )
@@ -42,14 +47,17 @@ class ProcessDocuments:
         
         return langchain_docs
 
-    def load_english_textbook(self):
-        CACHE_NAME = "textbook_en_parsed"
-        
-        # Check cache
-        cached = self._load_from_cache(CACHE_NAME)
-        if cached: return cached
+    def _local_parser(self):
+        return LocalPDFParser(
+            max_workers=config.PARSER_WORKERS,
+            pages_per_task=config.PARSER_PAGES_PER_TASK
+        )
+
+    def _parse_english_textbook(self):
+        print(f"Parsing TextBook EN ({self.backend})...")
+        if self.backend == "local":
+            return self._local_parser().load_data(config.PATH_TEXTBOOK_EN, "Human Nutrition Text")
 
-        print(f"Parsing TextBook EN...")
         parser = LlamaParse(
             api_key = config.LLAMA_CLOUD_API_KEY,
             result_type="markdown", 
@@ -61,50 +69,17 @@ class ProcessDocuments:
         llama_docs = parser.load_data(config.PATH_TEXTBOOK_EN)
         
         # convert sang langchain
-        final_docs = self._convert_to_langchain(llama_docs, "Human Nutrition Text")
-        
-        # Save cache
-        self._save_to_cache(final_docs, CACHE_NAME)
-        return final_docs
+        return self._convert_to_langchain(llama_docs, "Human Nutrition Text")
 
-    def load_vietnamese_table(self):
-        CACHE_NAME = "food_table_vn_parsed"
-        
-        # 1. Load file Cache cũ lên
-        docs = self._load_from_cache(CACHE_NAME)
-        
-        # --- [LOGIC TỰ ĐỘNG FIX VÀ LƯU] ---
-        if docs:
-            print(f"📂 Đã tìm thấy Cache '{CACHE_NAME}'. Đang kiểm tra chất lượng dữ liệu...")
-            count_fixed = 0
-            is_modified = False 
-            
-            for doc in docs:
-                original_text = doc.page_content
-                
-                # Gọi hàm sửa lỗi
-                fixed_text = fix_encoding(original_text)
-                cleaned_text = clean_broken_layout(fixed_text)
-                
-                # Nếu có thay đổi thì cập nhật
-                if original_text != cleaned_text:
-                    doc.page_content = cleaned_text
-                    count_fixed += 1
-                    is_modified = True 
-            
-            if count_fixed > 0:
-                print(f"Đã tự động sửa lỗi hiển thị cho {count_fixed} trang tài liệu.")
-            
-            if is_modified:
-                self._save_to_cache(docs, CACHE_NAME)
-                print("Đã lưu Cache mới! Lần sau load sẽ không cần sửa nữa.")
-            else:
-                print("Dữ liệu trong Cache đã sạch đẹp. Không cần xử lý thêm.")
-
-            return docs
-
-        # --- TRƯỜNG HỢP KHÔNG CÓ CACHE (Parse mới từ đầu) ---
-        print(f"Không thấy Cache. Bắt đầu Parse Food Table VN từ LlamaCloud...")
+    def _parse_vietnamese_table(self):
+        if self.backend == "local":
+            print(f"Bắt đầu Parse Food Table VN bằng local parser...")
+            # tables=True -> dựng lại bảng thành Markdown Table
+            return self._local_parser().load_data(
+                config.PATH_FOOD_TABLE_VN, "Vietnamese Food Table", tables=True
+            )
+
+        print(f"Bắt đầu Parse Food Table VN từ LlamaCloud...")
         parser = LlamaParse(
             api_key = config.LLAMA_CLOUD_API_KEY,
             result_type="markdown",
@@ -116,20 +91,69 @@ class ProcessDocuments:
         llama_docs = parser.load_data(config.PATH_FOOD_TABLE_VN)
         
         # Convert sang LangChain
-        final_docs = self._convert_to_langchain(llama_docs, "Vietnamese Food Table")
-        for doc in final_docs:
-            doc.page_content = fix_encoding(doc.page_content)
-            doc.page_content = clean_broken_layout(doc.page_content)
+        return self._convert_to_langchain(llama_docs, "Vietnamese Food Table")
 
-        # Lưu cache lại
-        self._save_to_cache(final_docs, CACHE_NAME)
+    @staticmethod
+    def _clean_pages(docs, batch_size: int = 32):
+        """Sửa lỗi font + layout theo lô trang (chạy lazy, vẫn stream từng trang ra ngoài)."""
+        for batch in batched(docs, batch_size):
+            fixed = fix_encoding_batch([doc.page_content for doc in batch])
+            for doc, text in zip(batch, fixed):
+                doc.page_content = clean_broken_layout(text)
+                yield doc
+
+    def iter_english_textbook(self) -> Iterator[LangChainDocument]:
+        """Stream từng trang TextBook EN (đọc lazy từ cache nếu có)."""
+        cache = self._open_cache(self._cache_name("textbook_en_parsed"), config.PATH_TEXTBOOK_EN)
+        raw = cache.raw_store()
         
-        return final_docs
+        # Check cache
+        if raw.exists():
+            print(f"Load cache_parse: textbook_en ({len(raw)} trang)")
+            yield from raw
+            return
+
+        yield from raw.write(self._parse_english_textbook())
+        print(f"Saved cache_parse: textbook_en")
+
+    def iter_vietnamese_table(self) -> Iterator[LangChainDocument]:
+        """
+        Stream từng trang Food Table VN đã làm sạch.
+        - Có cache clean đúng version -> đọc thẳng, không chạy lại fix_encoding.
+        - Chỉ có cache raw (bộ làm sạch vừa đổi) -> làm sạch lại từ raw, không parse lại PDF.
+        - Không có gì -> parse, lưu raw, làm sạch, lưu clean.
+        """
+        cache = self._open_cache(self._cache_name("food_table_vn_parsed"), config.PATH_FOOD_TABLE_VN)
+        clean, raw = cache.clean_store(), cache.raw_store()
+
+        if clean.exists():
+            print(f"📂 Load cache_parse đã làm sạch: food_table_vn ({len(clean)} trang, cleaner {CLEANER_VERSION})")
+            yield from clean
+            return
+
+        if raw.exists():
+            print(f"📂 Cache chưa làm sạch với cleaner {CLEANER_VERSION}. Đang làm sạch lại từ bản parse gốc...")
+            pages = iter(raw)
+        else:
+            print(f"Không thấy Cache.")
+            pages = raw.write(self._parse_vietnamese_table())
+
+        yield from clean.write(self._clean_pages(pages))
+        print(f"Saved cache_parse: food_table_vn (cleaner {CLEANER_VERSION})")
+
+    def load_english_textbook(self) -> List[LangChainDocument]:
+        return list(self.iter_english_textbook())
+
+    def load_vietnamese_table(self) -> List[LangChainDocument]:
+        return list(self.iter_vietnamese_table())
 
 
 class TextSplitter:
-    def __init__(self, chunk_size: int = config.CHUNK_SIZE, chunk_overlap: int = config.CHUNK_OVERLAP):
+    def __init__(self, chunk_size: int = config.CHUNK_SIZE, chunk_overlap: int = config.CHUNK_OVERLAP,
+                 table_aware: bool = config.TABLE_AWARE_SPLIT):
         
+        self.chunk_size = chunk_size
+        self.table_aware = table_aware
         self.splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -137,5 +161,96 @@ class TextSplitter:
         )
 
     def split(self, documents : List[str]):
-        chunks = self.splitter.split_documents(documents)
-        return chunks
\ No newline at end of file
+        if not self.table_aware:
+            return self.splitter.split_documents(documents)
+
+        chunks = []
+        for doc in documents:
+            page_code = find_page_food_code(doc.page_content)
+            for is_table, block in split_markdown_blocks(doc.page_content):
+                if is_table:
+                    chunks.extend(self._split_table(block, doc.metadata, page_code))
+                elif block.strip():
+                    # Văn xuôi vẫn dùng recursive splitter như cũ
+                    prose = LangChainDocument(page_content=block, metadata=dict(doc.metadata))
+                    chunks.extend(self.splitter.split_documents([prose]))
+        return chunks
+
+    def _split_table(self, lines: List[str], metadata: dict, page_code: str = None) -> List[LangChainDocument]:
+        """
+        1 chunk = header (lặp lại) + 1 hoặc vài dòng dữ liệu, không bao giờ cắt giữa dòng.
+        Mã thực phẩm (cột đầu hoặc 'Mã số' của trang) được giữ trong metadata.
+        """
+        rows = [compact_row(line) for line in lines]
+        header, rows = rows[0], rows[1:]
+        if rows and SEPARATOR_ROW.match(rows[0]):
+            rows = rows[1:]
+        # Bỏ các dòng separator / header bị lặp lại giữa bảng
+        rows = [row for row in rows if row != header and not SEPARATOR_ROW.match(row)]
+        head = f"{header}\n{separator_for(header)}"
+        if not rows:
+            return [LangChainDocument(page_content=head, metadata={**metadata, "content_type": "table"})]
+
+        chunks, group = [], []
+        for row in rows:
+            if group and len(head) + sum(len(r) + 1 for r in group) + len(row) + 1 > self.chunk_size:
+                chunks.append(self._table_chunk(head, group, metadata, page_code))
+                group = []
+            group.append(row)
+        chunks.append(self._table_chunk(head, group, metadata, page_code))
+        return chunks
+
+    @staticmethod
+    def _table_chunk(head: str, rows: List[str], metadata: dict, page_code: str = None) -> LangChainDocument:
+        codes = [code for code in (row_food_code(row) for row in rows) if code]
+        if not codes and page_code:
+            codes = [page_code]
+        chunk_metadata = {**metadata, "content_type": "table_row"}
+        if codes:
+            chunk_metadata["food_code"] = codes[0]
+            chunk_metadata["food_codes"] = codes
+        return LangChainDocument(page_content=head + "\n" + "\n".join(rows), metadata=chunk_metadata)
+
+
+class ParentChildSplitter:
+    """
+    Small-to-big: tách riêng đơn vị để tìm kiếm và đơn vị đưa cho LLM.
+    - Parent: 1 khối của trang (đoạn văn xuôi hoặc cả bảng), tối đa parent_max_chars, lưu ở docstore.
+    - Child: chunk nhỏ cắt từ parent (bảng vẫn giữ header), dùng để embed / BM25;
+      metadata["parent_id"] trỏ về chunk_id của parent.
+    """
+    def __init__(self, child_size: int = config.CHILD_CHUNK_SIZE, child_overlap: int = config.CHILD_CHUNK_OVERLAP,
+                 parent_max_chars: int = config.PARENT_MAX_CHARS, table_aware: bool = config.TABLE_AWARE_SPLIT):
+        self.table_aware = table_aware
+        self.parent = TextSplitter(chunk_size=parent_max_chars, chunk_overlap=0, table_aware=table_aware)
+        self.child = TextSplitter(chunk_size=child_size, chunk_overlap=child_overlap, table_aware=table_aware)
+
+    def _parents(self, doc: LangChainDocument) -> List[Tuple[LangChainDocument, str]]:
+        """(parent, page_code) của 1 trang."""
+        if not self.table_aware:
+            return [(parent, None) for parent in self.parent.splitter.split_documents([doc])]
+        page_code = find_page_food_code(doc.page_content)
+        parents = []
+        for is_table, block in split_markdown_blocks(doc.page_content):
+            if is_table:
+                parents.extend(self.parent._split_table(block, doc.metadata, page_code))
+            elif block.strip():
+                prose = LangChainDocument(page_content=block, metadata=dict(doc.metadata))
+                parents.extend(self.parent.splitter.split_documents([prose]))
+        return [(parent, page_code) for parent in parents]
+
+    def split(self, documents: List[LangChainDocument]) -> Tuple[List[LangChainDocument], List[LangChainDocument]]:
+        parents, children = [], []
+        for doc in documents:
+            for parent, page_code in self._parents(doc):
+                parent_id = parent.metadata["chunk_id"] = make_chunk_id(parent)
+                if parent.metadata.get("content_type") in ("table", "table_row"):
+                    kids = self.child._split_table(parent.page_content.split("\n"), doc.metadata, page_code)
+                else:
+                    kids = self.child.splitter.split_documents([parent])
+                for kid in kids:
+                    kid.metadata.pop("chunk_id", None)
+                    kid.metadata["parent_id"] = parent_id
+                parents.append(parent)
+                children.extend(kids)
+        return parents, children
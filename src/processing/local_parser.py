@@ -0,0 +1,95 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import pdfplumber
+from pypdf import PdfReader
+from langchain_core.documents import Document as LangChainDocument
+
+
+# ===== Hàm chạy trong worker process (phải ở top-level để pickle được) =====
+
+def _table_to_markdown(rows: List[List]) -> str:
+    """Dựng lại 1 bảng pdfplumber thành Markdown Table (dòng đầu là header)."""
+    rows = [[(cell or "").replace("\n", " ").strip() for cell in row] for row in rows if row]
+    rows = [row for row in rows if any(row)]
+    if not rows:
+        return ""
+
+    n_cols = max(len(row) for row in rows)
+    rows = [row + [""] * (n_cols - len(row)) for row in rows]
+    header, body = rows[0], rows[1:]
+
+    lines = [
+        "| " + " | ".join(header) + " |",
+        "|" + "---|" * n_cols,
+    ]
+    lines.extend("| " + " | ".join(row) + " |" for row in body)
+    return "\n".join(lines)
+
+def _page_to_markdown(page) -> str:
+    """Trang có bảng: phần chữ ngoài bảng + các bảng dạng Markdown."""
+    tables = page.find_tables()
+    if not tables:
+        return page.extract_text() or ""
+
+    # Phần chữ nằm ngoài vùng bảng (tiêu đề, chú thích...)
+    outside = page
+    for table in tables:
+        outside = outside.outside_bbox(table.bbox)
+    parts = [outside.extract_text() or ""]
+    parts.extend(_table_to_markdown(table.extract()) for table in tables)
+    return "\n\n".join(part for part in parts if part.strip())
+
+def _extract_page_range(pdf_path: str, start: int, end: int, tables: bool) -> List[Tuple[int, str]]:
+    """Trích xuất các trang [start, end) của 1 PDF. Trả về (số trang 1-based, text)."""
+    results = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for idx in range(start, end):
+            page = pdf.pages[idx]
+            text = _page_to_markdown(page) if tables else (page.extract_text() or "")
+            results.append((idx + 1, text))
+            page.close() # Giải phóng cache layout của pdfplumber
+    return results
+
+
+class LocalPDFParser:
+    """
+    Backend parse PDF chạy local (pdfplumber), thay thế LlamaParse khi cần.
+    PDF được chia thành các khoảng trang và trích xuất song song trên process pool.
+    """
+    def __init__(self, max_workers: int = None, pages_per_task: int = 16):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = max(1, pages_per_task)
+
+    def _page_ranges(self, n_pages: int) -> List[Tuple[int, int]]:
+        return [
+            (start, min(start + self.pages_per_task, n_pages))
+            for start in range(0, n_pages, self.pages_per_task)
+        ]
+
+    def load_data(self, pdf_path: str, source_name: str, tables: bool = False) -> List[LangChainDocument]:
+        n_pages = len(PdfReader(pdf_path).pages)
+        ranges = self._page_ranges(n_pages)
+        print(f"Local parse: {n_pages} trang, {len(ranges)} tasks, {self.max_workers} workers")
+
+        pages = []
+        if self.max_workers == 1 or len(ranges) == 1:
+            for start, end in ranges:
+                pages.extend(_extract_page_range(pdf_path, start, end, tables))
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(_extract_page_range, pdf_path, start, end, tables)
+                    for start, end in ranges
+                ]
+                # Giữ đúng thứ tự trang
+                for future in futures:
+                    pages.extend(future.result())
+
+        return [
+            LangChainDocument(
+                page_content=text,
+                metadata={"source": source_name, "page": page_number, "file_path": pdf_path}
+            )
+            for page_number, text in pages
+        ]
@@ -0,0 +1,47 @@
+import re
+from typing import List, Optional
+
+# ===== Helper nhận diện Markdown Table (dùng chung cho chunking và nutrient store) =====
+SEPARATOR_ROW = re.compile(r'^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$')
+FOOD_CODE = re.compile(r'^\d{3,6}$')
+PAGE_FOOD_CODE = re.compile(r'(?:Mã\s*số|Ma\s*so)\s*[:\-|]?\s*\|?\s*([0-9]{3,6})', re.IGNORECASE)
+
+def split_markdown_blocks(text: str):
+    """Tách trang thành các khối liên tiếp (is_table, nội dung); khối bảng là list các dòng '|...'."""
+    blocks, prose, table = [], [], []
+    for line in text.split("\n"):
+        if line.lstrip().startswith("|"):
+            if prose:
+                blocks.append((False, "\n".join(prose)))
+                prose = []
+            table.append(line.strip())
+        else:
+            if table:
+                blocks.append((True, table))
+                table = []
+            prose.append(line)
+    if table:
+        blocks.append((True, table))
+    if prose:
+        blocks.append((False, "\n".join(prose)))
+    return blocks
+
+def cells(row: str) -> List[str]:
+    return [cell.strip() for cell in row.strip().strip("|").split("|")]
+
+def compact_row(row: str) -> str:
+    # Bỏ khoảng trắng đệm trong ô -> chunk gọn hơn, ít token hơn
+    return "| " + " | ".join(cells(row)) + " |"
+
+def separator_for(header: str) -> str:
+    return "|" + "---|" * len(cells(header))
+
+def row_food_code(row: str) -> Optional[str]:
+    row_cells = cells(row)
+    if row_cells and FOOD_CODE.match(row_cells[0]):
+        return row_cells[0]
+    return None
+
+def find_page_food_code(text: str) -> Optional[str]:
+    match = PAGE_FOOD_CODE.search(text)
+    return match.group(1) if match else None
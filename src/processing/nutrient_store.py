@@ -0,0 +1,343 @@
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from rapidfuzz import fuzz, process
+from langchain_core.documents import Document as LangChainDocument
+# Internal Import
+from src.processing.markdown_table import (
+    SEPARATOR_ROW, cells, find_page_food_code, split_markdown_blocks
+)
+from src.utils.text import fold
+
+# Tên chất dinh dưỡng -> các cách gọi (đã bỏ dấu, viết thường)
+NUTRIENT_ALIASES = {
+    "energy": ["nang luong", "calo", "calorie", "calories", "kcal", "energy"],
+    "protein": ["protein", "chat dam", "dam"],
+    "lipid": ["lipid", "chat beo", "beo", "fat"],
+    "glucid": ["glucid", "carbohydrate", "carbohydrat", "carb", "tinh bot", "duong bot"],
+    "fiber": ["chat xo", "xo", "celluloza", "cellulose", "fiber", "fibre"],
+    "calcium": ["canxi", "calci", "calcium"],
+    "iron": ["sat", "iron"],
+    "phosphorus": ["photpho", "phospho", "phosphorus"],
+    "vitamin_c": ["vitamin c"],
+}
+NUTRIENT_LABELS = {
+    "energy": "Năng lượng", "protein": "Protein", "lipid": "Lipid", "glucid": "Glucid",
+    "fiber": "Chất xơ", "calcium": "Calci", "iron": "Sắt", "phosphorus": "Phospho",
+    "vitamin_c": "Vitamin C",
+}
+_ALIAS_PATTERNS = {
+    key: re.compile(r"\b(?:" + "|".join(re.escape(a) for a in aliases) + r")\b")
+    for key, aliases in NUTRIENT_ALIASES.items()
+}
+# Alias ngắn trùng với từ thường khi bỏ dấu ("giảm béo", "sát", "đậm"...):
+# trong câu hỏi chỉ tính khi đứng ngay sau cụm hỏi số liệu ("bao nhiêu sắt", "hàm lượng chất béo")
+_WEAK_ALIASES = {"dam", "beo", "xo", "sat"}
+_AMOUNT_WORDS = r"(?:bao nhieu|ham luong|luong|how much)"
+_QUERY_ALIAS_PATTERNS = {}
+for _key, _aliases in NUTRIENT_ALIASES.items():
+    _strong = [re.escape(a) for a in _aliases if a not in _WEAK_ALIASES]
+    _weak = [re.escape(a) for a in _aliases if a in _WEAK_ALIASES]
+    _parts = [r"\b(?:" + "|".join(_strong) + r")\b"] if _strong else []
+    if _weak:
+        _parts.append(r"\b" + _AMOUNT_WORDS + r"\s+(?:\w+\s+){0,1}(?:" + "|".join(_weak) + r")\b")
+    _QUERY_ALIAS_PATTERNS[_key] = re.compile("|".join(_parts))
+# Câu hỏi số liệu: "bao nhiêu", "hàm lượng", "how much", hoặc 1 lượng có đơn vị ("100g", "200 kcal").
+# Câu hỏi tư vấn ("ăn ức gà có giúp giảm béo không?") đi qua retrieval bình thường.
+_NUMERIC_INTENT = re.compile(
+    r"\b(?:bao nhieu|ham luong|how much|how many|amount of)\b|"
+    r"\b\d+(?:[.,]\d+)?\s*(?:g|gr|gram|grams|kg|mg|mcg|ml|kcal|calo|calories)\b"
+)
+_UNIT = re.compile(r"\((kcal|kj|g|mg|µg|mcg|ug)\)", re.IGNORECASE)
+_NUMBER = re.compile(r"^-?\d+(?:[.,]\d+)?$")
+_PAGE_FOOD_NAME = re.compile(r"Tên\s*(?:thực phẩm)?\s*[:|]\s*([^|\n]+)", re.IGNORECASE)
+# Từ không thuộc tên thực phẩm trong câu hỏi (bỏ trước khi so khớp tên)
+_QUERY_NOISE = re.compile(
+    r"\b(\d+(?:[.,]\d+)?\s*(?:g|gr|gram|kg|ml)?|bao nhieu|chua|co|trong|cua|la|how much|how many|"
+    r"in|of|per|does|contain|contains|what|is|the|ham luong|luong)\b"
+)
+
+
+def _words(text: str) -> List[str]:
+    """Từ giữ nguyên dấu (NFC, viết thường) để so khớp tên thực phẩm."""
+    return re.findall(r"\w+", unicodedata.normalize("NFC", text.lower()))
+
+def requested_nutrients(folded_query: str) -> List[str]:
+    """Các chất dinh dưỡng câu hỏi (đã bỏ dấu) nhắc tới; alias ngắn chỉ tính sau cụm hỏi số liệu."""
+    return [key for key, pattern in _QUERY_ALIAS_PATTERNS.items() if pattern.search(folded_query)]
+
+def _parse_number(cell: str) -> float:
+    cell = cell.strip().replace(" ", "")
+    if not _NUMBER.match(cell):
+        return float("nan")
+    return float(cell.replace(",", "."))
+
+def _nutrient_of(label: str) -> Optional[str]:
+    folded = fold(label)
+    for key, pattern in _ALIAS_PATTERNS.items():
+        if pattern.search(folded):
+            return key
+    return None
+
+
+class NutrientStoreBuilder:
+    """
+    Gom dữ liệu dinh dưỡng từ các trang Markdown của Bảng TPTP VN lúc ingestion.
+    Hỗ trợ 2 dạng bảng:
+    - Mỗi dòng là 1 thực phẩm (cột Mã số / Tên thực phẩm / Protein (g) ...).
+    - Mỗi trang là 1 thực phẩm ('Mã số: 1001'), mỗi dòng là 1 chất dinh dưỡng.
+    """
+    def __init__(self):
+        self.records: Dict[str, dict] = {}
+        self.units: Dict[str, str] = {}
+
+    def _record(self, code: Optional[str], name: Optional[str], page) -> dict:
+        key = code or fold(name)
+        record = self.records.setdefault(key, {"code": code or "", "name": name or "", "page": page, "values": {}})
+        if name and not record["name"]:
+            record["name"] = name
+        return record
+
+    def add_page(self, doc: LangChainDocument):
+        page = doc.metadata.get("page", -1)
+        for is_table, lines in split_markdown_blocks(doc.page_content):
+            if is_table:
+                self._add_table(lines, doc.page_content, page)
+
+    def _add_table(self, lines: List[str], page_text: str, page):
+        rows = [cells(line) for line in lines if not SEPARATOR_ROW.match(line)]
+        if len(rows) < 2:
+            return
+        header = rows[0]
+        folded_header = [fold(h) for h in header]
+        name_col = next((i for i, h in enumerate(folded_header) if "ten" in h or "name" in h), None)
+        code_col = next((i for i, h in enumerate(folded_header) if h.startswith("ma") or "code" in h), None)
+        nutrient_cols = {i: _nutrient_of(h) for i, h in enumerate(header) if i not in (name_col, code_col)}
+        nutrient_cols = {i: key for i, key in nutrient_cols.items() if key}
+
+        if name_col is not None and nutrient_cols:
+            # Dạng 1: mỗi dòng 1 thực phẩm
+            for i, key in nutrient_cols.items():
+                unit = _UNIT.search(header[i])
+                if unit:
+                    self.units.setdefault(key, unit.group(1))
+            for row in rows[1:]:
+                if row == header or len(row) <= name_col or not row[name_col]:
+                    continue
+                code = row[code_col] if code_col is not None and code_col < len(row) else None
+                record = self._record(code, row[name_col], page)
+                for i, key in nutrient_cols.items():
+                    if i < len(row):
+                        value = _parse_number(row[i])
+                        if not np.isnan(value):
+                            record["values"][key] = value
+            return
+
+        # Dạng 2: trang 1 thực phẩm, mỗi dòng 1 chất dinh dưỡng
+        code = find_page_food_code(page_text)
+        name_match = _PAGE_FOOD_NAME.search(page_text)
+        name = name_match.group(1).strip() if name_match else None
+        if not code and not name:
+            return
+        record = self._record(code, name, page)
+        for row in rows:
+            key = _nutrient_of(row[0]) if row else None
+            if not key:
+                continue
+            numbers = [_parse_number(c) for c in row[1:]]
+            numbers = [n for n in numbers if not np.isnan(n)]
+            if numbers:
+                record["values"][key] = numbers[0]
+            unit = next((c for c in row[1:] if fold(c) in ("kcal", "kj", "g", "mg", "µg", "mcg")), None)
+            if unit:
+                self.units.setdefault(key, unit)
+
+    def build(self) -> "NutrientStore":
+        records = [r for r in self.records.values() if r["values"] and r["name"]]
+        keys = sorted({k for r in records for k in r["values"]})
+        columns = {
+            key: np.array([r["values"].get(key, np.nan) for r in records], dtype=np.float32)
+            for key in keys
+        }
+        return NutrientStore(
+            codes=np.array([r["code"] for r in records], dtype=str),
+            names=np.array([r["name"] for r in records], dtype=str),
+            pages=np.array([r["page"] for r in records], dtype=np.int32),
+            columns=columns,
+            units={k: self.units.get(k, "kcal" if k == "energy" else "g") for k in keys},
+        )
+
+
+class NutrientStore:
+    """
+    Bảng dinh dưỡng dạng cột trong RAM: mỗi chất dinh dưỡng là 1 mảng NumPy float32
+    (NaN = không có số liệu), tra theo mã hoặc tên thực phẩm.
+    Dùng làm fast path cho câu hỏi kiểu "100g ức gà chứa bao nhiêu protein?".
+    """
+    def __init__(self, codes, names, pages, columns: Dict[str, np.ndarray], units: Dict[str, str]):
+        self.codes = codes
+        self.names = names
+        self.pages = pages
+        self.columns = columns
+        self.units = units
+        self._folded_names = [fold(str(name)) for name in names]
+        # (từ có dấu, từ bỏ dấu) của từng tên: khớp có dấu trước, bỏ dấu chỉ là phương án dự phòng
+        self._name_words = [(words, [fold(w) for w in words]) for words in (_words(str(name)) for name in names)]
+        self._code_index = {str(code): i for i, code in enumerate(codes) if code}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    # ---------- Persist ----------
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        keys = list(self.columns)
+        np.savez_compressed(
+            path,
+            codes=self.codes, names=self.names, pages=self.pages,
+            unit_keys=np.array(keys, dtype=str),
+            unit_values=np.array([self.units[k] for k in keys], dtype=str),
+            **{f"col_{k}": v for k, v in self.columns.items()},
+        )
+        print(f"Saved nutrient store: {len(self)} thực phẩm, {len(keys)} chất dinh dưỡng -> {path}")
+
+    @classmethod
+    def load(cls, path: str) -> Optional["NutrientStore"]:
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            columns = {name[len("col_"):]: data[name] for name in data.files if name.startswith("col_")}
+            units = dict(zip(data["unit_keys"].tolist(), data["unit_values"].tolist()))
+            return cls(data["codes"], data["names"], data["pages"], columns, units)
+
+    # ---------- Lookup ----------
+    @staticmethod
+    def _accents_agree(words: List[str], folded: List[str], name_words: List[str]) -> bool:
+        """Từ người dùng gõ có dấu phải đúng dấu của tên; từ gõ không dấu thì khớp mọi dấu."""
+        return all(w == f or w == n for w, f, n in zip(words, folded, name_words))
+
+    def _contained_food(self, query: str) -> Tuple[Optional[int], bool]:
+        """
+        Tên thực phẩm xuất hiện trọn từ trong câu hỏi, ưu tiên tên dài nhất. Trả về (idx, ambiguous).
+        - Khớp có dấu trước: "cá chứa" không khớp "Cà chua", "của" không khớp "Cua".
+        - Không tên nào khớp có dấu -> nhận khớp bỏ dấu nếu dấu không mâu thuẫn ("ca chua" gõ không dấu).
+        - ambiguous=True: khớp bỏ dấu dài nhất khác khớp có dấu / mâu thuẫn dấu -> không dùng fast path.
+        """
+        words = _words(query)
+        folded = [fold(w) for w in words]
+        exact, loose, loose_agrees = None, None, False
+        for idx, (name_words, name_folded) in enumerate(self._name_words):
+            n = len(name_folded)
+            size = len(self._folded_names[idx])
+            if not n or size < 2:
+                continue
+            for i in range(len(folded) - n + 1):
+                if folded[i:i + n] != name_folded:
+                    continue
+                if words[i:i + n] == name_words:
+                    if exact is None or size > len(self._folded_names[exact]):
+                        exact = idx
+                if size >= 3 and (loose is None or size > len(self._folded_names[loose])):
+                    loose = idx
+                    loose_agrees = self._accents_agree(words[i:i + n], folded[i:i + n], name_words)
+        if exact is not None:
+            # Khớp bỏ dấu dài hơn là tên khác ("cá chứa" vs "Cà chua") -> 2 cách đọc, không đoán
+            return exact, loose is not None and loose != exact and \
+                len(self._folded_names[loose]) > len(self._folded_names[exact])
+        if loose is not None:
+            return (loose, False) if loose_agrees else (None, True)
+        return None, False
+
+    def mentions_food(self, query: str) -> bool:
+        """Câu hỏi nhắc rõ (trọn từ, đúng dấu) 1 thực phẩm có trong bảng, không khớp mờ."""
+        idx, ambiguous = self._contained_food(query)
+        return idx is not None and not ambiguous
+
+    def _match_food(self, query: str, folded_query: str, min_score: float) -> Optional[tuple]:
+        # Tra theo mã số nếu câu hỏi nhắc "mã"
+        if re.search(r"\bma( so)?\b", folded_query):
+            for code in re.findall(r"\b\d{3,6}\b", folded_query):
+                if code in self._code_index:
+                    return self._code_index[code], 100.0
+
+        # Khớp tên trên câu hỏi gốc (còn dấu) trước khi bỏ từ nhiễu
+        idx, ambiguous = self._contained_food(query)
+        if ambiguous:
+            return None
+        if idx is not None:
+            return idx, 100.0
+
+        text = _QUERY_NOISE.sub(" ", folded_query)
+        for pattern in _ALIAS_PATTERNS.values():
+            text = pattern.sub(" ", text)
+        text = " ".join(text.split())
+        if len(text) < 3:
+            return None
+
+        candidates = process.extract(
+            text, self._folded_names, scorer=fuzz.partial_ratio, limit=10, score_cutoff=min_score
+        )
+        candidates = [c for c in candidates if len(c[0]) >= 3]
+        if not candidates:
+            return None
+        # Điểm bằng nhau -> ưu tiên tên dài hơn (cụ thể hơn), rồi tên gần độ dài câu hỏi
+        _, score, idx = max(candidates, key=lambda c: (c[1], fuzz.ratio(text, c[0]), len(c[0])))
+        # Khớp mờ trên chuỗi bỏ dấu: từ nào của câu hỏi trùng (bỏ dấu) với tên thì cũng phải đúng dấu
+        words = _words(query)
+        name_words, name_folded = self._name_words[idx]
+        pairs = [(w, fold(w)) for w in words if fold(w) in name_folded]
+        if not all(w == f or w in name_words for w, f in pairs):
+            return None
+        return idx, score
+
+    def lookup(self, query: str, min_score: float = 85) -> Optional[dict]:
+        """
+        Trả về hàng dữ liệu khớp nếu câu hỏi hỏi số liệu (bao nhiêu / hàm lượng / lượng có đơn vị)
+        của 1 chất dinh dưỡng trong 1 thực phẩm có trong bảng; ngược lại None -> retrieval bình thường.
+        """
+        folded = fold(query)
+        if not len(self) or not _NUMERIC_INTENT.search(folded):
+            return None
+        requested = [k for k in requested_nutrients(folded) if k in self.columns]
+        if not requested:
+            return None
+        match = self._match_food(query, folded, min_score)
+        if match is None:
+            return None
+        idx, score = match
+        values = {
+            key: float(column[idx]) for key, column in self.columns.items() if not np.isnan(column[idx])
+        }
+        if not any(key in values for key in requested):
+            return None
+        return {
+            "code": str(self.codes[idx]),
+            "name": str(self.names[idx]),
+            "page": int(self.pages[idx]),
+            "score": float(score),
+            "requested": requested,
+            "values": values,
+        }
+
+    def to_document(self, match: dict) -> LangChainDocument:
+        """Hàng dữ liệu chính xác -> Document làm context cho LLM (giá trị tính trên 100g ăn được)."""
+        keys = [k for k in self.columns if k in match["values"]]
+        header = ["Mã số", "Tên thực phẩm"] + [f"{NUTRIENT_LABELS[k]} ({self.units[k]})" for k in keys]
+        row = [match["code"], match["name"]] + [f"{match['values'][k]:g}" for k in keys]
+        content = (
+            "Bảng thành phần thực phẩm Việt Nam (trong 100g phần ăn được):\n"
+            "| " + " | ".join(header) + " |\n"
+            "|" + "---|" * len(header) + "\n"
+            "| " + " | ".join(row) + " |"
+        )
+        return LangChainDocument(
+            page_content=content,
+            metadata={
+                "source": "Vietnamese Food Table",
+                "page": match["page"],
+                "food_code": match["code"],
+                "content_type": "nutrient_lookup",
+            },
+        )
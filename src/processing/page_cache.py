@@ -0,0 +1,158 @@
+import glob
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from typing import Iterable, Iterator, List
+from langchain_core.documents import Document as LangChainDocument
+# Internal Import
+from src.utils import helpers
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 của file (đọc theo block để không nạp cả PDF vào RAM)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Phiên bản bộ làm sạch = CLEANER_REVISION + hash mã nguồn TCVN3Converter.
+# Sửa phần khác của helpers.py (make_chunk_id, batched...) không làm mất cache đã làm sạch.
+CLEANER_VERSION = hashlib.sha256(
+    f"{helpers.CLEANER_REVISION}\n{inspect.getsource(helpers.TCVN3Converter)}".encode("utf-8")
+).hexdigest()[:12]
+
+
+class PageStore:
+    """
+    Kho trang dạng JSONL + file index chứa byte offset của từng dòng.
+    - Đọc tuần tự (stream) hoặc truy cập ngẫu nhiên 1 trang mà không deserialize cả file.
+    - File index được ghi sau cùng: chưa có index = cache chưa ghi xong = không hợp lệ.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self._offsets = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path) and os.path.exists(self.index_path)
+
+    @property
+    def offsets(self) -> List[int]:
+        if self._offsets is None:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self._offsets = json.load(f)
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    @staticmethod
+    def _to_doc(line: bytes) -> LangChainDocument:
+        record = json.loads(line)
+        return LangChainDocument(page_content=record["page_content"], metadata=record["metadata"])
+
+    def get(self, i: int) -> LangChainDocument:
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[i])
+            return self._to_doc(f.readline())
+
+    def __iter__(self) -> Iterator[LangChainDocument]:
+        with open(self.path, "rb") as f:
+            for line in f:
+                yield self._to_doc(line)
+
+    def write(self, documents: Iterable[LangChainDocument]) -> Iterator[LangChainDocument]:
+        """
+        Ghi từng trang xuống đĩa và đồng thời yield lại trang đó,
+        để pipeline phía sau xử lý ngay mà không cần đợi ghi xong cả file.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        offsets = []
+        with open(tmp_path, "wb") as f:
+            for doc in documents:
+                offsets.append(f.tell())
+                record = {"page_content": doc.page_content, "metadata": doc.metadata}
+                f.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+                yield doc
+
+        os.replace(tmp_path, self.path)
+        with open(f"{self.index_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(offsets, f)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+        self._offsets = offsets
+
+
+class ParseCache:
+    """
+    Cache kết quả parse của 1 PDF, gồm 2 lớp:
+    - raw:   kết quả parse gốc, khoá theo hash nội dung PDF.
+    - clean: đã qua fix_encoding/clean_broken_layout, khoá theo hash PDF + CLEANER_VERSION.
+    Đổi bộ làm sạch chỉ cần làm sạch lại từ raw, không phải parse lại PDF.
+    """
+    def __init__(self, cache_dir: str, name: str, pdf_path: str):
+        self.dir = os.path.join(cache_dir, name)
+        # Cache kiểu cũ: cả list Document pickle trong 1 file, không khoá theo hash PDF
+        self.legacy_path = os.path.join(cache_dir, f"{name}.pkl")
+        # Không có PDF (chỉ mang theo data/cache_parse) -> dùng cache raw mới nhất của tên này
+        self.pdf_missing = not os.path.exists(pdf_path)
+        if self.pdf_missing:
+            self.source_hash = self._newest_cached_hash() or "missing"
+            print(f"Không thấy {pdf_path} -> dùng cache_parse {name} ({self.source_hash})")
+        else:
+            self.source_hash = file_hash(pdf_path)[:16]
+
+    def _newest_cached_hash(self):
+        """Hash PDF của cache raw hoàn chỉnh (có file index) được ghi gần nhất, None nếu chưa có."""
+        stores = [path for path in glob.glob(os.path.join(self.dir, "*.raw.jsonl")) if os.path.exists(f"{path}.idx")]
+        if not stores:
+            return None
+        newest = max(stores, key=os.path.getmtime)
+        return os.path.basename(newest)[:-len(".raw.jsonl")]
+
+    def raw_store(self) -> PageStore:
+        return PageStore(os.path.join(self.dir, f"{self.source_hash}.raw.jsonl"))
+
+    def clean_store(self) -> PageStore:
+        return PageStore(os.path.join(self.dir, f"{self.source_hash}.clean-{CLEANER_VERSION}.jsonl"))
+
+    def migrate_legacy(self) -> bool:
+        """
+        Chuyển cache .pkl cũ sang lớp raw JSONL (1 lần, rồi xoá file .pkl) để không phải parse lại PDF.
+        Cache cũ không ghi hash PDF -> coi như khớp PDF hiện tại; PDF đã đổi thì xoá data/cache_parse để parse lại.
+        Trả về True nếu đã chuyển.
+        """
+        if not os.path.exists(self.legacy_path):
+            return False
+        raw = self.raw_store()
+        if raw.exists():
+            return False
+        try:
+            with open(self.legacy_path, "rb") as f:
+                docs = pickle.load(f)
+        except Exception as e:
+            print(f"Không đọc được cache cũ {self.legacy_path} ({e}) -> sẽ parse lại toàn bộ PDF")
+            return False
+        pages = [LangChainDocument(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in docs]
+        for _ in raw.write(pages):
+            pass
+        os.remove(self.legacy_path)
+        print(f"Đã chuyển cache cũ {os.path.basename(self.legacy_path)} -> JSONL ({len(pages)} trang)")
+        return True
+
+    def prune(self):
+        """Xoá các file cache của PDF cũ / bộ làm sạch cũ."""
+        # Không có PDF -> không biết cache nào là cũ, giữ nguyên
+        if self.pdf_missing or not os.path.isdir(self.dir):
+            return
+        keep = {
+            os.path.basename(store.path) for store in (self.raw_store(), self.clean_store())
+        }
+        for filename in os.listdir(self.dir):
+            base = filename[:-len(".idx")] if filename.endswith(".idx") else filename
+            if base not in keep:
+                os.remove(os.path.join(self.dir, filename))
+                print(f"Xoá cache cũ: {filename}")
@@ -1,9 +1,42 @@
 import sys
 import os
+import queue
+import threading
+import time
+from itertools import chain
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from src.processing.ingestion import ProcessDocuments, TextSplitter
+from src.processing.ingestion import ParentChildSplitter, ProcessDocuments, TextSplitter
+from src.processing.nutrient_store import NutrientStoreBuilder
 from src.vectordb.qdrantdb import VectorDB
+from src.vectordb.embedding_cache import cache_stats
+from src.vectordb.sparse_index import SparseIndexBuilder
+from src.vectordb.parent_store import ParentStoreBuilder
+from src.vectordb.ingest_version import bump_ingest_version
 from src.config import config
+from src.utils.helpers import batched, make_chunk_id
+
+# Đánh dấu kết thúc luồng dữ liệu giữa các stage
+_END = object()
+
+
+class StageStats:
+    """Đếm số item + thời gian bận của 1 stage để in throughput."""
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items: int, seconds: float):
+        with self.lock:
+            self.items += items
+            self.busy += seconds
+
+    def report(self, wall: float) -> str:
+        rate = self.items / self.busy if self.busy else 0.0
+        return (f"  {self.name:<8} {self.items:>7} {self.unit:<6} | busy {self.busy:7.2f}s "
+                f"| {rate:8.1f} {self.unit}/s | util {self.busy / wall:5.0%}")
 
 class Pipeline:
     def __init__(self):
@@ -13,21 +46,32 @@ class Pipeline:
             chunk_size=config.CHUNK_SIZE, 
             chunk_overlap=config.CHUNK_OVERLAP
         )
+        # Small-to-big: chunk con được embed, parent được lưu ở docstore riêng
+        self.parent_child = ParentChildSplitter() if config.PARENT_CHILD else None
         
         self.vdb = None
 
     def run_full_pipeline(self):
-        """Quy trình chạy toàn bộ từ PDF -> PKL -> VectorDB"""
+        """Quy trình chạy toàn bộ từ PDF -> Cache (JSONL) -> VectorDB"""
         print("--- [START] INGESTION PIPELINE ---")
         
-        # 1. Trích xuất văn bản (Tạo file .pkl)
+        # 1. Trích xuất văn bản (Tạo cache parse)
         docs = self._extract_step()
+
+        # 1b. Dựng bảng dinh dưỡng dạng cột (fast path tra cứu số liệu)
+        self._build_nutrient_store(docs)
         
         # 2. Chia nhỏ văn bản
         chunks = self._split_step(docs)
         
         # 3. Lưu trữ vào Vector Database
         self._load_to_vector_db(chunks)
+
+        # 4. Index BM25 cho hybrid retrieval (sau bước 3 để chunk đã có chunk_id)
+        self._build_sparse_index(chunks)
+
+        # 5. Đánh dấu dữ liệu mới -> answer cache của agent tự mất hiệu lực
+        print(f"Ingest version: {bump_ingest_version()}")
         print("--- [FINISHED] PIPELINE HOÀN TẤT ---")
 
     def _extract_step(self):
@@ -38,26 +82,234 @@ class Pipeline:
         print(f"Đã xử lý xong {len(all_docs)} trang tài liệu.")
         return all_docs
 
+    def _build_nutrient_store(self, documents):
+        print("Đang dựng Nutrient Store từ Bảng TPTP VN...")
+        builder = NutrientStoreBuilder()
+        for doc in documents:
+            if doc.metadata.get("source") == "Vietnamese Food Table":
+                builder.add_page(doc)
+        builder.build().save(config.NUTRIENT_STORE_PATH)
+
+    def _build_sparse_index(self, chunks):
+        print("Đang dựng Sparse Index (BM25)...")
+        builder = SparseIndexBuilder(config.SPARSE_INDEX_PATH)
+        seen = set()
+        for chunk in chunks:
+            chunk_id = chunk.metadata.setdefault("chunk_id", make_chunk_id(chunk))
+            if chunk_id not in seen:
+                seen.add(chunk_id)
+                builder.add([chunk])
+        builder.save()
+
     def _split_step(self, documents):
         print("Đang thực hiện Chunking...")
-        chunks = self.splitter.split(documents)
+        parent_builder = ParentStoreBuilder(config.PARENT_STORE_PATH) if self.parent_child else None
+        chunks = self._split(documents, parent_builder)
+        if parent_builder is not None:
+            parent_builder.save()
         print(f"Tạo ra {len(chunks)} chunks nhỏ.")
         return chunks
+
+    def _split(self, documents, parent_builder=None):
+        """Chia chunk; chế độ parent/child thì ghi parent vào docstore và trả về chunk con."""
+        if parent_builder is None:
+            return self.splitter.split(documents)
+        parents, children = self.parent_child.split(documents)
+        parent_builder.add(parents)
+        return children
     
     def _load_to_vector_db(self, chunks):
-        print(f"Đang đẩy dữ liệu vào Vector DB (Qdrant)...")
-        # Khởi tạo VectorDB với chunks sẽ kích hoạt force_recreate=True
-        self.vdb = VectorDB(documents=chunks)
+        print(f"Đang đẩy dữ liệu vào Vector DB (Qdrant) - chế độ {config.INGEST_MODE}...")
+        # "full" -> force_recreate=True, "incremental" -> chỉ upsert phần thay đổi
+        self.vdb = VectorDB(documents=chunks, mode=config.INGEST_MODE)
+        if self.vdb.last_sync_report:
+            report = self.vdb.last_sync_report
+            print(f"Thay đổi: {report['added']} thêm mới, {report['deleted']} xoá, {report['unchanged']} giữ nguyên.")
         print(f"Dữ liệu đã được lưu trữ an toàn tại Local.")
+        self._report_embedding_cache()
+
+    @staticmethod
+    def _report_embedding_cache():
+        stats = cache_stats(config.EMBEDDING_MODEL)
+        if stats:
+            print(f"Embedding cache: {stats['hits']} hit / {stats['misses']} miss "
+                  f"(hit rate {stats['hit_rate']:.1%}), {stats['size']}/{stats['max_items']} vectors, "
+                  f"{stats['evictions']} evicted")
+
+
+    # ===================== STREAMING MODE =====================
+    # extract -> clean -> split -> embed -> upsert chạy đồng thời trên các thread,
+    # nối với nhau bằng queue có giới hạn => bộ nhớ chỉ phụ thuộc batch/queue size,
+    # không phụ thuộc kích thước corpus; embed và upload chạy chồng lên nhau.
+
+    def run_streaming_pipeline(self, batch_size: int = config.STREAM_BATCH_SIZE,
+                               queue_size: int = config.STREAM_QUEUE_SIZE,
+                               embed_workers: int = config.STREAM_EMBED_WORKERS):
+        print(f"--- [START] STREAMING INGESTION PIPELINE (batch={batch_size}, queue={queue_size}, "
+              f"embed_workers={embed_workers}, mode={config.INGEST_MODE}) ---")
+        self.vdb = VectorDB(mode=config.INGEST_MODE, streaming=True)
+        existing = self.vdb.existing_ids() if config.INGEST_MODE == "incremental" else set()
+
+        self._stop = threading.Event()
+        self._errors = []
+        q_pages, q_chunks, q_vectors = (queue.Queue(maxsize=queue_size) for _ in range(3))
+        stats = {
+            "extract": StageStats("extract", "pages"),
+            "split": StageStats("split", "chunks"),
+            "embed": StageStats("embed", "chunks"),
+            "upsert": StageStats("upsert", "chunks"),
+        }
+        # Trang / chunk / vector chỉ nằm trong các hàng đợi có giới hạn. Phần còn tăng theo corpus:
+        # - seen_ids: ~120 byte/chunk (chunk_id UUID), cần để khử trùng lặp + tìm chunk đã xoá
+        # - sparse_builder: ~20 byte/chunk; postings BM25 (~30 KB/chunk) spill ra đĩa mỗi SPARSE_SPILL_CHUNKS chunk
+        # - parent_builder: ~150 byte/parent (offset theo parent_id); nutrient_builder: theo số thực phẩm, không theo chunk
+        seen_ids = set()
+        embed_done = [0]
+        nutrient_builder = NutrientStoreBuilder()
+        sparse_builder = SparseIndexBuilder(config.SPARSE_INDEX_PATH)
+        parent_builder = ParentStoreBuilder(config.PARENT_STORE_PATH) if self.parent_child else None
+
+        def extract_stage():
+            # Trang được đọc lazy từ cache (hoặc parse) -> gom lô -> đẩy sang split
+            pages = chain(self.processor.iter_english_textbook(), self.processor.iter_vietnamese_table())
+            it = iter(batched(pages, batch_size))
+            while True:
+                start = time.perf_counter()
+                batch = next(it, None)
+                if batch is None:
+                    break
+                stats["extract"].add(len(batch), time.perf_counter() - start)
+                self._put(q_pages, batch)
+
+        def split_stage():
+            pending = []
+            for pages in self._drain(q_pages):
+                start = time.perf_counter()
+                for page in pages:
+                    if page.metadata.get("source") == "Vietnamese Food Table":
+                        nutrient_builder.add_page(page)
+                chunks = self._split(pages, parent_builder)
+                for chunk in chunks:
+                    chunk_id = make_chunk_id(chunk)
+                    if chunk_id in seen_ids:
+                        continue
+                    seen_ids.add(chunk_id)
+                    chunk.metadata["chunk_id"] = chunk_id
+                    # BM25 index gồm cả chunk không đổi (index được dựng lại toàn bộ)
+                    sparse_builder.add([chunk])
+                    # Chunk không đổi -> bỏ qua embed
+                    if chunk_id not in existing:
+                        pending.append(chunk)
+                stats["split"].add(len(chunks), time.perf_counter() - start)
+                while len(pending) >= batch_size:
+                    self._put(q_chunks, pending[:batch_size])
+                    pending = pending[batch_size:]
+            if pending:
+                self._put(q_chunks, pending)
+
+        def embed_stage():
+            for chunks in self._drain(q_chunks, requeue=True):
+                start = time.perf_counter()
+                vectors = self.vdb.embed_documents([c.page_content for c in chunks])
+                stats["embed"].add(len(chunks), time.perf_counter() - start)
+                self._put(q_vectors, (chunks, vectors))
+            # Worker embed cuối cùng kết thúc mới báo hết cho upsert
+            with stats["embed"].lock:
+                embed_done[0] += 1
+                last = embed_done[0] == embed_workers
+            if last:
+                self._put(q_vectors, _END)
+
+        def upsert_stage():
+            for chunks, vectors in self._drain(q_vectors):
+                start = time.perf_counter()
+                self.vdb.upsert_embedded(chunks, vectors)
+                stats["upsert"].add(len(chunks), time.perf_counter() - start)
+
+        wall_start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._guard, args=(extract_stage, q_pages), name="extract"),
+            threading.Thread(target=self._guard, args=(split_stage, q_chunks), name="split"),
+            *[threading.Thread(target=self._guard, args=(embed_stage, None), name=f"embed-{i}")
+              for i in range(embed_workers)],
+            threading.Thread(target=self._guard, args=(upsert_stage, None), name="upsert"),
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if self._errors:
+            raise RuntimeError(f"Streaming pipeline lỗi: {self._errors[0]!r}") from self._errors[0]
+
+        if config.INGEST_MODE == "incremental":
+            stale = existing - seen_ids
+            if stale:
+                print(f"Đang xoá {len(stale)} chunks không còn tồn tại...")
+                self.vdb.delete_ids(list(stale))
+            self.vdb.last_sync_report = {
+                "added": stats["upsert"].items,
+                "deleted": len(stale),
+                "unchanged": len(seen_ids) - stats["upsert"].items,
+                "total": len(seen_ids),
+            }
+
+        nutrient_builder.build().save(config.NUTRIENT_STORE_PATH)
+        sparse_builder.save()
+        if parent_builder is not None:
+            parent_builder.save()
+        print(f"Ingest version: {bump_ingest_version()}")
+
+        wall = time.perf_counter() - wall_start
+        print(f"Throughput theo stage (wall {wall:.2f}s):")
+        for stage in stats.values():
+            print(stage.report(wall))
+        self._report_embedding_cache()
+        print("--- [FINISHED] STREAMING PIPELINE HOÀN TẤT ---")
+
+    def _put(self, q: queue.Queue, item):
+        # put có timeout để không treo mãi khi stage phía sau đã lỗi
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def _drain(self, q: queue.Queue, requeue: bool = False):
+        """Đọc item từ queue tới khi gặp _END (requeue=True: trả lại _END cho worker khác)."""
+        while not self._stop.is_set():
+            try:
+                item = q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if item is _END:
+                if requeue:
+                    self._put(q, _END)
+                return
+            yield item
+
+    def _guard(self, stage, downstream):
+        """Chạy 1 stage; lỗi -> dừng toàn pipeline. Xong -> báo _END cho stage sau."""
+        try:
+            stage()
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+            return
+        if downstream is not None:
+            self._put(downstream, _END)
 
 
-#===== RUN Pipeline to test and create file pkl ====#
+#===== RUN Pipeline to test and create parse cache ====#
 
 if __name__ == "__main__":
     # Khởi tạo đối tượng Pipeline
     pipeline = Pipeline()
     
     # Kích hoạt quy trình
-    pipeline.run_full_pipeline()
+    if config.INGEST_STREAMING:
+        pipeline.run_streaming_pipeline()
+    else:
+        pipeline.run_full_pipeline()
 
 
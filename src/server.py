@@ -0,0 +1,249 @@
+"""
+HTTP/JSON server cho NutriAgent (stdlib http.server, không cần Streamlit) để các service khác gọi agent.
+
+Chạy:  python -m src.server [port]
+- POST /research  body: {"query": "...",
+                         "chat_history": [{"role": "user" | "assistant", "content": "..."}],   (tuỳ chọn)
+                         "use_reasoning": true,                                              (tuỳ chọn)
+                         "history_state": {...}}                                             (tuỳ chọn)
+                  -> {"answer", "model_thoughts", "retrieval_tier", "sources", "history_state", "latency_ms"}
+  Server không giữ session: client gửi lại history_state nhận được ở lượt trước để không tóm tắt lại lịch sử.
+- GET /healthz  process còn sống.
+- GET /readyz   200 khi model đã warm-up và agent đã dựng xong, 503 kèm trạng thái nếu chưa.
+- GET /metrics  Prometheus text: request, độ trễ, micro-batch, cache câu hỏi, RSS.
+Mỗi request chạy trên 1 thread; embed câu hỏi và chấm cross-encoder của các request đồng thời
+được gom thành micro-batch (server bật config.MICRO_BATCH theo SERVER_MICRO_BATCH trước khi load model).
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+# Internal Import
+from src.config import config
+from src.cores.history import new_history_state
+from src.cores.registry import get_registry, rss_bytes
+from src.utils.batching import batcher_stats, track_request
+
+
+class ServerState:
+    """Agent dùng chung + bộ đếm cho /metrics."""
+    def __init__(self):
+        # Phải đặt trước khi registry load embedder / cross-encoder (loader đọc cờ lúc load)
+        config.MICRO_BATCH = config.SERVER_MICRO_BATCH
+        self.registry = get_registry()
+        self.agent = None
+        self.startup_error: Optional[str] = None
+        self.started = time.time()
+        self.slots = threading.BoundedSemaphore(config.SERVER_MAX_CONCURRENCY)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.responses: Dict[int, int] = {}
+        self.latency_sum = 0.0
+        self.latency_count = 0
+
+    def start(self):
+        """Warm-up model + dựng agent trên thread nền; server nhận /healthz ngay từ đầu."""
+        def build():
+            try:
+                self.registry.warm_up(background=False)
+                from src.cores.CoT_agent import NutriAgentReseacher
+                self.agent = NutriAgentReseacher()
+                print("✅ NutriAgent sẵn sàng")
+            except Exception as e:
+                self.startup_error = str(e)
+                print(f"Không khởi tạo được agent: {e}")
+        threading.Thread(target=build, name="agent-startup", daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        return self.agent is not None
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(self, status: int, latency: Optional[float] = None):
+        with self._lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+            if latency is not None:
+                self.latency_sum += latency
+                self.latency_count += 1
+
+    def metrics(self) -> str:
+        lines = [
+            "# TYPE nutriagent_ready gauge",
+            f"nutriagent_ready {int(self.ready)}",
+            "# TYPE nutriagent_uptime_seconds gauge",
+            f"nutriagent_uptime_seconds {time.time() - self.started:.1f}",
+            "# TYPE nutriagent_research_in_flight gauge",
+            f"nutriagent_research_in_flight {self.in_flight}",
+            "# TYPE nutriagent_research_responses_total counter",
+        ]
+        with self._lock:
+            for status, count in sorted(self.responses.items()):
+                lines.append(f'nutriagent_research_responses_total{{status="{status}"}} {count}')
+            lines += [
+                "# TYPE nutriagent_research_latency_seconds summary",
+                f"nutriagent_research_latency_seconds_sum {self.latency_sum:.3f}",
+                f"nutriagent_research_latency_seconds_count {self.latency_count}",
+            ]
+        for name, stats in batcher_stats().items():
+            label = f'{{batcher="{name}"}}'
+            lines += [
+                f"nutriagent_microbatch_requests_total{label} {stats['requests']}",
+                f"nutriagent_microbatch_items_total{label} {stats['items']}",
+                f"nutriagent_microbatch_batches_total{label} {stats['batches']}",
+                f"nutriagent_microbatch_max_items{label} {stats['max_batch_items']}",
+                f"nutriagent_microbatch_wait_ms_avg{label} {stats['avg_wait_ms']:.2f}",
+            ]
+        if self.registry.is_loaded("vectordb"):
+            q_stats = self.registry.vectordb().query_cache_stats()
+            lines += [
+                f"nutriagent_query_cache_hits_total {q_stats['hits']}",
+                f"nutriagent_query_cache_misses_total {q_stats['misses']}",
+            ]
+        rss = rss_bytes()
+        if rss is not None:
+            lines.append(f"nutriagent_process_rss_bytes {rss}")
+        return "\n".join(lines) + "\n"
+
+
+def serialize_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Kết quả research() -> JSON (Document -> {"content", "metadata"})."""
+    return {
+        "answer": result.get("answer", ""),
+        "model_thoughts": result.get("model_thoughts", ""),
+        "retrieval_tier": result.get("retrieval_tier"),
+        "sources": [{"content": doc.page_content, "metadata": doc.metadata} for doc in result.get("sources", [])],
+    }
+
+
+class NutriAgentHandler(BaseHTTPRequestHandler):
+    server_version = "NutriAgent/1.0"
+    state: ServerState = None
+
+    def _send(self, status: int, body: str, content_type: str = "application/json; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        # default=str: metadata có thể chứa numpy float / kiểu không chuẩn JSON
+        self._send(status, json.dumps(payload, ensure_ascii=False, default=str))
+
+    def log_message(self, format: str, *args):
+        print(f"[server] {self.address_string()} {format % args}")
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/healthz":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/readyz":
+            warmup = self.state.registry.warmup_status()
+            payload = {"ready": self.state.ready, "warmup": warmup, "error": self.state.startup_error}
+            self._send_json(200 if self.state.ready else 503, payload)
+        elif path == "/metrics":
+            self._send(200, self.state.metrics(), "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _reject(self, status: int, payload: Dict[str, Any]):
+        self.state.record(status)
+        self._send_json(status, payload)
+
+    def _read_json(self) -> Optional[Dict[str, Any]]:
+        header = self.headers.get("Content-Length")
+        if header is None:
+            self._reject(411, {"error": "thiếu Content-Length"})
+            return None
+        try:
+            length = int(header)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._reject(400, {"error": "Content-Length không hợp lệ"})
+            return None
+        if length > config.SERVER_MAX_BODY_BYTES:
+            self._reject(413, {"error": "body quá lớn"})
+            return None
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            self._reject(400, {"error": "body không phải JSON"})
+            return None
+        if not isinstance(body, dict) or not isinstance(body.get("query"), str) or not body["query"].strip():
+            self._reject(400, {"error": "thiếu 'query'"})
+            return None
+        if body.get("chat_history") is not None and not isinstance(body["chat_history"], list):
+            self._reject(400, {"error": "'chat_history' phải là list"})
+            return None
+        if body.get("history_state") is not None and not isinstance(body["history_state"], dict):
+            self._reject(400, {"error": "'history_state' phải là object"})
+            return None
+        return body
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != "/research":
+            self._send_json(404, {"error": "not found"})
+            return
+        body = self._read_json()
+        if body is None:
+            return
+        if not self.state.ready:
+            self._reject(503, {"error": "agent chưa sẵn sàng", "warmup": self.state.registry.warmup_status()})
+            return
+        if not self.state.slots.acquire(timeout=config.SERVER_QUEUE_TIMEOUT):
+            self._reject(503, {"error": "server quá tải"})
+            return
+        start = time.perf_counter()
+        self.state.begin()
+        try:
+            history_state = body.get("history_state") or new_history_state()
+            use_reasoning = body.get("use_reasoning")
+            with track_request():
+                result = self.state.agent.research(
+                    body["query"],
+                    chat_history=body.get("chat_history") or [],
+                    history_state=history_state,
+                    use_reasoning=None if use_reasoning is None else bool(use_reasoning),
+                )
+        finally:
+            self.state.end()
+            self.state.slots.release()
+        latency = time.perf_counter() - start
+        payload = serialize_result(result)
+        payload["history_state"] = history_state
+        payload["latency_ms"] = round(1000 * latency, 1)
+        # research() bắt lỗi và trả về câu xin lỗi -> báo 500 để client / load balancer biết
+        status = 500 if result.get("error") else 200
+        self.state.record(status, latency)
+        self._send_json(status, payload)
+
+
+def serve(host: str = config.SERVER_HOST, port: int = config.SERVER_PORT, state: Optional[ServerState] = None):
+    state = state or ServerState()
+    if state.agent is None:
+        state.start()
+    handler = type("Handler", (NutriAgentHandler,), {"state": state})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    print(f"🌐 NutriAgent server: http://{host}:{port} (POST /research, GET /healthz /readyz /metrics)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else config.SERVER_PORT)
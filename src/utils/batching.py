@@ -0,0 +1,180 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+_ACTIVE_LOCK = threading.Lock()
+_active_requests = 0
+
+@contextmanager
+def track_request():
+    """
+    Đánh dấu 1 request (vd. 1 lượt /research của server) đang chạy trong process.
+    Batcher chỉ chờ gom khi còn request đang chạy khác ngoài các request đã nằm trong hàng đợi của nó.
+    """
+    global _active_requests
+    with _ACTIVE_LOCK:
+        _active_requests += 1
+    try:
+        yield
+    finally:
+        with _ACTIVE_LOCK:
+            _active_requests -= 1
+
+
+def active_requests() -> int:
+    return _active_requests
+
+
+class _Request:
+    __slots__ = ("items", "results", "error", "done", "enqueued")
+
+    def __init__(self, items: List[Any]):
+        self.items = items
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Gom việc của nhiều request đồng thời (nhiều thread) thành 1 lần gọi model.
+    - submit(items) chặn tới khi có kết quả, trả về list kết quả cùng thứ tự với items.
+    - Worker thread lấy các request đang có trong hàng đợi, gọi fn(tất cả items) 1 lần rồi chia kết quả
+      về từng request. Request tới trong lúc model đang chạy tự gom thành lô tiếp theo.
+    - Chỉ chờ thêm (tối đa max_wait_ms, dừng sớm khi đủ max_batch phần tử) khi còn request đang chạy
+      (track_request) chưa vào hàng đợi; request đứng 1 mình được chạy ngay, không thêm độ trễ.
+    - 1 request lớn hơn max_batch vẫn được chạy nguyên lô (không bị cắt).
+    - fn lỗi (kể cả BaseException) -> mọi request trong lô nhận lại exception đó, worker vẫn chạy tiếp;
+      worker thread chết vì lý do khác thì submit sau khởi động lại.
+    - submit chờ tối đa timeout giây (mặc định của batcher) rồi raise TimeoutError; request chưa chạy
+      được rút khỏi hàng đợi.
+    """
+    def __init__(self, fn: Callable[[List[Any]], Sequence[Any]], max_batch: int = 32,
+                 max_wait_ms: float = 5.0, name: str = "batch", timeout: Optional[float] = None):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.name = name
+        self.timeout = timeout
+
+        self.requests = 0
+        self.items = 0
+        self.batches = 0
+        self.max_items = 0
+        self.wait_s = 0.0
+        self.run_s = 0.0
+        self.errors = 0
+        self.timeouts = 0
+
+        self._cond = threading.Condition()
+        self._pending: List[_Request] = []
+        self._pending_items = 0
+        self._worker = None
+        BATCHERS[name] = self
+
+    def submit(self, items: Sequence[Any], timeout: Optional[float] = None) -> List[Any]:
+        items = list(items)
+        if not items:
+            return []
+        timeout = self.timeout if timeout is None else timeout
+        request = _Request(items)
+        with self._cond:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name=f"batcher-{self.name}", daemon=True)
+                self._worker.start()
+            self._pending.append(request)
+            self._pending_items += len(items)
+            self._cond.notify()
+        if not request.done.wait(timeout):
+            with self._cond:
+                # Chưa được lấy vào lô -> rút ra; đang chạy -> kết quả bị bỏ
+                if request in self._pending:
+                    self._pending.remove(request)
+                    self._pending_items -= len(items)
+                self.timeouts += 1
+            raise TimeoutError(f"{self.name}: không có kết quả sau {timeout}s")
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _next_batch(self) -> List[_Request]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while self._pending_items < self.max_batch and len(self._pending) < active_requests():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0].items) <= self.max_batch):
+                request = self._pending.pop(0)
+                batch.append(request)
+                size += len(request.items)
+            self._pending_items -= size
+            return batch
+
+    def _run(self, batch: List[_Request]):
+        items = [item for request in batch for item in request.items]
+        start = time.perf_counter()
+        try:
+            results = list(self.fn(items))
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name}: fn trả về {len(results)} kết quả cho {len(items)} phần tử")
+        except BaseException as e:
+            self._fail(batch, e)
+            return
+        end = time.perf_counter()
+
+        offset = 0
+        for request in batch:
+            request.results = results[offset:offset + len(request.items)]
+            offset += len(request.items)
+            self.wait_s += start - request.enqueued
+        self.requests += len(batch)
+        self.items += len(items)
+        self.batches += 1
+        self.max_items = max(self.max_items, len(items))
+        self.run_s += end - start
+        for request in batch:
+            request.done.set()
+
+    def _fail(self, batch: List[_Request], error: BaseException):
+        self.errors += 1
+        for request in batch:
+            if not request.done.is_set():
+                request.error = error
+                request.done.set()
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._run(batch)
+            except BaseException as e:
+                # Lỗi ngoài fn (chia kết quả, thống kê...) -> vẫn trả lời các request, worker chạy tiếp
+                self._fail(batch, e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "items": self.items,
+            "batches": self.batches,
+            "avg_batch_items": self.items / self.batches if self.batches else 0.0,
+            "max_batch_items": self.max_items,
+            "avg_wait_ms": 1000 * self.wait_s / self.requests if self.requests else 0.0,
+            "run_s": self.run_s,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+        }
+
+
+# Mọi batcher trong process theo tên (cho /metrics của server)
+BATCHERS: Dict[str, MicroBatcher] = {}
+
+def batcher_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: batcher.stats() for name, batcher in BATCHERS.items()}
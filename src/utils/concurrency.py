@@ -0,0 +1,16 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+# Internal Import
+from src.config import config
+
+# Pool giới hạn cho việc nặng CPU (embed câu hỏi, rerank, dense search trên mmap) của các API async:
+# event loop giữ được nhiều request cùng lúc, nhưng model dùng chung chỉ chạy tối đa CPU_WORKERS việc song song.
+CPU_EXECUTOR = ThreadPoolExecutor(max_workers=config.CPU_WORKERS, thread_name_prefix="cpu")
+
+
+async def run_cpu(fn: Callable, *args, **kwargs) -> Any:
+    """Chạy hàm đồng bộ trên CPU_EXECUTOR, không chặn event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(CPU_EXECUTOR, functools.partial(fn, *args, **kwargs))
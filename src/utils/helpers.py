@@ -1,9 +1,19 @@
+import codecs
+import hashlib
 import re
 import unicodedata
+import uuid
+from itertools import islice
+from typing import Iterable, Iterator, List
 
 # BẢNG MÃ FULL TCVN3 -> UNICODE (Đầy đủ cả Hoa/Thường và ký tự PDF lỗi)
-TCVN3_TO_UNICODE = {
-    # --- Nguyên âm thường ---
+# Font hoa và font thường của TCVN3 dùng chung nhiều mã, nên bảng HOA ghi đè
+# các mã trùng của bảng thường. Bản cũ viết chung 1 dict literal nên việc ghi đè
+# xảy ra âm thầm; giờ tách riêng và merge tường minh (giữ nguyên kết quả cũ).
+
+# --- Nguyên âm thường ---
+# Các mã khai báo trùng trong cùng bảng (û, ü, ÷) giữ giá trị khai báo sau cùng.
+TCVN3_LOWER = {
     'µ': 'à', '¸': 'á', '¶': 'ả', '·': 'ã', '¹': 'ạ',
     '¨': 'ă', '¾': 'ắ', '»': 'ằ', '¼': 'ẳ', '½': 'ẵ', 'Æ': 'ặ',
     '©': 'â', 'Ê': 'ấ', 'Ç': 'ầ', 'Ë': 'ẩ', 'É': 'ẫ', 'È': 'ậ',
@@ -13,12 +23,14 @@ TCVN3_TO_UNICODE = {
     '×': 'ì', 'Ý': 'í', 'Ø': 'ỉ', 'Ü': 'ĩ', 'Þ': 'ị',
     'ß': 'ò', 'ã': 'ó', 'á': 'ỏ', 'â': 'õ', 'ä': 'ọ',
     '«': 'ô', 'è': 'ộ', 'å': 'ồ', 'æ': 'ố', 'ç': 'ổ', 'é': 'ỗ',
-    '¬': 'ư', 'ú': 'ử', 'ù': 'ứ', 'û': 'ữ', 'ü': 'ự', '÷': 'ư', # Có nhiều biến thể của ư
+    '¬': 'ư', 'ú': 'ử', 'ù': 'ứ', 'û': 'ỷ', 'ü': 'ỹ', '÷': 'ự', # Có nhiều biến thể của ư
     'ê': 'ơ', 'í': 'ớ', 'ë': 'ờ', 'ì': 'ở', 'î': 'ỡ', 'ï': 'ợ',
     'ó': 'ù', 'ò': 'ú', 'ô': 'ủ', 'õ': 'ũ', 'ö': 'ụ',
-    'ý': 'ỳ', 'þ': 'ỵ', 'ø': 'ừ', '÷': 'ự', 'û': 'ỷ', 'ü': 'ỹ',
-    
-    # --- Nguyên âm HOA (Thường bị thiếu trong bảng cũ) ---
+    'ý': 'ỳ', 'þ': 'ỵ', 'ø': 'ừ',
+}
+
+# --- Nguyên âm HOA (Thường bị thiếu trong bảng cũ) ---
+TCVN3_UPPER = {
     'µ': 'À', '¸': 'Á', '¶': 'Ả', '·': 'Ã', '¹': 'Ạ',
     '¡': 'Ă', '¾': 'Ắ', '»': 'Ằ', '¼': 'Ẳ', '½': 'Ẵ', 'Æ': 'Ặ',
     '¢': 'Â', 'Ê': 'Ấ', 'Ç': 'Ầ', 'Ë': 'Ẩ', 'É': 'Ẫ', 'È': 'Ậ',
@@ -27,58 +39,181 @@ TCVN3_TO_UNICODE = {
     '¤': 'Ô', 'è': 'Ộ', 'å': 'Ồ', 'æ': 'Ố', 'ç': 'Ổ', 'é': 'Ỗ',
     '¥': 'Ơ', 'í': 'Ớ', 'ë': 'Ờ', 'ì': 'Ở', 'î': 'Ỡ', 'ï': 'Ợ',
     '¦': 'Ư', 'ú': 'Ử', 'ù': 'Ứ', 'û': 'Ữ', 'ü': 'Ự', 'ø': 'Ừ',
-    
-    # --- Ký tự lỗi PDF đặc thù (Do font map sai) ---
+}
+
+# --- Ký tự lỗi PDF đặc thù (Do font map sai) ---
+PDF_ARTIFACTS = {
     '3/4': 'ư', 
     '1/4': 'ở',
     '1/2': 'ả',
     '–': '', # Gạch nối dài thường gây lỗi
 }
 
+TCVN3_TO_UNICODE = {**TCVN3_LOWER, **TCVN3_UPPER, **PDF_ARTIFACTS}
+
+# Đơn vị đo được bảo vệ khỏi bảng mã (TCVN3 dùng 'µ' là 'à', nhưng trong khoa học 'µ' là micro)
+PROTECTED_TOKENS = ("µg", "mg")
+
+# Lỗi chính tả phổ biến còn sót lại do PDF OCR sai (không map được bằng bảng mã)
+OCR_TYPO_FIXES = {
+    "B,nh": "Bánh",
+    "m,y": "mây",
+    "l,t": "lứt",
+    "tî": "tẻ", # tî thường là tẻ trong 1 số font
+}
+
+
+# Phiên bản bộ làm sạch: tăng khi sửa bảng mã, OCR_TYPO_FIXES, regex hay logic của
+# clean_broken_layout / fix_encoding (mã nguồn TCVN3Converter đã được hash tự động)
+CLEANER_REVISION = 1
+
+
+class TCVN3Converter:
+    """
+    Engine chuyển TCVN3 -> Unicode biên dịch sẵn, thay cho vòng lặp str.replace theo từng khoá.
+    - Ký tự đơn: bảng giải mã 256 ký tự cho dải Latin-1 (nơi chứa toàn bộ mã TCVN3),
+      áp dụng 1 lượt bằng codecs.charmap_decode; ký tự ngoài dải dùng str.translate.
+    - Chuỗi nhiều ký tự (3/4, 1/4...) + đơn vị cần bảo vệ (µg, mg): 1 regex alternation,
+      chỉ chạy khi trang thực sự chứa token đó.
+    Bản cũ thay thế tuần tự theo thứ tự khoá, nên 1 ký tự đã đổi có thể bị đổi tiếp bởi khoá
+    phía sau. Bảng được dựng bằng cách mô phỏng đúng chuỗi thay thế đó cho từng ký tự,
+    nên kết quả giống hệt bản cũ (đối chiếu golden trong src/benchmarks/encoding.py).
+    """
+    def __init__(self, mapping: dict, protected=PROTECTED_TOKENS):
+        singles = {k: v for k, v in mapping.items() if len(k) == 1}
+        self.sequences = {k: v for k, v in mapping.items() if len(k) > 1}
+        self.protected = set(protected)
+
+        # Ký tự đơn: kết quả cuối cùng sau toàn bộ chuỗi replace của bản cũ
+        resolved = {}
+        for char in singles:
+            out = char
+            for key, value in singles.items():
+                out = out.replace(key, value)
+            resolved[char] = out
+
+        # Dải Latin-1 map 1-1 -> bảng giải mã; phần còn lại (vd '–' -> '') replace trước
+        self.decoding_table = "".join(
+            resolved[chr(i)] if len(resolved.get(chr(i), "")) == 1 else chr(i) for i in range(256)
+        )
+        self.extra = {
+            k: v for k, v in resolved.items() if ord(k) >= 256 or len(v) != 1
+        }
+        assert not any(c in resolved for v in self.extra.values() for c in v), \
+            "Ký tự ngoài bảng giải mã không được sinh ra ký tự cần map tiếp"
+        # Bảng dạng list đánh chỉ số theo code point (str.translate nhanh hơn dict nhiều lần)
+        self.table = [resolved.get(chr(i), chr(i)) for i in range(max(map(ord, resolved)) + 1)]
+
+        # Token không chứa ký tự nào cần map (vd 'mg') thì bảo vệ cũng như không -> bỏ qua
+        self.protected = {t for t in self.protected if any(c in resolved for c in t)}
+        # Đơn vị bảo vệ đứng trước để không bị map nhầm
+        self.tokens = sorted(self.protected, key=len, reverse=True) + sorted(self.sequences, key=len, reverse=True)
+        self.pattern = re.compile("(" + "|".join(re.escape(t) for t in self.tokens) + ")")
+
+    def _translate(self, text: str) -> str:
+        if text.isascii(): # Không có mã TCVN3 nào nằm trong ASCII
+            return text
+        for key, value in self.extra.items():
+            if key in text:
+                text = text.replace(key, value)
+        try:
+            raw = text.encode("latin-1")
+        except UnicodeEncodeError:
+            # Trang lẫn ký tự ngoài Latin-1 (đã là Unicode) -> đường chậm hơn
+            return text.translate(self.table)
+        return codecs.charmap_decode(raw, "strict", self.decoding_table)[0]
+
+    def convert(self, text: str) -> str:
+        if not any(token in text for token in self.tokens):
+            return self._translate(text)
+        # re.split với capture group: phần tử lẻ là token khớp, phần tử chẵn là đoạn text thường
+        parts = self.pattern.split(text)
+        for i, part in enumerate(parts):
+            if i % 2 == 0:
+                parts[i] = self._translate(part)
+            elif part not in self.protected:
+                parts[i] = self.sequences[part]
+        return "".join(parts)
+
+
+_CONVERTER = TCVN3Converter(TCVN3_TO_UNICODE)
+_TYPO_PATTERN = re.compile("|".join(re.escape(k) for k in OCR_TYPO_FIXES))
+# Ký tự ngăn cách khi xử lý theo lô (không phải chữ cái -> regex layout không nối qua trang)
+_BATCH_SEPARATOR = "\x00"
+
+# Regex bắt đầu bằng ký tự '\n' cố định để engine quét nhanh tới từng dấu xuống dòng,
+# thay vì thử lookbehind ở mọi vị trí trong chuỗi (cùng kết quả với bản cũ).
+_BROKEN_LINE_PATTERN = re.compile(r'\n(?<=[a-zA-Zà-ỹÀ-Ỹ]\n)(?=[a-zA-Zà-ỹÀ-Ỹ])')
+_LONG_DASH_PATTERN = re.compile(r'-{3,}')
+
 def clean_broken_layout(text: str) -> str:
     """Hàn gắn các ký tự bị xuống dòng vô lý"""
     if not text: return ""
     # M \n a \n g \n i \n ê -> Magiê
-    text = re.sub(r'(?<=[a-zA-Zà-ỹÀ-Ỹ])\n(?=[a-zA-Zà-ỹÀ-Ỹ])', '', text)
+    text = _BROKEN_LINE_PATTERN.sub('', text)
     # Xóa dấu gạch ngang dài thừa thãi (-----)
-    text = re.sub(r'-{3,}', ' ', text)
+    text = _LONG_DASH_PATTERN.sub(' ', text)
+    return text
+
+def _fix_encoding_raw(text: str) -> str:
+    # 1. Sửa layout trước
+    text = clean_broken_layout(text)
+
+    # 2 + 3. Bảo vệ đơn vị đo lường rồi thay thế ký tự TCVN3 bằng Unicode (1 lượt)
+    text = _CONVERTER.convert(text)
+
+    # 4.Chuẩn hóa Unicode (NFC)
+    # Bước này giúp gộp các ký tự rời rạc (a + `) thành 1 ký tự (à)
+    text = unicodedata.normalize('NFC', text)
+
+    # 5. Fix các lỗi chính tả phổ biến còn sót lại do PDF OCR sai
+    # Các khoá thay thế tuần tự có thể tạo ra khớp mới cho nhau -> giữ replace tuần tự
+    # khi có khớp (hiếm), còn không thì chỉ tốn 1 lượt search.
+    if _TYPO_PATTERN.search(text):
+        for wrong, right in OCR_TYPO_FIXES.items():
+            text = text.replace(wrong, right)
     return text
 
 def fix_encoding(text: str) -> str:
     """
     Hàm sửa lỗi encoding TCVN3 toàn diện.
-    Chiến thuật: Thay thế ký tự -> Chuẩn hóa Unicode NFC
+    Chiến thuật: Thay thế ký tự (engine biên dịch sẵn) -> Chuẩn hóa Unicode NFC
     """
     if not text: return ""
+    return _fix_encoding_raw(text).strip()
 
-    # 1. Sửa layout trước
-    text = clean_broken_layout(text)
+def fix_encoding_batch(texts: List[str]) -> List[str]:
+    """
+    Sửa lỗi encoding cho cả lô trang trong 1 lượt: nối các trang bằng ký tự ngăn cách,
+    chạy pipeline 1 lần rồi tách lại. Kết quả giống hệt gọi fix_encoding từng trang.
+    """
+    if any(_BATCH_SEPARATOR in text for text in texts if text):
+        return [fix_encoding(text) for text in texts]
+    joined = _fix_encoding_raw(_BATCH_SEPARATOR.join(text or "" for text in texts))
+    return [part.strip() for part in joined.split(_BATCH_SEPARATOR)]
 
-    # 2. Bảo vệ đơn vị đo lường (để không bị map nhầm)
-    # TCVN3 dùng 'µ' là 'à', nhưng trong khoa học 'µ' là micro
-    # Logic: Nếu µ đứng trước g, l, m... thì giữ nguyên. Nếu µ đứng trong từ (vµng) thì đổi.
-    text = text.replace("µg", "##MICRO_GRAM##")
-    text = text.replace("mg", "##MILLI_GRAM##")
 
-    # 3. Thay thế ký tự TCVN3 bằng Unicode
-    # Chúng ta iter qua bảng map để replace (An toàn hơn translate với chuỗi dài như 3/4)
-    for tcvn_char, unicode_char in TCVN3_TO_UNICODE.items():
-        if tcvn_char in text:
-            text = text.replace(tcvn_char, unicode_char)
+# Namespace cố định để ID của chunk ổn định giữa các lần chạy pipeline
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c2a8e-3d4b-5c6d-8e9f-0a1b2c3d4e5f")
 
-    # 4. Khôi phục đơn vị đo
-    text = text.replace("##MICRO_GRAM##", "µg")
-    text = text.replace("##MILLI_GRAM##", "mg")
+def content_hash(text: str) -> str:
+    """SHA-256 của nội dung văn bản (dùng để phát hiện chunk thay đổi)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-    # 5.Chuẩn hóa Unicode (NFC)
-    # Bước này giúp gộp các ký tự rời rạc (a + `) thành 1 ký tự (à)
-    text = unicodedata.normalize('NFC', text)
+def make_chunk_id(doc) -> str:
+    """
+    Sinh ID ổn định cho một chunk từ (source, page, content hash).
+    Cùng nội dung ở cùng trang -> cùng ID, nên lần nạp sau chỉ cần upsert phần thay đổi.
+    Qdrant yêu cầu ID dạng UUID hoặc số nguyên -> dùng uuid5.
+    """
+    source = doc.metadata.get("source", "")
+    page = doc.metadata.get("page", "")
+    key = f"{source}|{page}|{content_hash(doc.page_content)}"
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, key))
 
-    # 6. Fix các lỗi chính tả phổ biến còn sót lại do PDF OCR sai
-    # Chỉ giữ lại những từ cực kỳ đặc thù không thể map bằng bảng mã
-    text = text.replace("B,nh", "Bánh")
-    text = text.replace("m,y", "mây")
-    text = text.replace("l,t", "lứt")
-    text = text.replace("tî", "tẻ") # tî thường là tẻ trong 1 số font
 
-    return text.strip()
\ No newline at end of file
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """Gom iterable thành các lô list (itertools.batched chỉ có từ Python 3.12)."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
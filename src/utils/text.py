@@ -0,0 +1,29 @@
+import re
+import unicodedata
+from typing import List
+
+_WORD = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    """Chuẩn hoá để so khớp: viết thường, bỏ dấu tiếng Việt, đ -> d."""
+    text = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    return "".join(c for c in text if not unicodedata.combining(c)).strip()
+
+
+def tokenize_vi(text: str) -> List[str]:
+    """
+    Tokenizer cho BM25 tiếng Việt / tiếng Anh:
+    - Mỗi âm tiết giữ bản có dấu và thêm bản bỏ dấu -> "uc ga" và "ức gà" đều khớp.
+    - Thêm bigram bỏ dấu ("uc_ga") -> tên thực phẩm nhiều âm tiết khớp chính xác hơn.
+    - Mã số thực phẩm (1001...) được giữ nguyên như 1 token.
+    """
+    words = _WORD.findall(unicodedata.normalize("NFC", text.lower()))
+    folded = [fold(word) for word in words]
+    tokens = []
+    for word, plain in zip(words, folded):
+        tokens.append(word)
+        if plain != word:
+            tokens.append(plain)
+    tokens.extend(f"{a}_{b}" for a, b in zip(folded, folded[1:]))
+    return tokens
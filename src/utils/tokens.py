@@ -0,0 +1,43 @@
+import threading
+from typing import Optional
+# Internal Import
+from src.config import config
+
+_ENCODER = None
+_ENCODER_LOADED = False
+_ENCODER_LOCK = threading.Lock()
+
+
+def get_encoder():
+    """Encoder tiktoken dùng chung; None nếu không tải được (máy offline chưa có cache BPE)."""
+    global _ENCODER, _ENCODER_LOADED
+    with _ENCODER_LOCK:
+        if not _ENCODER_LOADED:
+            _ENCODER_LOADED = True
+            try:
+                import tiktoken
+                _ENCODER = tiktoken.get_encoding(config.TOKEN_ENCODING)
+            except Exception as e:
+                print(f"Không tải được tiktoken encoding {config.TOKEN_ENCODING} ({e}), ước lượng 4 ký tự / token.")
+        return _ENCODER
+
+
+def count_tokens(text: str) -> int:
+    """Số token (xấp xỉ tokenizer của Groq, đủ để chặn kích thước prompt)."""
+    if not text:
+        return 0
+    encoder = get_encoder()
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: Optional[int]) -> str:
+    """Cắt text còn tối đa max_tokens token."""
+    if not text or max_tokens is None:
+        return text
+    encoder = get_encoder()
+    if encoder is None:
+        return text[:max_tokens * 4]
+    ids = encoder.encode(text, disallowed_special=())
+    return text if len(ids) <= max_tokens else encoder.decode(ids[:max_tokens])
@@ -0,0 +1,356 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+# Internal Import
+from src.config import config
+from src.utils.batching import MicroBatcher
+from src.utils.lru import TTLCache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bọc 1 model Embeddings bằng cache bền vững, khoá theo nội dung (model + hash text).
+    - Vector lưu trong ma trận float32 memory-mapped (vectors.f32), file index.json map key -> slot.
+    - Giới hạn max_items: đầy thì thu hồi slot của key ít dùng nhất (LRU) để ghi đè;
+      index được lưu xuống đĩa trước khi slot bị ghi đè.
+    - Re-ingest sau khi đổi cách chunking chỉ encode các đoạn text chưa từng thấy.
+    - Chỉ cache vector document; câu hỏi đã có cache trong RAM (QueryCachedEmbeddings).
+    - Nhiều process (app, server, run_pipeline): chỉ process giữ file lock được ghi, các process khác chỉ đọc.
+      keys.bin lưu key của từng slot và được kiểm tra khi đọc -> index cũ / ghi dở thành cache miss,
+      không bao giờ trả nhầm vector của text khác.
+    Trong process thì thread-safe.
+    """
+    GROW_ROWS = 4096
+    KEY_BYTES = 16
+
+    def __init__(self, base: Embeddings, model_name: str, cache_dir: str = config.EMBEDDING_CACHE_DIR,
+                 max_items: int = config.EMBEDDING_CACHE_MAX_ITEMS):
+        self.base = base
+        self.model_name = model_name
+        self.max_items = max(1, max_items)
+        self.dir = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.keys_path = os.path.join(self.dir, "keys.bin")
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.lock_path = os.path.join(self.dir, "writer.lock")
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._writer = None # None = chưa thử lấy lock ghi, True / False = có / không được ghi
+        self._lock_file = None
+        self._load()
+        atexit.register(self.flush)
+
+    # ---------- Persist ----------
+    def _reset(self):
+        self._dirty = False
+        self._dim = None
+        self._matrix = None
+        self._keys = None
+        self._index: "OrderedDict[str, int]" = OrderedDict() # key -> slot, cũ nhất đứng đầu
+        self._free_slots: List[int] = []
+
+    def _load(self):
+        self._reset()
+        if not (os.path.exists(self.index_path) and os.path.exists(self.vectors_path)):
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("model") != self.model_name:
+            print(f"Embedding cache của model khác ({meta.get('model')}), bỏ qua.")
+            return
+        self._dim = meta["dim"]
+        rows = os.path.getsize(self.vectors_path) // (4 * self._dim)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(rows, self._dim))
+        self._open_keys(rows, backfill=meta["entries"])
+        entries = [(key, slot) for key, slot in meta["entries"] if slot < rows]
+        # max_items bị giảm so với lần trước -> bỏ các key cũ nhất
+        if len(entries) > self.max_items:
+            self._free_slots = [slot for _, slot in entries[:len(entries) - self.max_items]]
+            entries = entries[len(entries) - self.max_items:]
+        self._index = OrderedDict((key, slot) for key, slot in entries)
+        print(f"Loaded embedding cache: {len(self._index)} vectors ({self.dir})")
+
+    def _open_keys(self, rows: int, backfill=None):
+        """Map keys.bin (rows x KEY_BYTES). Cache cũ chưa có keys.bin -> dựng lại từ index."""
+        size = rows * self.KEY_BYTES
+        missing = not os.path.exists(self.keys_path)
+        with open(self.keys_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode="r+", shape=(rows, self.KEY_BYTES))
+        if missing and backfill:
+            for key, slot in backfill:
+                if slot < rows:
+                    self._keys[slot] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+            self._keys.flush()
+
+    def _acquire_writer(self) -> bool:
+        """Lấy file lock ghi (1 lần / process). Lấy được -> nạp lại index mới nhất trên đĩa trước khi ghi."""
+        if self._writer is not None:
+            return self._writer
+        os.makedirs(self.dir, exist_ok=True)
+        self._lock_file = open(self.lock_path, "a")
+        try:
+            import fcntl
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except ImportError:
+            pass # Không có fcntl (Windows): giả định chỉ 1 process ghi
+        except OSError:
+            print(f"Embedding cache đang được process khác ghi ({self.dir}), process này chỉ đọc.")
+            self._lock_file.close()
+            self._lock_file = None
+            self._writer = False
+            return False
+        self._writer = True
+        self._load()
+        return True
+
+    def _save_index(self):
+        meta = {"model": self.model_name, "dim": self._dim, "entries": list(self._index.items())}
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.index_path)
+
+    def flush(self):
+        """Ghi vector + key đang nằm trong page cache xuống đĩa, rồi ghi index (atomic)."""
+        with self._lock:
+            if not self._dirty or self._matrix is None:
+                return
+            self._matrix.flush()
+            self._keys.flush()
+            self._save_index()
+            self._dirty = False
+
+    # ---------- Slot management ----------
+    def _grow(self, dim: int):
+        """Nới file vector + key thêm GROW_ROWS dòng (không vượt max_items)."""
+        if self._matrix is None:
+            os.makedirs(self.dir, exist_ok=True)
+            self._dim, rows = dim, 0
+        else:
+            rows = self._matrix.shape[0]
+            self._matrix.flush()
+            self._keys.flush()
+            del self._matrix, self._keys
+        new_rows = min(rows + self.GROW_ROWS, self.max_items)
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_rows * self._dim * 4)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(new_rows, self._dim))
+        self._open_keys(new_rows)
+        self._free_slots.extend(range(rows, new_rows))
+
+    def _reserve(self, n: int, dim: int) -> List[int]:
+        """n slot trống; thiếu thì thu hồi slot LRU và lưu index trước khi slot đó bị ghi đè."""
+        while len(self._free_slots) < n and (self._matrix is None or self._matrix.shape[0] < self.max_items):
+            self._grow(dim)
+        evicted = []
+        while len(self._free_slots) + len(evicted) < n and self._index:
+            _, slot = self._index.popitem(last=False)
+            self._keys[slot] = 0
+            evicted.append(slot)
+        if evicted:
+            self.evictions += len(evicted)
+            # Index trên đĩa không còn trỏ tới slot sắp bị ghi đè (kể cả khi process bị kill giữa chừng)
+            self._keys.flush()
+            self._save_index()
+        self._free_slots.extend(evicted)
+        return [self._free_slots.pop() for _ in range(min(n, len(self._free_slots)))]
+
+    def _key(self, kind: str, text: str) -> str:
+        payload = f"{self.model_name}\x00{kind}\x00{text}".encode("utf-8")
+        return hashlib.blake2b(payload, digest_size=self.KEY_BYTES).hexdigest()
+
+    # ---------- Lookup / Store ----------
+    def get_many(self, texts: List[str], kind: str = "document") -> List[Optional[List[float]]]:
+        """Vector đã cache của từng text (None nếu chưa có). Có cập nhật thứ tự LRU + đếm hit/miss."""
+        keys = [self._key(kind, text) for text in texts]
+        with self._lock:
+            results = []
+            for key in keys:
+                slot = self._index.get(key)
+                # Slot đã bị process khác ghi đè -> key trong keys.bin không khớp -> miss
+                if slot is None or self._keys[slot].tobytes() != bytes.fromhex(key):
+                    results.append(None)
+                    continue
+                self._index.move_to_end(key)
+                results.append(self._matrix[slot].tolist())
+            n_missing = sum(1 for vector in results if vector is None)
+            self.hits += len(keys) - n_missing
+            self.misses += n_missing
+        return results
+
+    def put_many(self, texts: List[str], vectors, kind: str = "document"):
+        with self._lock:
+            if not self._acquire_writer():
+                return
+            new = {}
+            for text, vector in zip(texts, vectors):
+                key = self._key(kind, text)
+                if key not in self._index:
+                    new.setdefault(key, vector)
+            if not new:
+                return
+            items = list(new.items())[-self.max_items:]
+            slots = self._reserve(len(items), len(items[0][1]))
+            for (key, vector), slot in zip(items, slots):
+                self._matrix[slot] = vector
+                self._keys[slot] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+                self._index[key] = slot
+            self._dirty = True
+
+    # ---------- Embeddings API ----------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results = self.get_many(texts)
+        # Text chưa có trong cache (khử trùng lặp trong cùng lô)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, results) if vector is None))
+        if missing:
+            # Encode ngoài lock để nhiều thread embed song song được
+            vectors = self.base.embed_documents(missing)
+            self.put_many(missing, vectors)
+            self.flush()
+            computed = dict(zip(missing, vectors))
+            results = [list(computed[text]) if vector is None else vector for text, vector in zip(texts, results)]
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        # Câu hỏi không ghi vào cache đĩa: đã có cache trong RAM phía trên (QueryCachedEmbeddings)
+        return self.base.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return embed_queries(self.base, texts)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._index),
+            "max_items": self.max_items,
+            "writer": bool(self._writer),
+        }
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    embed_query cho nhiều câu hỏi trong 1 lần encode.
+    Chỉ gộp lô khi model encode query giống document (HuggingFaceEmbeddings không có query_encode_kwargs),
+    ngược lại (vd. model cần prefix "query: ") thì gọi embed_query từng câu.
+    """
+    if not texts:
+        return []
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if getattr(embeddings, "query_encode_kwargs", None) == {}:
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
+def normalize_query(text: str) -> str:
+    """Khoá cache cho câu hỏi: NFC, chữ thường, gộp khoảng trắng."""
+    return " ".join(unicodedata.normalize("NFC", text).casefold().split())
+
+
+class QueryCachedEmbeddings(Embeddings):
+    """
+    Cache vector câu hỏi trong RAM (LRU + TTL) trước model embedding.
+    Câu hỏi lặp lại / chỉ khác hoa-thường, khoảng trắng -> không phải encode lại trên CPU.
+    embed_documents đi thẳng xuống model gốc.
+    """
+    def __init__(self, base: Embeddings, maxsize: int = config.QUERY_CACHE_SIZE,
+                 ttl: Optional[float] = config.QUERY_CACHE_TTL):
+        self.base = base
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.cache.get_or_compute(normalize_query(text), lambda: self.base.embed_query(text))
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Nhiều câu hỏi (vd. các biến thể multi-query): câu nào chưa có trong cache được encode chung 1 lô."""
+        keys = [normalize_query(text) for text in texts]
+        results = [self.cache.get(key) for key in keys]
+        missing = {key: text for key, text, vector in zip(keys, texts, results) if vector is None}
+        if missing:
+            computed = dict(zip(missing, embed_queries(self.base, list(missing.values()))))
+            for key, vector in computed.items():
+                self.cache.set(key, vector)
+            results = [computed[key] if vector is None else vector for key, vector in zip(keys, results)]
+        return results
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Gom embed câu hỏi của nhiều request đồng thời (nhiều thread) thành 1 lần encode qua MicroBatcher.
+    embed_documents (ingestion) đi thẳng xuống model gốc.
+    """
+    def __init__(self, base: Embeddings, max_batch: int = config.MICRO_BATCH_MAX_QUERIES,
+                 max_wait_ms: float = config.MICRO_BATCH_WAIT_MS, name: str = "query_embeddings",
+                 timeout: float = config.MICRO_BATCH_TIMEOUT):
+        self.base = base
+        self.batcher = MicroBatcher(lambda texts: embed_queries(base, texts),
+                                    max_batch=max_batch, max_wait_ms=max_wait_ms, name=name, timeout=timeout)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.submit([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.batcher.submit(texts)
+
+
+_SHARED: Dict[str, Embeddings] = {}
+_SHARED_QUERY: Dict[str, QueryCachedEmbeddings] = {}
+_SHARED_LOCK = threading.Lock()
+
+def get_embeddings(model_name: str = config.EMBEDDING_MODEL) -> Embeddings:
+    """
+    Embeddings dùng chung trong process (VectorDB, evaluation...): model chỉ load 1 lần.
+    EMBEDDING_CACHE=False -> trả về HuggingFaceEmbeddings thường.
+    """
+    with _SHARED_LOCK:
+        if model_name not in _SHARED:
+            from langchain_huggingface import HuggingFaceEmbeddings
+            print(f"Loading Embedding Model: {model_name}")
+            base = HuggingFaceEmbeddings(model_name=model_name)
+            _SHARED[model_name] = CachedEmbeddings(base, model_name) if config.EMBEDDING_CACHE else base
+        return _SHARED[model_name]
+
+
+def get_query_embeddings(model_name: str = config.EMBEDDING_MODEL) -> QueryCachedEmbeddings:
+    """
+    Embeddings cho retrieval có cache câu hỏi, dùng chung giữa các agent / session trong process.
+    MICRO_BATCH=True (src.server): câu hỏi không trúng cache của các request đồng thời được encode chung 1 lô.
+    """
+    base = get_embeddings(model_name)
+    with _SHARED_LOCK:
+        if model_name not in _SHARED_QUERY:
+            if config.MICRO_BATCH:
+                base = BatchedEmbeddings(base)
+            _SHARED_QUERY[model_name] = QueryCachedEmbeddings(base)
+        return _SHARED_QUERY[model_name]
+
+
+def cache_stats(model_name: str = config.EMBEDDING_MODEL) -> Optional[dict]:
+    cached = _SHARED.get(model_name)
+    return cached.stats() if isinstance(cached, CachedEmbeddings) else None
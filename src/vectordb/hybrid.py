@@ -0,0 +1,68 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document as LangChainDocument
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+# Internal Import
+from src.utils.helpers import make_chunk_id
+from src.vectordb.sparse_index import SparseIndex
+
+# Dense + sparse chạy song song; dùng chung 1 pool cho mọi retriever trong process
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid")
+
+
+def doc_key(doc: LangChainDocument) -> str:
+    return doc.metadata.get("chunk_id") or make_chunk_id(doc)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[LangChainDocument]], k: int = 60,
+                           weights: Optional[Sequence[float]] = None) -> List[Tuple[LangChainDocument, float]]:
+    """RRF: score(d) = sum_i w_i / (k + rank_i(d)). Chỉ dùng thứ hạng nên không cần chuẩn hoá điểm BM25 vs cosine."""
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[str, float] = {}
+    docs: Dict[str, LangChainDocument] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc_key(doc)
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+            docs.setdefault(key, doc)
+    return [(docs[key], score) for key, score in sorted(fused.items(), key=lambda item: -item[1])]
+
+
+def fuse_hybrid(dense: List[LangChainDocument], sparse: List[LangChainDocument], k: int,
+                rrf_k: int = 60) -> List[LangChainDocument]:
+    """Hợp nhất 1 cặp kết quả dense + sparse, gắn rrf_score vào metadata."""
+    results = []
+    for doc, score in reciprocal_rank_fusion([dense, sparse], k=rrf_k)[:k]:
+        doc.metadata["rrf_score"] = round(score, 6)
+        results.append(doc)
+    return results
+
+
+def submit_sparse_many(sparse_index: SparseIndex, queries: List[str], k: int,
+                       sources: Optional[Sequence[str]] = None) -> List[Future]:
+    """Đẩy BM25 của nhiều câu hỏi lên pool dùng chung (chạy song song với dense search của caller)."""
+    return [_EXECUTOR.submit(sparse_index.search, query, k=k, sources=sources) for query in queries]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense (vector store) + sparse (BM25) chạy song song, hợp nhất bằng Reciprocal Rank Fusion.
+    Trả về k chunk tốt nhất (ít nhưng chính xác hơn over-fetch dense) cho reranker.
+    """
+    vectorstore: VectorStore
+    sparse_index: SparseIndex
+    k: int = 10
+    dense_k: int = 20
+    sparse_k: int = 20
+    rrf_k: int = 60
+    search_kwargs: Dict[str, Any] = {}
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[LangChainDocument]:
+        dense = _EXECUTOR.submit(self.vectorstore.similarity_search, query, k=self.dense_k, **self.search_kwargs)
+        sparse = _EXECUTOR.submit(self.sparse_index.search, query, k=self.sparse_k)
+        sparse_docs = [doc for doc, _ in sparse.result()]
+        return fuse_hybrid(dense.result(), sparse_docs, k=self.k, rrf_k=self.rrf_k)
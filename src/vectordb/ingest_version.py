@@ -0,0 +1,24 @@
+import os
+import time
+import uuid
+# Internal Import
+from src.config import config
+
+
+def bump_ingest_version(path: str = config.INGEST_VERSION_PATH) -> str:
+    """Ghi version mới sau mỗi lần nạp dữ liệu -> các cache phụ thuộc dữ liệu (answer cache...) tự mất hiệu lực."""
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    return version
+
+
+def current_ingest_version(path: str = config.INGEST_VERSION_PATH) -> str:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
@@ -0,0 +1,379 @@
+import json
+import os
+import shutil
+import threading
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document as LangChainDocument
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+def _generation_paths(path: str, generation: int) -> Tuple[str, str]:
+    """File vectors / payloads của 1 generation (generation 0 = tên file của index cũ)."""
+    if generation == 0:
+        return os.path.join(path, "vectors.bin"), os.path.join(path, "payloads.jsonl")
+    return os.path.join(path, f"vectors.{generation}.bin"), os.path.join(path, f"payloads.{generation}.jsonl")
+
+
+def _read_at(file, offset: int, size: int) -> bytes:
+    """Đọc theo offset không đụng vị trí con trỏ file (nhiều thread dùng chung 1 handle)."""
+    if hasattr(os, "pread"):
+        return os.pread(file.fileno(), size, offset)
+    with _READ_LOCK: # Windows: không có pread
+        file.seek(offset)
+        return file.read(size)
+
+_READ_LOCK = threading.Lock()
+
+
+class MmapVectorStore(VectorStore):
+    """
+    Vector store nhúng trong process, không cần server Qdrant:
+    - vectors.<gen>.bin: ma trận (n, dim) float32/float16 đã chuẩn hoá L2, đọc bằng np.memmap (mở gần như tức thì).
+    - payloads.<gen>.jsonl: page_content + metadata từng dòng, đọc theo byte offset khi trả kết quả.
+    - meta.json: generation, dim, dtype, ids, offsets, source từng dòng, các dòng đã xoá (ghi sau cùng, atomic).
+    Tìm kiếm exact top-k bằng tích ma trận NumPy (cosine = dot trên vector đã chuẩn hoá).
+    Upsert/xoá là append + đánh dấu xoá; compact() ghi sang generation mới khi cần dọn.
+    Mỗi instance giữ handle file + memmap của generation nó đang đọc, và đọc lại meta.json khi process
+    khác (ingestion) ghi đè -> compact ở process khác không làm hỏng tìm kiếm đang chạy.
+    """
+    def __init__(self, path: str, embedding: Embeddings, dtype: str = "float32", recreate: bool = False):
+        self.path = path
+        self.embedding = embedding
+        self.meta_path = os.path.join(path, "meta.json")
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._source_array = None
+        self._meta_stamp = None
+
+        if recreate and os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+
+        if os.path.exists(self.meta_path):
+            self._load_meta()
+        else:
+            self.generation = 0
+            self.dim, self.dtype = None, np.dtype(dtype)
+            self.ids, self.offsets, self.deleted, self.sources = [], [], set(), []
+            for file_path in _generation_paths(path, 0):
+                open(file_path, "wb").close()
+            self._vectors_file, self._payloads_file = self._open_generation(0)
+            self._row_of = {}
+
+    # ---------- Storage ----------
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    @property
+    def vectors_path(self) -> str:
+        return _generation_paths(self.path, self.generation)[0]
+
+    @property
+    def payloads_path(self) -> str:
+        return _generation_paths(self.path, self.generation)[1]
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def existing_ids(self) -> set:
+        return set(self._row_of)
+
+    def _open_generation(self, generation: int):
+        vectors_path, payloads_path = _generation_paths(self.path, generation)
+        vectors_file = open(vectors_path, "rb")
+        try:
+            return vectors_file, open(payloads_path, "rb")
+        except BaseException:
+            vectors_file.close()
+            raise
+
+    def _stamp(self):
+        # os.replace đổi inode của meta.json ở mỗi lần ghi -> (inode, mtime) nhận ra mọi lần ghi
+        stat = os.stat(self.meta_path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load_meta(self):
+        """Đọc meta.json và mở file của đúng generation đó (đọc lại nếu compact vừa đổi generation)."""
+        with self._lock:
+            while True:
+                stamp = self._stamp()
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                generation = meta.get("generation", 0)
+                try:
+                    files = self._open_generation(generation)
+                    break
+                except FileNotFoundError:
+                    # Generation này vừa bị dọn sau khi meta.json đổi -> đọc meta mới; meta không đổi thì lỗi thật
+                    if self._stamp() == stamp:
+                        raise
+            # Không đóng handle cũ: thread đang tìm kiếm có thể vẫn đọc generation cũ (GC tự đóng)
+            self._vectors_file, self._payloads_file = files
+            self.generation = generation
+            self.dim, self.dtype = meta["dim"], np.dtype(meta["dtype"])
+            self.ids, self.offsets = meta["ids"], meta["offsets"]
+            self.deleted = set(meta["deleted"])
+            # Index cũ chưa lưu source -> dựng lại từ payload ở lần lọc đầu tiên
+            self.sources = meta.get("sources")
+            self._row_of = {cid: row for row, cid in enumerate(self.ids) if row not in self.deleted}
+            self._matrix = None
+            self._source_array = None
+            self._meta_stamp = stamp
+
+    def refresh(self):
+        """Process khác đã ghi meta.json (upsert / xoá / compact) -> đọc lại để thấy dữ liệu mới."""
+        try:
+            stamp = self._stamp()
+        except FileNotFoundError:
+            return
+        if stamp != self._meta_stamp:
+            with self._lock:
+                if self._stamp() != self._meta_stamp:
+                    self._load_meta()
+
+    def _save_meta(self):
+        meta = {
+            "generation": self.generation,
+            "dim": self.dim, "dtype": self.dtype.name,
+            "ids": self.ids, "offsets": self.offsets, "deleted": sorted(self.deleted),
+            "sources": self.sources,
+        }
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        self._meta_stamp = self._stamp()
+
+    @property
+    def matrix(self) -> np.ndarray:
+        with self._lock:
+            if self._matrix is None:
+                rows = len(self.ids)
+                if rows == 0 or self.dim is None:
+                    return np.empty((0, self.dim or 0), dtype=self.dtype)
+                # Map từ handle đang giữ, không mở lại theo tên file
+                self._matrix = np.memmap(self._vectors_file, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+            return self._matrix
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def upsert(self, ids: Sequence[str], documents: Sequence[LangChainDocument], vectors):
+        """Ghi thêm (append) các vector + payload; ID đã tồn tại thì dòng cũ bị đánh dấu xoá."""
+        if not ids:
+            return
+        vectors = self._normalize(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if self.sources is None:
+                self.sources = [self._document(row).metadata.get("source", "") for row in range(len(self.ids))]
+            with open(self.payloads_path, "ab") as f:
+                for doc in documents:
+                    self.offsets.append(f.tell())
+                    self.sources.append(doc.metadata.get("source", ""))
+                    record = {"page_content": doc.page_content, "metadata": doc.metadata}
+                    f.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.astype(self.dtype).tobytes())
+            for cid in ids:
+                cid = str(cid)
+                if cid in self._row_of:
+                    self.deleted.add(self._row_of[cid])
+                self._row_of[cid] = len(self.ids)
+                self.ids.append(cid)
+            self._matrix = None # File đã lớn thêm -> map lại ở lần đọc sau
+            self._source_array = None
+            self._save_meta()
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        with self._lock:
+            for cid in ids or []:
+                row = self._row_of.pop(str(cid), None)
+                if row is not None:
+                    self.deleted.add(row)
+            self._save_meta()
+        return True
+
+    def compact(self):
+        """
+        Ghi các dòng còn sống (bỏ dòng đã xoá / bị ghi đè) sang generation mới, rồi ghi meta.json (atomic)
+        trỏ sang generation đó. Instance đang đọc generation cũ vẫn giữ handle + memmap của nó (file bị xoá
+        khỏi thư mục nhưng còn đọc được tới khi đóng), lần tìm kiếm sau tự chuyển sang generation mới.
+        """
+        with self._lock:
+            if not self.deleted:
+                return
+            live = sorted(self._row_of.values())
+            ids = [self.ids[row] for row in live]
+            sources = [self.sources[row] for row in live] if self.sources is not None else []
+            offsets = []
+            generation = self.generation + 1
+            vectors_path, payloads_path = _generation_paths(self.path, generation)
+            try:
+                with open(payloads_path, "wb") as f:
+                    for row in live:
+                        doc = self._document(row)
+                        offsets.append(f.tell())
+                        if self.sources is None:
+                            sources.append(doc.metadata.get("source", ""))
+                        record = {"page_content": doc.page_content, "metadata": doc.metadata}
+                        f.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(vectors_path, "wb") as f:
+                    # Từng khối để không phải đọc cả ma trận vào RAM
+                    for start in range(0, len(live), 4096):
+                        f.write(np.asarray(self.matrix[live[start:start + 4096]], dtype=self.dtype).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                files = self._open_generation(generation)
+            except BaseException:
+                for file_path in (vectors_path, payloads_path):
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                raise
+            self._vectors_file, self._payloads_file = files
+            self.generation = generation
+            self.ids, self.offsets, self.deleted, self.sources = ids, offsets, set(), sources
+            self._row_of = {cid: row for row, cid in enumerate(ids)}
+            self._matrix = None
+            self._source_array = None
+            self._save_meta() # Điểm commit: từ đây reader mở meta.json sẽ thấy generation mới
+            self._remove_old_generations()
+
+    def _remove_old_generations(self):
+        """
+        Xoá file của các generation cũ. POSIX: handle / memmap đang mở vẫn đọc được sau khi xoá,
+        reader chưa kịp mở sẽ đọc lại meta.json. Windows: file đang mở không xoá được -> để lần compact sau.
+        """
+        keep = set(map(os.path.basename, _generation_paths(self.path, self.generation)))
+        for filename in os.listdir(self.path):
+            if filename in keep or not (filename.startswith("vectors.") or filename.startswith("payloads.")):
+                continue
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                pass
+
+    def _document(self, row: int) -> LangChainDocument:
+        return self._read_document(self._payloads_file, self.offsets, row)
+
+    @staticmethod
+    def _read_document(payloads_file, offsets: List[int], row: int) -> LangChainDocument:
+        start = offsets[row]
+        end = offsets[row + 1] if row + 1 < len(offsets) else os.fstat(payloads_file.fileno()).st_size
+        record = json.loads(_read_at(payloads_file, start, end - start).split(b"\n", 1)[0])
+        return LangChainDocument(page_content=record["page_content"], metadata=record["metadata"])
+
+    # ---------- Search ----------
+    def source_rows(self, sources: Sequence[str]) -> np.ndarray:
+        """Các dòng thuộc 1 trong các source (payload index trong RAM, dựng 1 lần)."""
+        with self._lock:
+            if self._source_array is None:
+                if self.sources is None:
+                    self.sources = [self._document(row).metadata.get("source", "") for row in range(len(self.ids))]
+                self._source_array = np.array(self.sources, dtype=object)
+            return np.flatnonzero(np.isin(self._source_array, list(sources)))
+
+    def search_vectors(self, query_vectors, k: int = 4,
+                       row_filter: Optional[Callable[[LangChainDocument], bool]] = None,
+                       sources: Optional[Sequence[str]] = None
+                       ) -> List[List[Tuple[LangChainDocument, float]]]:
+        """
+        Exact top-k cho nhiều câu hỏi cùng lúc: 1 phép nhân (m, dim) x (dim, n).
+        sources: chỉ nhân với các dòng thuộc các source này (1 phần của ma trận).
+        Trả về list (Document, cosine score) cho từng câu hỏi.
+        """
+        self.refresh()
+        # Chụp trạng thái 1 lần: upsert / compact chạy song song không làm lệch dòng <-> payload
+        with self._lock:
+            matrix, payloads_file, offsets = self.matrix, self._payloads_file, self.offsets
+            deleted = list(self.deleted)
+            rows = self.source_rows(sources) if sources else None
+        queries = self._normalize(query_vectors)
+        if matrix.shape[0] == 0:
+            return [[] for _ in range(len(queries))]
+        if sources:
+            # Không thuộc source nào -> -inf, chỉ tính điểm các dòng được chọn
+            scores = np.full((len(queries), matrix.shape[0]), -np.inf, dtype=np.float32)
+            if len(rows):
+                scores[:, rows] = queries @ np.asarray(matrix[rows], dtype=np.float32).T
+        else:
+            # float32: asarray chỉ là view trên memmap; float16: đổi kiểu 1 lần cho cả lô câu hỏi
+            scores = np.asarray(queries @ np.asarray(matrix, dtype=np.float32).T)
+        if deleted:
+            scores[:, deleted] = -np.inf
+
+        results = []
+        for row_scores in scores:
+            # Có filter -> lấy dư rồi lọc; không thì argpartition đúng k
+            fetch = min(len(row_scores), k if row_filter is None else max(k * 4, 64))
+            while True:
+                top = np.argpartition(-row_scores, fetch - 1)[:fetch]
+                top = top[np.argsort(-row_scores[top])]
+                hits = []
+                for row in top:
+                    if not np.isfinite(row_scores[row]):
+                        break
+                    doc = self._read_document(payloads_file, offsets, int(row))
+                    if row_filter is None or row_filter(doc):
+                        hits.append((doc, float(row_scores[row])))
+                        if len(hits) == k:
+                            break
+                if len(hits) == k or fetch == len(row_scores):
+                    break
+                fetch = min(len(row_scores), fetch * 4)
+            results.append(hits)
+        return results
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               **kwargs: Any) -> List[Tuple[LangChainDocument, float]]:
+        return self.search_vectors([embedding], k=k, row_filter=kwargs.get("row_filter"),
+                                   sources=kwargs.get("sources"))[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[LangChainDocument]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[LangChainDocument, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[LangChainDocument]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def batch_similarity_search_with_score(self, queries: List[str], k: int = 4,
+                                           **kwargs: Any) -> List[List[Tuple[LangChainDocument, float]]]:
+        """Nhiều câu hỏi (vd. các biến thể multi-query) -> 1 lần tìm kiếm."""
+        vectors = [self.embedding.embed_query(query) for query in queries]
+        return self.search_vectors(vectors, k=k, row_filter=kwargs.get("row_filter"),
+                                   sources=kwargs.get("sources"))
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Score đã là cosine similarity
+        return lambda score: score
+
+    # ---------- LangChain API ----------
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [str(cid) for cid in ids] if ids else [m.get("chunk_id") or str(len(self.ids) + i) for i, m in enumerate(metadatas)]
+        documents = [LangChainDocument(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        self.upsert(ids, documents, self.embedding.embed_documents(texts))
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, path: str = None, dtype: str = "float32",
+                   **kwargs: Any) -> "MmapVectorStore":
+        store = cls(path, embedding, dtype=dtype, recreate=True)
+        store.add_texts(texts, metadatas, ids)
+        return store
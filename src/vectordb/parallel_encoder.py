@@ -0,0 +1,94 @@
+import multiprocessing as mp
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+# Internal Import
+from src.config import config
+
+
+# ===== Hàm chạy trong worker process (phải ở top-level để pickle được) =====
+_MODEL = None
+
+def _init_worker(model_name: str, threads: int):
+    """Mỗi worker load 1 bản model, giới hạn số thread torch để các worker không tranh CPU."""
+    global _MODEL
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(threads)
+    _MODEL = SentenceTransformer(model_name, device="cpu")
+
+def _encode_batch(indices: List[int], texts: List[str]) -> Tuple[List[int], np.ndarray]:
+    vectors = _MODEL.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+    return indices, vectors.astype(np.float32, copy=False)
+
+
+class ParallelEncoder(Embeddings):
+    """
+    Encoder embedding chạy trên process pool (CPU-only ingest).
+    - Text được sort theo độ dài trước khi chia lô -> mỗi lô có độ dài gần nhau, ít padding.
+    - Các lô được đẩy cho worker rảnh trước; vector trả về ngay khi lô encode xong (iter_encode),
+      nên bước upsert chạy chồng lên bước encode.
+    Cùng model + cùng cách encode với HuggingFaceEmbeddings (không normalize).
+    """
+    def __init__(self, model_name: str = config.EMBEDDING_MODEL, workers: int = config.EMBED_WORKERS,
+                 batch_size: int = config.EMBED_BATCH_SIZE):
+        self.model_name = model_name
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.batch_size = max(1, batch_size)
+        self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            print(f"Khởi động encoder pool: {self.workers} workers x {threads} threads, batch={self.batch_size}")
+            # spawn: không fork process đang giữ thread pool của torch
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, threads),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _batches(self, texts: List[str]) -> List[List[int]]:
+        # Dài trước: lô nặng nhất chạy sớm, tránh 1 worker ôm lô dài ở cuối
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        return [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+    def iter_encode(self, texts: List[str]) -> Iterator[Tuple[List[int], np.ndarray]]:
+        """Yield (vị trí trong texts, ma trận vector) theo thứ tự lô nào xong trước."""
+        if not texts:
+            return
+        pool = self._get_pool()
+        batches = iter(self._batches(texts))
+        pending = set()
+        # Giới hạn số lô đang chờ -> bộ nhớ không tăng theo số text
+        max_in_flight = self.workers * 2
+        while True:
+            while len(pending) < max_in_flight:
+                indices = next(batches, None)
+                if indices is None:
+                    break
+                pending.add(pool.submit(_encode_batch, indices, [texts[i] for i in indices]))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results = [None] * len(texts)
+        for indices, vectors in self.iter_encode(texts):
+            for i, vector in zip(indices, vectors):
+                results[i] = vector.tolist()
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional
+from langchain_core.documents import Document as LangChainDocument
+# Internal Import
+from src.utils.lru import TTLCache
+
+
+class ParentStoreBuilder:
+    """
+    Ghi các parent section (khối văn xuôi / bảng của trang) lúc ingestion, dùng được cho pipeline streaming.
+    Format giống PageStore (JSONL) nhưng file index khoá theo parent_id thay vì số thứ tự.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(f"{path}.tmp", "wb")
+        self._offsets: Dict[str, int] = {}
+
+    def add(self, parents: Iterable[LangChainDocument]):
+        for doc in parents:
+            parent_id = doc.metadata["chunk_id"]
+            if parent_id in self._offsets:
+                continue
+            self._offsets[parent_id] = self._file.tell()
+            record = {"page_content": doc.page_content, "metadata": doc.metadata}
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+
+    def save(self):
+        self._file.close()
+        os.replace(f"{self.path}.tmp", self.path)
+        # Index ghi sau cùng: chưa có index = store chưa ghi xong
+        with open(f"{self.index_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self._offsets, f)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+        print(f"Saved parent store: {len(self._offsets)} parents -> {self.path}")
+
+
+class ParentStore:
+    """
+    Docstore cục bộ của parent section, đọc ngẫu nhiên theo parent_id (seek theo byte offset).
+    Chỉ parent của top-n kết quả cuối cùng được đọc; parent hay dùng được giữ trong LRU.
+    """
+    def __init__(self, path: str, offsets: Dict[str, int], cache_size: int = 1024):
+        self.path = path
+        self.offsets = offsets
+        self.cache = TTLCache(maxsize=cache_size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __contains__(self, parent_id: str) -> bool:
+        return parent_id in self.offsets
+
+    @classmethod
+    def load(cls, path: str) -> Optional["ParentStore"]:
+        index_path = f"{path}.idx"
+        if not os.path.exists(path) or not os.path.exists(index_path):
+            return None
+        with open(index_path, "r", encoding="utf-8") as f:
+            return cls(path, json.load(f))
+
+    def get_many(self, parent_ids: List[str]) -> Dict[str, LangChainDocument]:
+        found, missing = {}, []
+        for parent_id in dict.fromkeys(parent_ids):
+            cached = self.cache.get(parent_id)
+            if cached is not None:
+                found[parent_id] = cached
+            elif parent_id in self.offsets:
+                missing.append(parent_id)
+        if missing:
+            with self._lock, open(self.path, "rb") as f:
+                for parent_id in sorted(missing, key=self.offsets.get):
+                    f.seek(self.offsets[parent_id])
+                    record = json.loads(f.readline())
+                    doc = LangChainDocument(page_content=record["page_content"], metadata=record["metadata"])
+                    self.cache.set(parent_id, doc)
+                    found[parent_id] = doc
+        return found
@@ -1,36 +1,61 @@
+import asyncio
 import os
 import sys
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Sequence, Tuple
 #from langchain_community.vectorstores import Pinecone
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 from src.config import config
+from src.utils.helpers import make_chunk_id, batched
+from langchain_core.documents import Document as LangChainDocument
+from src.vectordb.embedding_cache import CachedEmbeddings, get_embeddings, get_query_embeddings
+from src.vectordb.parallel_encoder import ParallelEncoder
+from src.vectordb.mmap_index import MmapVectorStore
+from src.vectordb.sparse_index import SparseIndex
+from src.vectordb.hybrid import HybridRetriever, fuse_hybrid, submit_sparse_many
+from src.utils.concurrency import run_cpu
 
 
 class VectorDB:
-    def __init__(self, documents: Optional[List] = None):
+    def __init__(self, documents: Optional[List] = None, mode: str = "full", streaming: bool = False):
         
         # 1. Khởi tạo thuộc tính cơ bản
         self.collection_name = config.COLLECTION_NAME
         self.db_type = config.VECTOR_DB_TYPE
         self.db_path = config.QDRANT_LOCAL_PATH
+        self.mode = mode
+        self.last_sync_report = None
+        self._sparse_index = None
+        self._async_client = None
         
-        # Setup Embedding
-        print(f"Loading Embedding Model: {config.EMBEDDING_MODEL}")
-        self.embeddings = HuggingFaceEmbeddings(model_name=config.EMBEDDING_MODEL)
+        # Setup Embedding (có cache vector trên đĩa, dùng chung trong process)
+        self.embeddings = get_embeddings(config.EMBEDDING_MODEL)
+        # Retrieval: vector câu hỏi đi qua cache LRU/TTL trong RAM
+        self.query_embeddings = get_query_embeddings(config.EMBEDDING_MODEL)
+        # Encoder cho ingestion: "default" = model trong process, "parallel" = process pool
+        self.encoder = ParallelEncoder() if config.ENCODER_MODE == "parallel" else None
 
         # 2. Thiết lập kết nối dựa trên loại DB
         self.client_config = self._get_client_config()
         
         # 3. Khởi tạo Vector Store
-        if documents and len(documents) > 0:
-            self.db = self._create_new_db(documents)
+        if streaming:
+            # Pipeline streaming tự embed + upsert từng lô -> chỉ cần chuẩn bị collection
+            self.db = self._prepare_streaming_db()
+        elif documents and len(documents) > 0:
+            if self.mode == "incremental":
+                self.db = self._sync_db(documents)
+            else:
+                self.db = self._create_new_db(documents)
         else:
             self.db = self._load_existing_db()
     
     def _get_client_config(self) -> dict:
         
+        if self.db_type == "mmap":
+            print(f"Using Mmap Index: {config.MMAP_INDEX_PATH}")
+            return {"path": config.MMAP_INDEX_PATH}
+
         if self.db_type == "qdrant_cloud":
             if not config.QDRANT_ENDPOINT or not config.QDRANT_API_KEY:
                 raise ValueError("Thiếu cấu hình Qdrant Cloud trong .env")
@@ -50,19 +75,213 @@ class VectorDB:
         if self.db_type == "qdrant_local":
             os.makedirs(self.client_config["path"], exist_ok=True)
 
-        return QdrantVectorStore.from_documents(
-            documents=documents,
-            embedding=self.embeddings,
+        # Gắn ID ổn định ngay cả khi rebuild để lần chạy incremental sau dùng lại được
+        unique_docs = {}
+        for doc in documents:
+            chunk_id = make_chunk_id(doc)
+            doc.metadata["chunk_id"] = chunk_id
+            unique_docs.setdefault(chunk_id, doc)
+
+        if self.encoder is not None or self.db_type == "mmap":
+            self.db = self._open_store(recreate=True)
+            self._embed_and_upsert(list(unique_docs.values()))
+            return self.db
+
+        store = QdrantVectorStore.from_documents(
+            documents=list(unique_docs.values()),
+            ids=list(unique_docs.keys()),
+            embedding=self.query_embeddings,
             collection_name=self.collection_name,
             force_recreate=True,
             **self.client_config # Unpack tham số (url/api_key hoặc path)
         )
+        self._ensure_payload_indexes(store.client)
+        return store
+
+    def _ensure_payload_indexes(self, client: QdrantClient):
+        """Payload index cho các trường hay lọc (metadata.source) -> search có filter chỉ duyệt phần khớp."""
+        schema = client.get_collection(self.collection_name).payload_schema or {}
+        for field in config.PAYLOAD_INDEX_FIELDS:
+            if field not in schema:
+                print(f"Tạo payload index '{field}'...")
+                client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=field,
+                    field_schema=models.PayloadSchemaType.KEYWORD,
+                )
     
+    def _open_store(self, recreate: bool = False) -> QdrantVectorStore:
+        """Mở client + đảm bảo collection tồn tại (recreate=True -> xoá và tạo lại)."""
+        if self.db_type == "mmap":
+            return MmapVectorStore(
+                self.client_config["path"], self.query_embeddings, dtype=config.MMAP_DTYPE, recreate=recreate
+            )
+
+        if self.db_type == "qdrant_local":
+            os.makedirs(self.client_config["path"], exist_ok=True)
+
+        client = QdrantClient(**self.client_config)
+        exists = client.collection_exists(self.collection_name)
+        if exists and recreate:
+            print(f"Xoá Collection cũ '{self.collection_name}'...")
+            client.delete_collection(self.collection_name)
+        if not exists or recreate:
+            print(f"Tạo mới Collection '{self.collection_name}'...")
+            dim = len(self.embeddings.embed_query("dimension probe"))
+            client.create_collection(
+                collection_name=self.collection_name,
+                vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE),
+            )
+        self._ensure_payload_indexes(client)
+
+        return QdrantVectorStore(
+            client=client,
+            collection_name=self.collection_name,
+            embedding=self.query_embeddings,
+        )
+
+    def _prepare_streaming_db(self) -> QdrantVectorStore:
+        # "full" -> xoá trắng collection trước khi stream; "incremental" -> giữ nguyên
+        return self._open_store(recreate=self.mode != "incremental")
+
+    def _sync_db(self, documents: List) -> QdrantVectorStore:
+        """
+        Nạp tăng dần (incremental): mỗi chunk có ID ổn định từ (source, page, content hash).
+        Chỉ embed + upsert chunk mới/thay đổi, xoá chunk không còn trong tài liệu.
+        """
+        store = self._open_store()
+        self.db = store
+
+        # Gom chunk theo ID (chunk trùng nội dung trên cùng trang chỉ giữ 1 bản)
+        incoming = {}
+        for doc in documents:
+            chunk_id = make_chunk_id(doc)
+            doc.metadata["chunk_id"] = chunk_id
+            incoming.setdefault(chunk_id, doc)
+
+        existing = self.existing_ids()
+        to_add = [cid for cid in incoming if cid not in existing]
+        to_delete = [cid for cid in existing if cid not in incoming]
+
+        if to_add:
+            print(f"Đang embed + upsert {len(to_add)} chunks mới/thay đổi...")
+            if self.encoder is not None or self.db_type == "mmap":
+                self._embed_and_upsert([incoming[cid] for cid in to_add])
+            else:
+                store.add_documents([incoming[cid] for cid in to_add], ids=to_add)
+        if to_delete:
+            print(f"Đang xoá {len(to_delete)} chunks không còn tồn tại...")
+            self.delete_ids(to_delete)
+
+        self.last_sync_report = {
+            "added": len(to_add),
+            "deleted": len(to_delete),
+            "unchanged": len(incoming) - len(to_add),
+            "total": len(incoming),
+        }
+        print(
+            f"Incremental sync: +{self.last_sync_report['added']} / "
+            f"-{self.last_sync_report['deleted']} / "
+            f"={self.last_sync_report['unchanged']} (tổng {self.last_sync_report['total']} chunks)"
+        )
+        return store
+
+    def existing_ids(self) -> set:
+        """Lấy toàn bộ ID đang có trong collection (không kéo vector/payload)."""
+        if self.db_type == "mmap":
+            return self.db.existing_ids()
+        ids = set()
+        offset = None
+        while True:
+            points, offset = self.db.client.scroll(
+                collection_name=self.collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False,
+            )
+            ids.update(str(point.id) for point in points)
+            if offset is None:
+                break
+        return ids
+
+    def iter_embed(self, texts: List[str]):
+        """
+        Yield (vị trí trong texts, vectors) theo từng lô ngay khi có:
+        lấy từ embedding cache trước, phần còn lại encode bằng self.encoder (hoặc model trong process).
+        """
+        cache = self.embeddings if isinstance(self.embeddings, CachedEmbeddings) else None
+        if self.encoder is None:
+            yield list(range(len(texts))), self.embeddings.embed_documents(texts)
+            return
+
+        cached = cache.get_many(texts) if cache else [None] * len(texts)
+        hits = [i for i, vector in enumerate(cached) if vector is not None]
+        if hits:
+            yield hits, [cached[i] for i in hits]
+
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        missing_texts = [texts[i] for i in missing]
+        for indices, vectors in self.encoder.iter_encode(missing_texts):
+            if cache:
+                cache.put_many([missing_texts[i] for i in indices], vectors)
+            yield [missing[i] for i in indices], vectors
+        if cache:
+            cache.flush()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results = [None] * len(texts)
+        for indices, vectors in self.iter_embed(texts):
+            for i, vector in zip(indices, vectors):
+                results[i] = vector
+        return results
+
+    def _embed_and_upsert(self, documents: List):
+        """Encode theo lô (song song nếu ENCODER_MODE="parallel") và upsert ngay lô nào xong trước."""
+        done = 0
+        for indices, vectors in self.iter_embed([doc.page_content for doc in documents]):
+            for batch in batched(list(zip(indices, vectors)), config.EMBED_BATCH_SIZE):
+                self.upsert_embedded([documents[i] for i, _ in batch], [vector for _, vector in batch])
+            done += len(indices)
+            print(f"Embedded + upserted {done}/{len(documents)} chunks", end="\r")
+        print()
+
+    def upsert_embedded(self, documents: List, vectors: List[List[float]]):
+        """Upsert các chunk đã có sẵn vector (ID lấy từ metadata['chunk_id'])."""
+        if self.db_type == "mmap":
+            self.db.upsert([doc.metadata["chunk_id"] for doc in documents], documents, vectors)
+            return
+        points = [
+            models.PointStruct(
+                id=doc.metadata["chunk_id"],
+                vector=[float(x) for x in vector],
+                # Cùng layout payload với QdrantVectorStore để retrieval đọc lại được
+                payload={"page_content": doc.page_content, "metadata": doc.metadata},
+            )
+            for doc, vector in zip(documents, vectors)
+        ]
+        self.db.client.upsert(collection_name=self.collection_name, points=points)
+
+    def delete_ids(self, ids: List[str]):
+        if self.db_type == "mmap":
+            self.db.delete(ids)
+            self.db.compact() # Dọn các dòng đã xoá khỏi file
+            return
+        self.db.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.PointIdsList(points=list(ids)),
+        )
+
     def _load_existing_db(self) -> QdrantVectorStore:
         """Kết nối tới DB đã tồn tại (Retrieval)."""
         # Kiểm tra folder nếu chạy local
         if self.db_type == "qdrant_local" and not os.path.exists(self.client_config["path"]):
             raise FileNotFoundError(f"Chưa thấy DB tại {self.client_config['path']}")
+        if self.db_type == "mmap":
+            if not os.path.exists(os.path.join(self.client_config["path"], "meta.json")):
+                raise FileNotFoundError(f"Chưa thấy Mmap Index tại {self.client_config['path']}")
+            # Chỉ map file, không nạp ma trận vào RAM
+            return self._open_store()
 
         print(f"Kết nối tới Collection: {self.collection_name}")
         # Khởi tạo client 
@@ -71,12 +290,152 @@ class VectorDB:
         return QdrantVectorStore(
             client=client,
             collection_name=self.collection_name,
-            embedding=self.embeddings,
+            embedding=self.query_embeddings,
         )
     
-    def get_retriever(self, search_kwargs: Dict = None): 
+    def query_cache_stats(self) -> dict:
+        return self.query_embeddings.stats()
+
+    @property
+    def sparse_index(self) -> Optional[SparseIndex]:
+        """Index BM25 dựng lúc ingestion (load lazy, None nếu chưa có)."""
+        if self._sparse_index is None:
+            self._sparse_index = SparseIndex.load(config.SPARSE_INDEX_PATH)
+        return self._sparse_index
+
+    @staticmethod
+    def _source_filter(sources: Optional[Sequence[str]]) -> Optional[models.Filter]:
+        if not sources:
+            return None
+        return models.Filter(must=[
+            models.FieldCondition(key="metadata.source", match=models.MatchAny(any=list(sources)))
+        ])
+
+    def search_with_score(self, query: str, k: int = 4,
+                          sources: Optional[Sequence[str]] = None) -> List[Tuple[LangChainDocument, float]]:
+        """Dense search 1 câu hỏi, chỉ trong các source được chọn (None = toàn bộ collection)."""
+        if self.db_type == "mmap":
+            return self.db.similarity_search_with_score(query, k=k, sources=sources)
+        return self.db.similarity_search_with_score(query, k=k, filter=self._source_filter(sources))
+
+    def _dense_search_many(self, queries: List[str], k: int,
+                           sources: Optional[Sequence[str]] = None) -> List[List[LangChainDocument]]:
+        """Embed tất cả câu hỏi trong 1 lô + 1 lần tìm kiếm (mmap: 1 phép nhân ma trận; Qdrant: 1 request batch)."""
+        vectors = self.query_embeddings.embed_queries(queries)
+        if self.db_type == "mmap":
+            return [[doc for doc, _ in hits] for hits in self.db.search_vectors(vectors, k=k, sources=sources)]
+
+        responses = self.db.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=self._query_requests(vectors, k, sources),
+        )
+        return [[self._point_document(point) for point in response.points] for response in responses]
+
+    def _query_requests(self, vectors, k: int, sources: Optional[Sequence[str]] = None) -> List[models.QueryRequest]:
+        query_filter = self._source_filter(sources)
+        return [
+            models.QueryRequest(query=[float(x) for x in vector], filter=query_filter, limit=k, with_payload=True)
+            for vector in vectors
+        ]
+
+    @staticmethod
+    def _point_document(point) -> LangChainDocument:
+        return LangChainDocument(
+            page_content=point.payload.get("page_content", ""),
+            metadata=point.payload.get("metadata") or {},
+        )
+
+    def batch_search(self, queries: List[str], k: int = 4, search_type: str = "similarity",
+                     sources: Optional[Sequence[str]] = None) -> List[List[LangChainDocument]]:
+        """
+        Tìm kiếm nhiều câu hỏi cùng lúc (vd. các biến thể multi-query), trả về kết quả theo từng câu.
+        sources: chỉ tìm trong các tài liệu này (do QueryRouter chọn), None = tất cả.
+        """
+        if not queries:
+            return []
+        if search_type == "hybrid" and self.sparse_index is not None:
+            # Dense (1 lô) và BM25 (song song) chạy đồng thời
+            sparse = submit_sparse_many(self.sparse_index, queries, config.HYBRID_SPARSE_K, sources=sources)
+            dense = self._dense_search_many(queries, config.HYBRID_DENSE_K, sources=sources)
+            return [
+                fuse_hybrid(dense_docs, [doc for doc, _ in future.result()], k=k, rrf_k=config.RRF_K)
+                for dense_docs, future in zip(dense, sparse)
+            ]
+        return self._dense_search_many(queries, k, sources=sources)
+
+    # ---------- Async (aresearch) ----------
+    @property
+    def is_remote(self) -> bool:
+        """Qdrant Cloud: tìm kiếm là I/O mạng. mmap / Qdrant local: tìm kiếm là việc CPU trong process."""
+        return "url" in self.client_config
+
+    @property
+    def async_client(self):
+        """AsyncQdrantClient (tạo lười) cho Qdrant Cloud: chờ mạng trên event loop, không giữ thread của CPU_EXECUTOR."""
+        if self._async_client is None:
+            from qdrant_client import AsyncQdrantClient
+            self._async_client = AsyncQdrantClient(**self.client_config)
+        return self._async_client
+
+    async def asearch_with_score(self, query: str, k: int = 4,
+                                 sources: Optional[Sequence[str]] = None) -> List[Tuple[LangChainDocument, float]]:
+        """
+        Bản async của search_with_score: chỉ phần CPU (embed câu hỏi; mmap / Qdrant local) chạy trên
+        CPU_EXECUTOR, request tới Qdrant Cloud được chờ bằng AsyncQdrantClient.
+        """
+        if not self.is_remote:
+            return await run_cpu(self.search_with_score, query, k, sources)
+        vector = await run_cpu(self.query_embeddings.embed_query, query)
+        response = await self.async_client.query_points(
+            collection_name=self.collection_name,
+            query=[float(x) for x in vector],
+            query_filter=self._source_filter(sources),
+            limit=k,
+            with_payload=True,
+        )
+        return [(self._point_document(point), point.score) for point in response.points]
+
+    async def abatch_search(self, queries: List[str], k: int = 4, search_type: str = "similarity",
+                            sources: Optional[Sequence[str]] = None) -> List[List[LangChainDocument]]:
+        """Bản async của batch_search (CPU trên CPU_EXECUTOR, I/O Qdrant Cloud trên event loop)."""
+        if not queries:
+            return []
+        if not self.is_remote:
+            return await run_cpu(self.batch_search, queries, k, search_type, sources)
+        hybrid = search_type == "hybrid" and self.sparse_index is not None
+        # BM25 chạy trên pool của hybrid trong lúc chờ embed + Qdrant
+        sparse = submit_sparse_many(self.sparse_index, queries, config.HYBRID_SPARSE_K, sources=sources) if hybrid else None
+        vectors = await run_cpu(self.query_embeddings.embed_queries, queries)
+        responses = await self.async_client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=self._query_requests(vectors, config.HYBRID_DENSE_K if hybrid else k, sources),
+        )
+        dense = [[self._point_document(point) for point in response.points] for response in responses]
+        if sparse is None:
+            return dense
+        sparse_hits = await asyncio.gather(*(asyncio.wrap_future(future) for future in sparse))
+        return [
+            fuse_hybrid(dense_docs, [doc for doc, _ in hits], k=k, rrf_k=config.RRF_K)
+            for dense_docs, hits in zip(dense, sparse_hits)
+        ]
+
+    def get_retriever(self, search_kwargs: Dict = None, search_type: str = "similarity"): 
         if search_kwargs is None:
             search_kwargs = {"k": 4}
+
+        if search_type == "hybrid":
+            if self.sparse_index is not None:
+                extra = {key: value for key, value in search_kwargs.items() if key != "k"}
+                return HybridRetriever(
+                    vectorstore=self.db,
+                    sparse_index=self.sparse_index,
+                    k=search_kwargs.get("k", 4),
+                    dense_k=config.HYBRID_DENSE_K,
+                    sparse_k=config.HYBRID_SPARSE_K,
+                    rrf_k=config.RRF_K,
+                    search_kwargs=extra,
+                )
+            print(f"Chưa có sparse index tại {config.SPARSE_INDEX_PATH}, dùng dense retrieval.")
         
         return self.db.as_retriever(
             search_type="similarity",
@@ -0,0 +1,186 @@
+import json
+import os
+from array import array
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document as LangChainDocument
+# Internal Import
+from src.config import config
+from src.processing.page_cache import PageStore
+from src.utils.text import tokenize_vi
+
+
+class SparseIndexBuilder:
+    """
+    Dựng inverted index BM25 lúc ingestion (nạp từng lô chunk, dùng được cho pipeline streaming).
+    Payload chunk được ghi thẳng xuống file JSONL cùng format với PageStore.
+    Postings chỉ giữ trong RAM cho tối đa `spill_every` chunk, sau đó được ghi ra 1 file run
+    (mảng NumPy đã sắp theo term) và gộp lại lúc save() -> RAM không tăng theo số chunk
+    ngoài ~20 byte/chunk (độ dài, offset payload, source).
+    """
+    def __init__(self, path: str, spill_every: int = config.SPARSE_SPILL_CHUNKS):
+        self.path = path
+        self.docs_path = f"{path}.docs.jsonl"
+        self.spill_every = spill_every
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._docs_file = open(f"{self.docs_path}.tmp", "wb")
+        self._offsets = array("q")
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._pending_docs = 0
+        self._runs: List[str] = []
+        self._doc_len = array("i")
+        self._sources: List[str] = []
+
+    def add(self, documents: Iterable[LangChainDocument]):
+        for doc in documents:
+            doc_idx = len(self._doc_len)
+            counts = Counter(tokenize_vi(doc.page_content))
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append((doc_idx, tf))
+            self._doc_len.append(sum(counts.values()))
+            self._sources.append(doc.metadata.get("source", ""))
+            self._offsets.append(self._docs_file.tell())
+            record = {"page_content": doc.page_content, "metadata": doc.metadata}
+            self._docs_file.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+            self._pending_docs += 1
+            if self._pending_docs >= self.spill_every:
+                self._spill()
+
+    def _spill(self):
+        """Ghi postings đang giữ trong RAM ra 1 file run (CSR theo term đã sắp) rồi giải phóng."""
+        if not self._postings:
+            return
+        terms = sorted(self._postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(self._postings[term]) for term in terms], out=indptr[1:])
+        postings = np.array([p for term in terms for p in self._postings[term]], dtype=np.int32).reshape(-1, 2)
+        run_path = f"{self.path}.run{len(self._runs)}.npz"
+        np.savez(run_path, terms=np.array(terms, dtype=str), indptr=indptr,
+                 doc_idx=postings[:, 0], tf=postings[:, 1].astype(np.float32))
+        self._runs.append(run_path)
+        self._postings = {}
+        self._pending_docs = 0
+
+    def _merge_runs(self):
+        """Gộp các file run thành 1 CSR. Run theo thứ tự chunk -> sort ổn định giữ doc_idx tăng dần trong mỗi term."""
+        runs = [np.load(run_path) for run_path in self._runs]
+        if not runs:
+            return np.array([], dtype=str), np.zeros(1, dtype=np.int64), np.array([], dtype=np.int32), np.array([], dtype=np.float32)
+        terms = np.unique(np.concatenate([run["terms"] for run in runs]))
+        term_ids, doc_idx, tfs = [], [], []
+        for run in runs:
+            ids = np.searchsorted(terms, run["terms"])
+            term_ids.append(np.repeat(ids, np.diff(run["indptr"])))
+            doc_idx.append(run["doc_idx"])
+            tfs.append(run["tf"])
+        term_ids = np.concatenate(term_ids)
+        order = np.argsort(term_ids, kind="stable")
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=indptr[1:])
+        return terms, indptr, np.concatenate(doc_idx)[order], np.concatenate(tfs)[order]
+
+    def save(self):
+        self._spill()
+        terms, indptr, doc_idx, tfs = self._merge_runs()
+
+        self._docs_file.close()
+        os.replace(f"{self.docs_path}.tmp", self.docs_path)
+        with open(f"{self.docs_path}.idx.tmp", "w", encoding="utf-8") as f:
+            json.dump(self._offsets.tolist(), f)
+        os.replace(f"{self.docs_path}.idx.tmp", f"{self.docs_path}.idx")
+
+        np.savez(
+            self.path,
+            terms=terms,
+            indptr=indptr,
+            doc_idx=doc_idx,
+            tf=tfs,
+            doc_len=np.array(self._doc_len, dtype=np.float32),
+            sources=np.array(self._sources, dtype=str),
+        )
+        for run_path in self._runs:
+            os.remove(run_path)
+        print(f"Saved sparse index: {len(self._doc_len)} chunks, {len(terms)} terms "
+              f"({len(self._runs)} run) -> {self.path}")
+        self._runs = []
+
+
+class SparseIndex:
+    """
+    Index BM25 (Okapi) trên chunk, chạy hoàn toàn trong RAM bằng NumPy.
+    Bắt được tên thực phẩm, mã số, thuật ngữ dinh dưỡng chính xác mà embedding MiniLM hay bỏ sót.
+    """
+    def __init__(self, terms, indptr, doc_idx, tf, doc_len, docs: PageStore, k1: float = 1.5, b: float = 0.75,
+                 sources: Optional[np.ndarray] = None):
+        self.vocab = {term: i for i, term in enumerate(terms.tolist())}
+        self.indptr = indptr
+        self.doc_idx = doc_idx
+        self.tf = tf
+        self.doc_len = doc_len
+        self.docs = docs
+        # Source của từng chunk (None = index cũ, lọc source bằng cách đọc payload)
+        self.sources = sources
+        self.k1, self.b = k1, b
+        n_docs = len(doc_len)
+        df = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        # Phần mẫu số BM25 chỉ phụ thuộc độ dài chunk -> tính sẵn
+        avg_len = float(doc_len.mean()) if n_docs else 1.0
+        self._norm = k1 * (1 - b + b * doc_len / max(avg_len, 1e-6))
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SparseIndex"]:
+        docs = PageStore(f"{path}.docs.jsonl")
+        if not os.path.exists(path) or not docs.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            sources = data["sources"] if "sources" in data.files else None
+            return cls(data["terms"], data["indptr"], data["doc_idx"], data["tf"], data["doc_len"], docs,
+                       sources=sources)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.doc_len), dtype=np.float32)
+        for term in set(tokenize_vi(query)):
+            i = self.vocab.get(term)
+            if i is None:
+                continue
+            start, end = self.indptr[i], self.indptr[i + 1]
+            docs, tf = self.doc_idx[start:end], self.tf[start:end]
+            scores[docs] += self.idf[i] * tf * (self.k1 + 1) / (tf + self._norm[docs])
+        return scores
+
+    def search(self, query: str, k: int = 10,
+               row_filter: Optional[Callable[[LangChainDocument], bool]] = None,
+               sources: Optional[Sequence[str]] = None) -> List[Tuple[LangChainDocument, float]]:
+        scores = self.scores(query)
+        if sources:
+            if self.sources is not None:
+                scores[~np.isin(self.sources, list(sources))] = 0
+            else:
+                allowed, base_filter = set(sources), row_filter
+                row_filter = lambda doc: doc.metadata.get("source") in allowed and (base_filter is None or base_filter(doc))
+        candidates = np.flatnonzero(scores > 0)
+        if not len(candidates):
+            return []
+        # Chỉ sort phần đầu (argpartition); có filter thì lấy dư, thiếu mới sort toàn bộ
+        fetch = k if row_filter is None else k * 8
+        if len(candidates) > fetch:
+            top = candidates[np.argpartition(-scores[candidates], fetch - 1)[:fetch]]
+            order = top[np.argsort(-scores[top])]
+            if row_filter is not None:
+                rest = np.setdiff1d(candidates, top)
+                order = np.concatenate([order, rest[np.argsort(-scores[rest])]])
+        else:
+            order = candidates[np.argsort(-scores[candidates])]
+        results = []
+        for idx in order:
+            doc = self.docs.get(int(idx))
+            if row_filter is None or row_filter(doc):
+                results.append((doc, float(scores[idx])))
+                if len(results) == k:
+                    break
+        return results